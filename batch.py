@@ -0,0 +1,106 @@
+import json
+import time
+import fnmatch
+from collections import Counter
+from settings import *
+
+
+# exit codes of a run
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_INCOMPLETE = 2
+
+
+class BatchPlan:
+    """
+    Answers of all the prompts for unattended runs, from the command line and a run plan json file:
+    {"files": ["contacts.xlsx", "leads_*.csv"], "write_back": true, "login_timeout_secs": 300, "summary_file": "reports/summary.json"}
+    """
+    def __init__(self) -> None:
+        self.enabled = False
+        self.files = None
+        self.write_back = True
+        self.login_timeout_secs = 300.0
+        self.summary_file = None
+        self.options = {}
+
+    def load(self, path=None, **overrides):
+        """Enables the batch mode, the overrides which aren't None win over the plan file"""
+        plan = {}
+        if path is not None:
+            with open(path, "r", encoding="utf-8") as f:
+                plan = json.load(f)
+            if not isinstance(plan, dict):
+                raise Exception(f"Run plan {path} must be a json object")
+        plan.update({key: value for key, value in overrides.items() if value is not None})
+        self.enabled = True
+        self.files = plan.pop("files", None)
+        self.write_back = bool(plan.pop("write_back", True))
+        self.login_timeout_secs = float(plan.pop("login_timeout_secs", 300))
+        self.summary_file = plan.pop("summary_file", None)
+        # the command line options set in the plan: workers, invisible, ...
+        self.options = plan
+        return self
+
+    def answer(self, key, subject=None):
+        if key=="process_file":
+            return self.files is None or any(fnmatch.fnmatch(subject, pattern) for pattern in self.files)
+        if key=="write_back":
+            return self.write_back
+        return False
+
+
+batch_plan = BatchPlan()
+
+
+class RunSummary:
+    """Machine readable outcome of a run: the statuses of the rows of every file and the exit code"""
+    def __init__(self) -> None:
+        self.started_at = time.time()
+        self.finished_at = None
+        self.logged_in = False
+        self.files = {}
+        self.errors = []
+        self.failed = None
+
+    def add_file(self, filename, statuses):
+        self.files.setdefault(str(filename), Counter()).update(statuses)
+
+    def add_error(self, error):
+        self.errors.append(str(error))
+
+    def fail(self, reason):
+        self.failed = str(reason)
+
+    def totals(self):
+        totals = Counter()
+        for statuses in self.files.values():
+            totals.update(statuses)
+        return totals
+
+    def exit_code(self):
+        if self.failed is not None or not self.logged_in:
+            return EXIT_FAILED
+        totals = self.totals()
+        if len(self.errors)>0 or totals["Fail"]>0 or totals["Unknown"]>0 or totals["Pending"]>0 or totals["Unconfirmed"]>0 or totals["In Flight"]>0:
+            return EXIT_INCOMPLETE
+        return EXIT_OK
+
+    def to_dict(self):
+        finished_at = self.finished_at or time.time()
+        return {
+            "exit_code": self.exit_code(),
+            "logged_in": self.logged_in,
+            "failed": self.failed,
+            "errors": self.errors,
+            "elapsed_secs": finished_at - self.started_at,
+            "totals": dict(self.totals()),
+            "files": {filename: dict(statuses) for filename, statuses in self.files.items()},
+        }
+
+    def write(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        print(f"Run summary written to {path}")
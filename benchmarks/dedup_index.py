@@ -0,0 +1,72 @@
+# benchmark of the batch-wide dedup index on synthetic contacts
+# run from the project folder: python benchmarks/dedup_index.py
+
+import sys
+import time
+import argparse
+import psutil
+import numpy as np
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dedup import build_dedup_index
+from settings import CONTACT_NUMBER_COLUMN_NAME
+
+
+class SyntheticContactSource:
+    """Local 10 digit numbers spread over a few sheets, about a tenth of them repeated"""
+    def __init__(self, name, rows, sheets=4, duplicate_ratio=0.1, seed=0) -> None:
+        self.name = name
+        self.rows_per_sheet = rows // sheets
+        self.sheet_names = [f"Sheet{i+1}" for i in range(sheets)]
+        rng = np.random.default_rng(seed)
+        unique = int(rows * (1 - duplicate_ratio))
+        numbers = rng.choice(9 * 10**9, size=unique, replace=False) + 10**9
+        numbers = np.concatenate([numbers, rng.choice(numbers, size=rows - unique)])
+        rng.shuffle(numbers)
+        self.numbers = numbers
+
+    def sheets(self):
+        return self.sheet_names
+
+    def columns(self, sheet):
+        return [CONTACT_NUMBER_COLUMN_NAME]
+
+    def rows(self, sheet):
+        start = self.sheet_names.index(sheet) * self.rows_per_sheet
+        for idx in range(self.rows_per_sheet):
+            yield idx, {CONTACT_NUMBER_COLUMN_NAME: int(self.numbers[start + idx])}
+
+
+def run(backend, source, lookups):
+    process = psutil.Process()
+    rss_before = process.memory_info().rss
+    start_time = time.time()
+    index = build_dedup_index([source], backend=backend)
+    build_secs = time.time() - start_time
+    rss_after = process.memory_info().rss
+    probes = [f"+91{number}" for number in source.numbers[:lookups]]
+    start_time = time.time()
+    duplicates = sum(1 for number in probes if index.first(number) is not None)
+    lookup_secs = time.time() - start_time
+    unique = len(index)
+    index.close()
+    print(f"""Dedup index '{backend}':
+                          Rows: {len(source.numbers)}
+                          Unique numbers: {unique}
+                          Build: {build_secs} seconds ({len(source.numbers)/build_secs} rows/sec)
+                          Lookups: {lookups/lookup_secs} /sec ({duplicates} found)
+                          RSS growth: {(rss_after - rss_before)/2**20} MiB""")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build and lookup time of the dedup index backends")
+    parser.add_argument("-r", "--rows", type=int, default=1000000, help="Synthetic rows, default: 1000000")
+    parser.add_argument("-l", "--lookups", type=int, default=100000, help="Lookups to time, default: 100000")
+    parser.add_argument("-b", "--backend", choices=["memory", "disk"], action="append", help="Backend, default: both")
+    args = parser.parse_args()
+
+    source = SyntheticContactSource("synthetic.xlsx", args.rows)
+    for backend in args.backend or ["memory", "disk"]:
+        run(backend, source, min(args.lookups, args.rows))
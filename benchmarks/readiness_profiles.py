@@ -0,0 +1,77 @@
+# benchmark of the page readiness profiles against a local stand-in page
+# run from the project folder: python benchmarks/readiness_profiles.py
+
+import sys
+import time
+import argparse
+import threading
+import numpy as np
+from pathlib import Path
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from main import WhatsAppSendMsg
+from settings import LOGIN_TITLE
+
+
+STAND_IN_PAGE = f"""<!DOCTYPE html>
+<html>
+<head><title>{LOGIN_TITLE}</title></head>
+<body>
+<div id="app">
+    <div id="main" style="height: 5000px">
+        <footer><div title="Type a message" contenteditable="true"></div></footer>
+    </div>
+</div>
+</body>
+</html>
+""".encode("utf-8")
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(STAND_IN_PAGE)))
+        self.end_headers()
+        self.wfile.write(STAND_IN_PAGE)
+
+    def log_message(self, *args):
+        pass
+
+
+def measure(wp, url, profile, rows):
+    durations = []
+    for _ in range(rows):
+        start_time = time.time()
+        if not wp.get_page(url, LOGIN_TITLE, profile=profile):
+            raise Exception(f"Stand-in page isn't ready with profile '{profile}'")
+        durations.append(time.time() - start_time)
+    return durations
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-row page readiness time by profile")
+    parser.add_argument("-r", "--rows", type=int, default=20, help="Page loads per profile, default: 20")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:%d/send" % server.server_address[1]
+
+    wp = WhatsAppSendMsg(invisible=True)
+    try:
+        wp.config_browser()
+        results = {profile: measure(wp, url, profile, args.rows) for profile in ("default", "send")}
+    finally:
+        wp.kill_browser_process()
+        server.shutdown()
+
+    for profile, durations in results.items():
+        print(f"""Profile '{profile}' per-row readiness:
+                          Max: {max(durations)}
+                          Min: {min(durations)}
+                          Avg: {np.average(durations)}""")
+    saved = np.average(results["default"]) - np.average(results["send"])
+    print(f"Saved per row by the 'send' profile: {saved} seconds")
@@ -0,0 +1,284 @@
+# end-to-end throughput of the send loop against the local stand-in of WhatsApp Web
+# run from the project folder: python benchmarks/send_throughput.py --rows 1000 10000 100000
+# compare with a previous version: python benchmarks/send_throughput.py --compare reports/benchmarks/send_throughput-1.0.7-....json
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+import urllib.request
+from pathlib import Path
+from contextlib import redirect_stdout, nullcontext
+import psutil
+from openpyxl import Workbook
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main
+from main import WhatsAppSendMsg, SheetSender, iter_validated_rows, iter_chunks, validate_sheet_columns
+from batch import batch_plan
+from contacts import open_contact_source, StatusWriter
+from validation import ContactValidator
+from templates import MessageTemplate
+from pipeline import SendPipeline
+from metrics import span_recorder
+from delivery import DeliveryReconciler
+from standin import StandInServer
+from settings import *
+
+
+RESULTS_DIR = REPORTS_DIR / "benchmarks"
+BENCHMARK_IMAGE = "_benchmark.png"
+# 1x1 png
+BENCHMARK_IMAGE_BYTES = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000001e221bc330000000049454e44ae426082"
+)
+
+
+def make_workbook(path, rows, image_ratio=0.0):
+    """Contact workbook with distinct local numbers, every 1/image_ratio row has an image"""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Sheet1")
+    ws.append([CONTACT_NUMBER_COLUMN_NAME, CONTACT_NAME_COLUMN_NAME, IMAGE_NAME_COLUMN_NAME, STATUS_COLUMN_NAME])
+    every = round(1 / image_ratio) if image_ratio>0 else 0
+    for i in range(rows):
+        image_name = BENCHMARK_IMAGE if every>0 and i % every==0 else None
+        ws.append([str(9000000000 + i), f"Contact {i}", image_name, None])
+    wb.save(path)
+
+
+def serve_stand_in(conn, options):
+    # in its own process, so its memory isn't counted with the sender's
+    server = StandInServer(**options)
+    conn.send(server.url)
+    server.server.serve_forever()
+
+
+class PeakRss:
+    """Peak resident memory of this process and of the browser processes it launched, sampled in the background"""
+    def __init__(self, exclude=(), interval=0.05) -> None:
+        self.process = psutil.Process()
+        self.exclude = set(exclude)
+        self.interval = interval
+        self.peak = 0
+        self.peak_children = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            children = 0
+            for child in self.process.children(recursive=True):
+                if child.pid in self.exclude:
+                    continue
+                try:
+                    children += child.memory_info().rss
+                except psutil.Error:
+                    pass
+            self.peak_children = max(self.peak_children, children)
+            self.stopped.wait(self.interval)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stopped.set()
+        self.thread.join()
+
+
+def stand_in_stats(url):
+    with urllib.request.urlopen(f"{url}/stats", timeout=10) as response:
+        return json.loads(response.read())
+
+
+def run_size(wp, message_template, path, write_back):
+    """Sends all the rows of the workbook like start_sending_msg does, without the ledger and the rate limiter"""
+    source = open_contact_source(path)
+    status_writer = StatusWriter(source)
+    validator = ContactValidator(source.name)
+    pipeline = SendPipeline()
+    batch_plan.write_back = write_back
+    span_recorder.reset()
+    for sheet in source.sheets():
+        validate_sheet_columns(source.columns(sheet), source.name)
+        # the stages of start_sending_msg, without the ledger and the rate limiter
+        stages = SheetSender(wp, message_template, status_writer, source.name, sheet)
+        for _, _, chunk in iter_chunks(source.rows(sheet), source.count(sheet), sheet):
+            errors = pipeline.run(iter_validated_rows(validator, sheet, chunk, wp.attachment_mode), stages.prepare, stages.send, stages.write, stages.flush)
+            for idx, *_ in errors:
+                status_writer.update(sheet, idx, "Fail")
+            if write_back:
+                status_writer.flush()
+    if write_back:
+        status_writer.flush(final=True)
+    validator.close()
+    source.close()
+    return status_writer.counts, pipeline.stats()
+
+
+def benchmark(args, url, stand_in_pid):
+    main.BROWSER_DRIVER = args.driver
+    main.STAND_IN_URL = url
+    if args.driver=="selenium":
+        # chrome loads the stand-in pages themselves
+        main.LOGIN_URL = url
+        main.SEND_URL = f"{url}/send?phone=%s&%s"
+        main.WARM_SEND_URL = f"{url}/send?phone=%s&%s"
+    batch_plan.enabled = True
+    span_recorder.path = None
+    message_template = MessageTemplate("Hi {contact_name}, this is a benchmark message")
+    results = []
+    with tempfile.TemporaryDirectory(prefix="send-throughput-") as tmp_dir:
+        wp = WhatsAppSendMsg(invisible=args.invisible)
+        # the clipboard is shared with everything else running, images are uploaded instead
+        wp.attachment_mode = "file_input"
+        wp.warm_session = args.warm_session
+        wp.reconciler = DeliveryReconciler(wp.delivery, args.max_unconfirmed) if args.max_unconfirmed>0 else None
+        try:
+            if not wp.setup_session():
+                raise Exception("Couldn't log in to the stand-in")
+            for rows in args.rows:
+                path = Path(tmp_dir) / f"benchmark-{rows}.xlsx"
+                start_time = time.time()
+                make_workbook(path, rows, args.image_ratio)
+                workbook_secs = time.time() - start_time
+                stats_before = stand_in_stats(url)
+                print(f"Sending {rows} rows...")
+                with PeakRss(exclude=[stand_in_pid]) as rss:
+                    start_time = time.time()
+                    with redirect_stdout(open(os.devnull, "w")) if not args.verbose else nullcontext():
+                        statuses, pipeline_stats = run_size(wp, message_template, path, not args.no_write_back)
+                    elapsed = time.time() - start_time
+                stats_after = stand_in_stats(url)
+                sent = stats_after["sent"] - stats_before["sent"]
+                result = {
+                    "rows": rows,
+                    "elapsed_secs": elapsed,
+                    "msgs_per_sec": sent / elapsed if elapsed>0 else None,
+                    "rows_per_sec": rows / elapsed if elapsed>0 else None,
+                    "sent": sent,
+                    "statuses": dict(statuses),
+                    "stages": span_recorder.stats(),
+                    "pipeline": pipeline_stats,
+                    "peak_rss_mib": rss.peak / 2**20,
+                    "peak_browser_rss_mib": rss.peak_children / 2**20,
+                    "workbook_secs": workbook_secs,
+                    "stand_in": {key: stats_after[key] - stats_before.get(key, 0) for key in stats_after},
+                }
+                results.append(result)
+                report(result)
+        finally:
+            wp.kill_browser_process()
+            image_path = MESSAGE_IMAGE_DIR / BENCHMARK_IMAGE
+            if image_path.exists():
+                image_path.unlink()
+    return results
+
+
+def report(result):
+    print(f"""Send throughput of {result["rows"]} rows:
+                          Elapsed: {result["elapsed_secs"]} seconds
+                          Msgs/sec: {result["msgs_per_sec"]}
+                          Statuses: {result["statuses"]}
+                          Peak RSS: {result["peak_rss_mib"]} MiB
+                          Peak browser RSS: {result["peak_browser_rss_mib"]} MiB""")
+    for stage, stats in sorted(result["stages"].items()):
+        print(f"""Stage '{stage}':
+                          P50: {stats["p50"]}
+                          P95: {stats["p95"]}
+                          P99: {stats["p99"]}""")
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(results, previous_path):
+    with open(previous_path, "r", encoding="utf-8") as f:
+        previous = json.load(f)
+    by_rows = {result["rows"]: result for result in previous["results"]}
+    print(f"Compared with version {previous['version']} ({previous.get('commit') or '-'}) of {previous['started_at']}:")
+    for result in results:
+        before = by_rows.get(result["rows"])
+        if before is None or not before["msgs_per_sec"] or not result["msgs_per_sec"]:
+            print(f"                          {result['rows']} rows: nothing to compare with")
+            continue
+        change = (result["msgs_per_sec"] / before["msgs_per_sec"] - 1) * 100
+        print(f"                          {result['rows']} rows: {before['msgs_per_sec']} -> {result['msgs_per_sec']} msgs/sec ({change:+.1f}%)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Messages sent per second by the send loop against the WhatsApp Web stand-in")
+    parser.add_argument("-r", "--rows", type=int, nargs="+", default=[1000], help="Rows of the synthetic workbooks, default: 1000")
+    parser.add_argument("--driver", choices=["stand_in", "selenium"], default="stand_in", help="stand_in: without a browser, selenium: chrome on the stand-in pages, default: stand_in")
+    parser.add_argument("--image-ratio", type=float, default=0.0, help="Share of the rows with an image, default: 0")
+    parser.add_argument("--page-latency", type=float, default=0.0, help="Seconds the stand-in takes to load a page, default: 0")
+    parser.add_argument("--send-latency", type=float, default=0.0, help="Seconds the stand-in takes to accept a message, default: 0")
+    parser.add_argument("--pending-secs", type=float, default=0.2, help="Seconds a message stays pending, default: 0.2")
+    parser.add_argument("--delivered-secs", type=float, default=1.0, help="Seconds after sending a message is delivered, default: 1")
+    parser.add_argument("--read-secs", type=float, default=None, help="Seconds after sending a message is read, default: never")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of the chats without a send button, default: 0")
+    parser.add_argument("--max-unconfirmed", type=int, default=MAX_UNCONFIRMED_MESSAGES, help=f"Messages sent but not confirmed yet, default: {MAX_UNCONFIRMED_MESSAGES}")
+    parser.add_argument("--warm-session", action="store_true", help="Open the next chat in-page instead of reloading the stand-in")
+    parser.add_argument("--no-write-back", action="store_true", help="Don't write the statuses back to the workbooks")
+    parser.add_argument("--invisible", action="store_true", help="Headless chrome with --driver selenium")
+    parser.add_argument("--verbose", action="store_true", help="Print the logs of every row")
+    parser.add_argument("-o", "--output", type=Path, help="Results json, default: reports/benchmarks/send_throughput-<version>-<time>.json")
+    parser.add_argument("--compare", type=Path, help="Results json of a previous run to compare with")
+    args = parser.parse_args()
+
+    if args.image_ratio>0:
+        MESSAGE_IMAGE_DIR.mkdir(parents=True, exist_ok=True)
+        (MESSAGE_IMAGE_DIR / BENCHMARK_IMAGE).write_bytes(BENCHMARK_IMAGE_BYTES)
+
+    options = dict(
+        page_latency=args.page_latency, send_latency=args.send_latency,
+        pending_secs=args.pending_secs, delivered_secs=args.delivered_secs, read_secs=args.read_secs,
+        failure_rate=args.failure_rate,
+    )
+    parent_conn, child_conn = multiprocessing.Pipe()
+    stand_in = multiprocessing.Process(target=serve_stand_in, args=(child_conn, options), daemon=True)
+    stand_in.start()
+    url = parent_conn.recv()
+    started_at = time.strftime("%Y-%m-%d %H:%M:%S")
+    try:
+        results = benchmark(args, url, stand_in.pid)
+    finally:
+        stand_in.terminate()
+        stand_in.join()
+
+    output = args.output or RESULTS_DIR / f"send_throughput-{VERSION}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "version": VERSION,
+            "commit": git_commit(),
+            "started_at": started_at,
+            "driver": args.driver,
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "chunk_size": CHUNK_SIZE,
+            "pipeline_depth": PIPELINE_DEPTH,
+            "max_unconfirmed": args.max_unconfirmed,
+            "stand_in": options,
+            "image_ratio": args.image_ratio,
+            "write_back": not args.no_write_back,
+            "results": results,
+        }, f, indent=2)
+    print(f"Results: {output}")
+    if args.compare is not None:
+        compare(results, args.compare)
@@ -0,0 +1,426 @@
+import os
+import csv
+import json
+import codecs
+import shutil
+import sqlite3
+import time
+import tempfile
+import threading
+from pathlib import Path
+from contextlib import suppress
+from collections import Counter
+from copy import copy
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from utils import confirmation_input
+from settings import *
+
+
+class ContactSource:
+    """
+    A file of contacts with one or more sheets, the same column names from the settings are used for all of them.
+    The rows are yielded as (index, {column: value}), the index identifies the row when writing the statuses back.
+    """
+    def __init__(self, path) -> None:
+        self.path = path
+        self.name = path.name
+        self._snapshot_path = None
+
+    def sheets(self):
+        raise NotImplementedError
+
+    def columns(self, sheet):
+        raise NotImplementedError
+
+    def count(self, sheet):
+        return None
+
+    def rows(self, sheet):
+        raise NotImplementedError
+
+    def write_statuses(self, statuses):
+        """Writes {sheet: {index: status}} back to the source"""
+        raise NotImplementedError
+
+    def finish_statuses(self):
+        """Called once all the statuses are written, returns the number of rows written back by it"""
+        return 0
+
+    def snapshot(self):
+        """
+        Copy of the file the rows are read from, so the original isn't kept open
+        (and locked on windows) while the statuses are written back to it.
+        """
+        if self._snapshot_path is None:
+            fd, snapshot_path = tempfile.mkstemp(prefix="contacts-", suffix=self.path.suffix)
+            os.close(fd)
+            shutil.copyfile(self.path, snapshot_path)
+            self._snapshot_path = Path(snapshot_path)
+        return self._snapshot_path
+
+    def replace_with(self, tmp_path):
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        if self._snapshot_path is not None:
+            with suppress(OSError):
+                self._snapshot_path.unlink()
+            self._snapshot_path = None
+
+
+class XlsxContactSource(ContactSource):
+    """
+    Reads the contacts of a workbook lazily, row by row, with openpyxl read-only mode,
+    so the memory used doesn't grow with the size of the sheets.
+    The statuses are appended to a side file while sending and merged into the workbook in a single pass at the end.
+    """
+    def __init__(self, path) -> None:
+        super().__init__(path)
+        self.statuses_path = path.with_name(f"{path.name}.statuses.jsonl")
+        self._layout = None
+
+    def layout(self):
+        """{sheet: (columns, count)} of the workbook, read once"""
+        if self._layout is None:
+            wb = load_workbook(self.path, read_only=True)
+            try:
+                self._layout = {}
+                for sheet in wb.sheetnames:
+                    header = next(wb[sheet].iter_rows(min_row=1, max_row=1, values_only=True), ())
+                    max_row = wb[sheet].max_row
+                    self._layout[sheet] = (
+                        [column for column in header if column is not None],
+                        None if max_row is None else max(max_row - 1, 0)
+                    )
+            finally:
+                wb.close()
+        return self._layout
+
+    def sheets(self):
+        return list(self.layout())
+
+    def columns(self, sheet):
+        return self.layout()[sheet][0]
+
+    def count(self, sheet):
+        return self.layout()[sheet][1]
+
+    def rows(self, sheet):
+        wb = load_workbook(self.snapshot(), read_only=True)
+        try:
+            header = None
+            for i, values in enumerate(wb[sheet].iter_rows(values_only=True)):
+                if header is None:
+                    header = values
+                    continue
+                yield i - 1, {column: value for column, value in zip(header, values) if column is not None}
+        finally:
+            wb.close()
+
+    def write_statuses(self, statuses):
+        # rewriting the workbook every status_write_interval_secs would cost as much as the sheets are big
+        with open(self.statuses_path, "a", encoding="utf-8") as f:
+            for sheet, sheet_statuses in statuses.items():
+                for idx, status in sheet_statuses.items():
+                    f.write(json.dumps([sheet, idx, status]) + "\n")
+
+    def read_statuses(self):
+        """{sheet: {index: status}} of the side file, the statuses left by a run which didn't finish included"""
+        statuses = {}
+        if self.statuses_path.exists():
+            with open(self.statuses_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    with suppress(ValueError):
+                        sheet, idx, status = json.loads(line)
+                        statuses.setdefault(sheet, {})[idx] = status
+        return statuses
+
+    @staticmethod
+    def copy_cell(ws, cell, value):
+        new_cell = WriteOnlyCell(ws, value=value)
+        # the empty cells of a read-only row have no style
+        if getattr(cell, "has_style", False):
+            new_cell.font = copy(cell.font)
+            new_cell.fill = copy(cell.fill)
+            new_cell.border = copy(cell.border)
+            new_cell.alignment = copy(cell.alignment)
+            new_cell.protection = copy(cell.protection)
+            new_cell.number_format = cell.number_format
+        return new_cell
+
+    def finish_statuses(self):
+        statuses = self.read_statuses()
+        if len(statuses)==0:
+            return 0
+        # streamed from a read-only workbook to a write-only one, the cell styles are copied
+        # but the column widths, merged cells and the like aren't kept
+        src = load_workbook(self.path, read_only=True)
+        dst = Workbook(write_only=True)
+        tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+        try:
+            for sheet in src.sheetnames:
+                ws = dst.create_sheet(sheet)
+                sheet_statuses = statuses.get(sheet, {})
+                status_col = None
+                for i, row in enumerate(src[sheet].iter_rows()):
+                    if i==0:
+                        header = [cell.value for cell in row]
+                        status_col = header.index(STATUS_COLUMN_NAME) if STATUS_COLUMN_NAME in header else None
+                    # idx 0 is the row below the header
+                    status = sheet_statuses.get(i - 1) if i>0 and status_col is not None else None
+                    cells = [self.copy_cell(ws, cell, cell.value) for cell in row]
+                    if status is not None:
+                        cells.extend(WriteOnlyCell(ws) for _ in range(status_col + 1 - len(cells)))
+                        cells[status_col] = self.copy_cell(ws, row[status_col], status) if status_col<len(row) else WriteOnlyCell(ws, value=status)
+                    ws.append(cells)
+            dst.save(tmp_path)
+        finally:
+            src.close()
+        self.replace_with(tmp_path)
+        self.statuses_path.unlink()
+        return sum(map(len, statuses.values()))
+
+
+class CsvContactSource(ContactSource):
+    """A csv file is a single sheet named after the file"""
+    encoding = "utf-8-sig"
+
+    def sheets(self):
+        return [self.path.stem]
+
+    def columns(self, sheet):
+        with open(self.path, "r", encoding=self.encoding, newline="") as f:
+            return next(csv.reader(f), [])
+
+    def rows(self, sheet):
+        with open(self.snapshot(), "r", encoding=self.encoding, newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader, [])
+            # the rows are counted like write_statuses does, blank lines included
+            for i, row in enumerate(reader):
+                if len(row)==0:
+                    continue
+                row.extend([""] * (len(header) - len(row)))
+                # empty cells are read as empty strings
+                yield i, {column: (None if value=="" else value) for column, value in zip(header, row)}
+
+    def write_statuses(self, statuses):
+        sheet_statuses = statuses.get(self.path.stem, {})
+        tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+        with open(self.path, "rb") as f:
+            # the byte order mark is only written back if the file had one
+            out_encoding = self.encoding if f.read(3)==codecs.BOM_UTF8 else "utf-8"
+        with open(self.path, "r", encoding=self.encoding, newline="") as src, \
+            open(tmp_path, "w", encoding=out_encoding, newline="") as dst:
+            reader = csv.reader(src)
+            writer = csv.writer(dst)
+            header = next(reader, None)
+            if header is None:
+                return
+            writer.writerow(header)
+            status_col = header.index(STATUS_COLUMN_NAME) if STATUS_COLUMN_NAME in header else None
+            for i, row in enumerate(reader):
+                if status_col is not None and i in sheet_statuses:
+                    row.extend([""] * (status_col + 1 - len(row)))
+                    row[status_col] = sheet_statuses[i]
+                writer.writerow(row)
+        self.replace_with(tmp_path)
+
+
+class ParquetContactSource(ContactSource):
+    """A parquet file is a single sheet named after the file, it's read in record batches"""
+    batch_size = 10000
+
+    def __init__(self, path) -> None:
+        super().__init__(path)
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            raise Exception(f"{self.name} can't be read, parquet contacts need pyarrow: pip install pyarrow")
+        self.pq = pyarrow.parquet
+
+    def sheets(self):
+        return [self.path.stem]
+
+    def columns(self, sheet):
+        return list(self.pq.ParquetFile(self.path).schema_arrow.names)
+
+    def count(self, sheet):
+        return self.pq.ParquetFile(self.path).metadata.num_rows
+
+    def rows(self, sheet):
+        i = 0
+        for batch in self.pq.ParquetFile(self.snapshot()).iter_batches(batch_size=self.batch_size):
+            for row in batch.to_pylist():
+                yield i, row
+                i += 1
+
+    def write_statuses(self, statuses):
+        # parquet files are immutable, the status column is replaced and the file rewritten
+        import pyarrow as pa
+        sheet_statuses = statuses.get(self.path.stem, {})
+        table = self.pq.read_table(self.path)
+        status_idx = table.schema.get_field_index(STATUS_COLUMN_NAME)
+        if status_idx<0:
+            return
+        status_values = table.column(status_idx).to_pylist()
+        for i, status in sheet_statuses.items():
+            status_values[i] = status
+        table = table.set_column(status_idx, pa.field(STATUS_COLUMN_NAME, pa.string()), pa.array(
+            [None if value is None else str(value) for value in status_values], type=pa.string()
+        ))
+        tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+        self.pq.write_table(table, tmp_path)
+        self.replace_with(tmp_path)
+
+
+class SqliteContactSource(ContactSource):
+    """
+    Every table of the database is a sheet and the rowid is the row index,
+    so the statuses are updated in place.
+    """
+    page_size = 1000
+
+    def __init__(self, path) -> None:
+        super().__init__(path)
+        # the statuses are written from the background thread of StatusWriter, one statement at a time
+        self.connection = sqlite3.connect(str(path), check_same_thread=False)
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def quote(identifier):
+        return '"%s"' % str(identifier).replace('"', '""')
+
+    def execute(self, sql, parameters=()):
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def sheets(self):
+        rows = self.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name")
+        return [name for name, in rows]
+
+    def columns(self, sheet):
+        return [row[1] for row in self.execute(f"PRAGMA table_info({self.quote(sheet)})")]
+
+    def count(self, sheet):
+        return self.execute(f"SELECT COUNT(*) FROM {self.quote(sheet)}")[0][0]
+
+    def rows(self, sheet):
+        # fetched page by page so no statement is left open while the statuses are updated
+        last_rowid = -1
+        while True:
+            with self.lock:
+                cursor = self.connection.execute(
+                    f"SELECT rowid, * FROM {self.quote(sheet)} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                    (last_rowid, self.page_size)
+                )
+                columns = [description[0] for description in cursor.description][1:]
+                page = cursor.fetchall()
+            if len(page)==0:
+                break
+            for row in page:
+                yield row[0], dict(zip(columns, row[1:]))
+            last_rowid = page[-1][0]
+
+    def write_statuses(self, statuses):
+        with self.lock, self.connection:
+            for sheet, sheet_statuses in statuses.items():
+                self.connection.executemany(
+                    f"UPDATE {self.quote(sheet)} SET {self.quote(STATUS_COLUMN_NAME)} = ? WHERE rowid = ?",
+                    [(status, idx) for idx, status in sheet_statuses.items()]
+                )
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+        super().close()
+
+
+CONTACT_SOURCES = {
+    ".xlsx": XlsxContactSource,
+    ".csv": CsvContactSource,
+    ".parquet": ParquetContactSource,
+    ".db": SqliteContactSource,
+    ".sqlite": SqliteContactSource,
+    ".sqlite3": SqliteContactSource,
+}
+
+
+def open_contact_source(path):
+    return CONTACT_SOURCES[path.suffix.lower()](path)
+
+
+class StatusWriter:
+    """
+    Keeps the statuses of the rows processed since the last write and writes them back to the source
+    on a background thread, every status_write_interval_secs at most and once at the end of the file
+    """
+    def __init__(self, source, interval=STATUS_WRITE_INTERVAL_SECS) -> None:
+        self.source = source
+        self.interval = interval
+        self.pending = {}
+        self.confirmed = None
+        self.counts = Counter()
+        self.lock = threading.Lock()
+        self.last_write = time.time()
+        # the write in progress
+        self.thread = None
+
+    def update(self, sheet, idx, status):
+        with self.lock:
+            self.pending.setdefault(sheet, {})[idx] = status
+            self.counts[status] += 1
+
+    def flush(self, final=False):
+        """Writes the statuses if the interval is over, waits for all of them to be written if final"""
+        if not final and (time.time() - self.last_write<self.interval or self.thread is not None and self.thread.is_alive()):
+            return
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if len(self.pending)==0:
+            # the statuses written in the background are merged into the source at the end
+            if final and self.confirmed:
+                self._finish()
+            return
+        if self.confirmed is None:
+            self.confirmed = confirmation_input(
+                f"\n###################### Please close '{self.source.name}' if it's opened anywhere. ######################\n"
+                "Statuses will be written back to it while sending. Closed?",
+                'N/y',
+                key="write_back",
+                subject=self.source.name
+            )
+        with self.lock:
+            statuses, self.pending = self.pending, {}
+        if not self.confirmed:
+            return
+        self.last_write = time.time()
+        if final:
+            self._write(statuses)
+            self._finish()
+        else:
+            self.thread = threading.Thread(target=self._write, args=(statuses,), daemon=True)
+            self.thread.start()
+
+    def _finish(self):
+        try:
+            count = self.source.finish_statuses()
+            if count>0:
+                print(f"Statuses of {count} rows merged into '{self.source.name}'")
+        except Exception as e:
+            print(f"StatusWriter.flush Error: couldn't write to '{self.source.name}': {e}")
+
+    def _write(self, statuses):
+        try:
+            self.source.write_statuses(statuses)
+            print(f"Statuses of {sum(map(len, statuses.values()))} rows written back to '{self.source.name}'")
+        except Exception as e:
+            # e.g. opened somewhere, the statuses are kept for the next write unless a row got a newer one
+            print(f"StatusWriter.flush Error: couldn't write to '{self.source.name}': {e}")
+            with self.lock:
+                for sheet, sheet_statuses in statuses.items():
+                    pending = self.pending.setdefault(sheet, {})
+                    for idx, status in sheet_statuses.items():
+                        pending.setdefault(idx, status)
@@ -0,0 +1,130 @@
+import time
+import sqlite3
+import threading
+from pathlib import Path
+from contextlib import suppress
+import pandas as pd
+from utils import chunker
+from validation import normalize_contact_numbers
+from settings import CONTACT_NUMBER_COLUMN_NAME, DEDUP_INDEX, DEDUP_INDEX_FILE
+
+
+class MemoryDedupIndex:
+    """First row of every contact number in a hash table, the row is packed in an int to keep it small"""
+    def __init__(self) -> None:
+        self.sheets = []
+        self.numbers = {}
+
+    def register(self, filename, sheet):
+        self.sheets.append((str(filename), str(sheet)))
+        return len(self.sheets) - 1
+
+    def add_many(self, sheet_id, rows):
+        """Adds (number, idx) rows of a registered sheet, the first row of a number is kept"""
+        setdefault = self.numbers.setdefault
+        for number, idx in rows:
+            setdefault(number, (sheet_id << 32) | int(idx))
+
+    def first(self, number):
+        packed = self.numbers.get(number)
+        if packed is None:
+            return None
+        filename, sheet = self.sheets[packed >> 32]
+        return filename, sheet, packed & 0xFFFFFFFF
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def close(self):
+        self.numbers = {}
+
+
+class DiskDedupIndex:
+    """
+    First row of every contact number in a sqlite table sorted by the number,
+    for lists too big to be held in memory.
+    """
+    def __init__(self, path=DEDUP_INDEX_FILE) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # it's rebuilt on every run
+        for p in (self.path, self.path.with_name(f"{self.path.name}-journal")):
+            if p.exists():
+                p.unlink()
+        # looked up by the validation of the rows on the preparer thread of the send pipeline
+        self.connection = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.lock = threading.Lock()
+        self.connection.execute("PRAGMA journal_mode=OFF")
+        self.connection.execute("PRAGMA synchronous=OFF")
+        self.connection.execute("CREATE TABLE sheets (id INTEGER PRIMARY KEY, filename TEXT, sheet TEXT)")
+        self.connection.execute(
+            "CREATE TABLE numbers (number TEXT PRIMARY KEY, sheet_id INTEGER, idx INTEGER) WITHOUT ROWID"
+        )
+
+    def register(self, filename, sheet):
+        with self.lock:
+            cursor = self.connection.execute("INSERT INTO sheets (filename, sheet) VALUES (?, ?)", (str(filename), str(sheet)))
+            return cursor.lastrowid
+
+    def add_many(self, sheet_id, rows):
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO numbers (number, sheet_id, idx) VALUES (?, ?, ?)",
+                ((number, sheet_id, int(idx)) for number, idx in rows)
+            )
+
+    def first(self, number):
+        with self.lock:
+            return self.connection.execute(
+                "SELECT sheets.filename, sheets.sheet, numbers.idx FROM numbers "
+                "JOIN sheets ON sheets.id = numbers.sheet_id WHERE numbers.number = ?",
+                (number,)
+            ).fetchone()
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM numbers").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+        with suppress(OSError):
+            self.path.unlink()
+
+
+def new_dedup_index(backend=DEDUP_INDEX):
+    if backend=="disk":
+        return DiskDedupIndex()
+    return MemoryDedupIndex()
+
+
+def build_dedup_index(sources, backend=DEDUP_INDEX, batch_size=10000, check=None):
+    """
+    Indexes the first row of every valid contact number of all the sources before anything is sent.
+    check(columns, filename) raises for the sheets which won't be sent, they don't own any number.
+    """
+    start_time = time.time()
+    index = new_dedup_index(backend)
+    total = 0
+    for source in sources:
+        for sheet in source.sheets():
+            columns = source.columns(sheet)
+            if CONTACT_NUMBER_COLUMN_NAME not in columns:
+                continue
+            if check is not None:
+                try:
+                    check(columns, source.name)
+                except Exception as e:
+                    print(f"Sheet '{sheet}' of {source.name} left out of the dedup index: {e}")
+                    continue
+            sheet_id = index.register(source.name, sheet)
+            for chunk in chunker(source.rows(sheet), batch_size):
+                numbers = pd.Series([r.get(CONTACT_NUMBER_COLUMN_NAME) for _, r in chunk], dtype=object)
+                normalized, reasons = normalize_contact_numbers(numbers)
+                valid = reasons.isna().to_numpy()
+                index.add_many(sheet_id, (
+                    (number, idx) for number, (idx, _), ok in zip(normalized.tolist(), chunk, valid) if ok
+                ))
+                total += len(chunk)
+    print(f"Dedup index ({backend}) of {len(index)} unique numbers out of {total} rows built in {time.time()-start_time} seconds")
+    return index
@@ -0,0 +1,338 @@
+import json
+import time
+import itertools
+from collections import Counter
+from metrics import StreamingHistogram
+from settings import *
+
+
+# states of an outgoing message, read from its status icon
+PENDING = "pending"
+SENT = "sent"
+DELIVERED = "delivered"
+READ = "read"
+FAILED = "failed"
+STATE_ORDER = {PENDING: 0, SENT: 1, DELIVERED: 2, READ: 3}
+
+# a message whose status icon was never seen, e.g. the page got reloaded, it's sent again in the next run
+UNCONFIRMED_STATUS = "Unconfirmed"
+# status column value of the final state
+STATE_STATUSES = {None: UNCONFIRMED_STATUS, PENDING: "Pending", SENT: "Sent", DELIVERED: "Delivered", READ: "Read", FAILED: "Fail"}
+# statuses of the rows whose message left the browser, Success is what was written before the delivery was tracked
+SENT_STATUSES = {"Success", "Sent", "Delivered", "Read"}
+# a row whose send button was clicked, its message is confirmed later, see max_unconfirmed_messages
+IN_FLIGHT_STATUS = "In Flight"
+# a message still pending at the deadline may go out later, it's never sent again
+KEEP_STATUSES = SENT_STATUSES | {"Pending", IN_FLIGHT_STATUS}
+
+# the exact aria-labels and data-icons of the status of a message, e.g. an unread badge or a presentation role don't count
+STATUS_LABELS = {"pending": PENDING, "sent": SENT, "delivered": DELIVERED, "read": READ, "failed": FAILED}
+STATUS_ICONS = {"msg-time": PENDING, "msg-check": SENT, "msg-dblcheck": DELIVERED, "msg-dblcheck-ack": READ, "msg-error": FAILED, "error": FAILED, "alert": FAILED}
+
+# follows the first outgoing message added to the opened chat from now on, call it before clicking send.
+# Once another chat is opened (OPEN_CHAT_SCRIPT marks them left) the message is followed in the chat list.
+ARM_SCRIPT = """
+    var id = arguments[0], phone = arguments[1];
+    if (!document.querySelector('#main')) return false;
+    var registry = window.__deliveries;
+    if (!registry) {
+        registry = window.__deliveries = {trackers: {}, listeners: []};
+        var order = {pending: 0, sent: 1, delivered: 2, read: 3};
+        var labels = __STATUS_LABELS__, icons = __STATUS_ICONS__;
+        var stateOf = function(el) {
+            var states = [];
+            el.querySelectorAll('[aria-label]').forEach(function(item) {
+                var label = item.getAttribute('aria-label').trim().toLowerCase();
+                if (labels.hasOwnProperty(label)) states.push(labels[label]);
+            });
+            el.querySelectorAll('[data-icon]').forEach(function(item) {
+                var icon = item.getAttribute('data-icon');
+                if (icons.hasOwnProperty(icon)) states.push(icons[icon]);
+            });
+            if (states.indexOf('failed') !== -1) return 'failed';
+            var state = null;
+            states.forEach(function(item) { if (state === null || order[item] > order[state]) state = item; });
+            return state;
+        };
+        // the row of the chat in the chat list, titled with the name of a saved contact or the number of the others
+        var chatRow = function(tracker) {
+            var titled = document.querySelectorAll('#pane-side [title]');
+            for (var i = 0; i < titled.length; i++) {
+                var title = titled[i].getAttribute('title');
+                if ((tracker.title && title === tracker.title) || (tracker.digits && title.replace(/\\D/g, '') === tracker.digits)) {
+                    return titled[i].closest('[role="listitem"], [role="row"]');
+                }
+            }
+            return null;
+        };
+        var messageId = function(el) {
+            var withId = el.closest('[data-id]');
+            return withId ? withId.getAttribute('data-id') : null;
+        };
+        var locate = function(tracker) {
+            if (tracker.message && tracker.message.isConnected) return tracker.message;
+            // the message rendered again, e.g. back in its chat, is found by its id
+            if (tracker.messageId) {
+                var byId = document.querySelector('#main [data-id="' + CSS.escape(tracker.messageId) + '"]');
+                if (byId) return tracker.message = byId;
+            }
+            if (tracker.left) return chatRow(tracker);
+            // the newest outgoing message
+            var outgoing = document.querySelectorAll('#main:not([data-stale-chat]) .message-out');
+            for (var i = outgoing.length - 1; i >= 0; i--) {
+                if (!tracker.known.has(outgoing[i])) {
+                    tracker.messageId = messageId(outgoing[i]);
+                    return tracker.message = outgoing[i];
+                }
+            }
+            return null;
+        };
+        registry.update = function() {
+            var changed = false;
+            Object.keys(registry.trackers).forEach(function(id) {
+                var tracker = registry.trackers[id], el = locate(tracker);
+                tracker.found = !!el;
+                var state = el ? stateOf(el) : null;
+                // the chat list may still show an earlier state, the state only moves forward
+                if (!state || state === tracker.state) return;
+                if (state !== 'failed' && tracker.state in order && order[state] < order[tracker.state]) return;
+                tracker.state = state;
+                tracker.transitions.push({state: state, at: (performance.now() - tracker.start) / 1000});
+                changed = true;
+            });
+            if (changed) registry.listeners.slice().forEach(function(listener) { listener(); });
+        };
+        registry.observer = new MutationObserver(registry.update);
+        registry.observer.observe(document, {childList: true, subtree: true, attributes: true, attributeFilter: ['data-icon', 'aria-label', 'data-stale-chat']});
+    }
+    var known = new WeakSet();
+    document.querySelectorAll('#main .message-out').forEach(function(el) { known.add(el); });
+    var header = document.querySelector('#main header [title]');
+    registry.trackers[id] = {
+        digits: String(phone || '').replace(/\\D/g, ''), title: header ? header.getAttribute('title') : null,
+        known: known, left: false, found: false, message: null, messageId: null, state: null, transitions: [], start: performance.now()
+    };
+    return true;
+""".replace("__STATUS_LABELS__", json.dumps(STATUS_LABELS)).replace("__STATUS_ICONS__", json.dumps(STATUS_ICONS))
+
+# resolves with the states of the messages as soon as one of them reaches the state or fails, or at the deadline
+WATCH_SCRIPT = """
+    var ids = arguments[0], target = arguments[1], timeoutMs = arguments[2], forget = arguments[3];
+    var done = arguments[arguments.length - 1];
+    var order = {pending: 0, sent: 1, delivered: 2, read: 3};
+    var registry = window.__deliveries, start = performance.now();
+    if (!registry) {
+        done({states: {}, waited: 0, lost: true});
+        return;
+    }
+    forget.forEach(function(id) { delete registry.trackers[id]; });
+    registry.update();
+    function reached() {
+        return ids.some(function(id) {
+            var tracker = registry.trackers[id];
+            return tracker && (tracker.state === 'failed' || (tracker.state in order && order[tracker.state] >= order[target]));
+        });
+    }
+    function result() {
+        var states = {};
+        ids.forEach(function(id) {
+            var tracker = registry.trackers[id];
+            if (tracker) states[id] = {state: tracker.state, transitions: tracker.transitions, found: tracker.found};
+        });
+        return {states: states, waited: (performance.now() - start) / 1000, lost: false};
+    }
+    if (timeoutMs <= 0 || reached()) {
+        done(result());
+        return;
+    }
+    var finished = false;
+    var timer = setTimeout(finish, timeoutMs);
+    function listener() {
+        if (!finished && reached()) finish();
+    }
+    function finish() {
+        finished = true;
+        clearTimeout(timer);
+        registry.listeners.splice(registry.listeners.indexOf(listener), 1);
+        done(result());
+    }
+    registry.listeners.push(listener);
+"""
+
+
+def state_of(labels, icons):
+    """State of a message from the aria-labels and data-icons of its status, like stateOf of ARM_SCRIPT"""
+    states = [STATUS_LABELS[label.strip().lower()] for label in labels if label.strip().lower() in STATUS_LABELS]
+    states += [STATUS_ICONS[icon] for icon in icons if icon in STATUS_ICONS]
+    if FAILED in states:
+        return FAILED
+    return max(states, key=STATE_ORDER.get, default=None)
+
+
+def settled_state(state, found):
+    """A message or chat row not found anymore may have been sent since, it's unknown rather than still pending"""
+    return None if not found and state==PENDING else state
+
+
+def reached(state, target):
+    return state==FAILED or (state in STATE_ORDER and STATE_ORDER[state]>=STATE_ORDER[target])
+
+
+class DeliveryTracker:
+    """
+    Follows the status icon of the messages sent (pending, sent, delivered, read, failed) with an in-page observer,
+    the transitions are handed back by an async script as soon as the awaited state is reached, or at the deadline.
+    """
+    def __init__(self, driver=None, wait_state=DELIVERY_WAIT_STATE, deadline=DELIVERY_TIMEOUT_SECS) -> None:
+        self.driver = driver
+        self.wait_state = wait_state
+        self.deadline = deadline
+        self.ids = itertools.count(1)
+        # the message of the last click on send
+        self.current = None
+        self.statuses = Counter()
+        # seconds from the click to each state
+        self.durations = {state: StreamingHistogram() for state in (SENT, DELIVERED, READ, FAILED)}
+
+    def arm(self, phone=None):
+        """Returns the id the next message sent is followed by, None if it can't be followed"""
+        delivery_id = str(next(self.ids))
+        self.current = None
+        try:
+            if self.driver.execute_script(ARM_SCRIPT, delivery_id, phone):
+                self.current = delivery_id
+        except Exception as e:
+            print("DeliveryTracker.arm Error: ", e)
+        return self.current
+
+    def poll(self, ids, timeout, state=None, forget=()):
+        """
+        Returns {id: {state, transitions, found}} of the messages once one of them reaches the state, or after timeout seconds,
+        None if the page got replaced and they can't be followed anymore
+        """
+        try:
+            self.driver.set_script_timeout(timeout + 5)
+            result = self.driver.execute_async_script(WATCH_SCRIPT, list(ids), state or self.wait_state, int(timeout*1000), list(forget))
+        except Exception as e:
+            print("DeliveryTracker.poll Error: ", e)
+            return None
+        if not result or result.get("lost"):
+            return None
+        return result["states"]
+
+    def settle(self, state, transitions):
+        """Records the final state of a message, returns its status"""
+        for transition in transitions:
+            if transition["state"] in self.durations:
+                self.durations[transition["state"]].observe(transition["at"])
+        status = self.status(state)
+        self.statuses[status] += 1
+        return status
+
+    def wait(self, delivery_id=None, state=None, deadline=None):
+        """Waits for the message to reach the state, returns the state it got to within the deadline, None if it was never seen"""
+        delivery_id = delivery_id or self.current
+        state = state or self.wait_state
+        deadline = self.deadline if deadline is None else deadline
+        states = self.poll([delivery_id], deadline, state) if delivery_id is not None else None
+        result = (states or {}).get(delivery_id)
+        if result is None:
+            print("The message sent couldn't be followed")
+            result = {"state": None, "transitions": []}
+        else:
+            # nothing to follow anymore
+            self.poll([], 0, forget=[delivery_id])
+        final_state = settled_state(result["state"], result.get("found", True))
+        self.settle(final_state, result["transitions"])
+        if not reached(final_state, state):
+            print(f"Message {final_state or 'not seen'} after {deadline} seconds, waited for it to be {state}")
+        return final_state
+
+    def status(self, state):
+        return STATE_STATUSES.get(state, UNCONFIRMED_STATUS)
+
+    def report(self):
+        if len(self.statuses)==0:
+            print("Delivery metrics: nothing sent")
+        else:
+            lines = "\n".join(f"                          {status}: {count}" for status, count in self.statuses.most_common())
+            print(f"Delivery metrics:\n{lines}")
+        for state, histogram in self.durations.items():
+            if histogram.count>0:
+                histogram.report(f"Time to {state}")
+
+
+class DeliveryReconciler:
+    """
+    Lets the sender open the next chat right after clicking send, with at most max_unconfirmed messages not confirmed yet.
+    Their status keeps being followed in the page, in their chat and then in the chat list,
+    the rows are handed back with their final status once confirmed or at their deadline.
+    """
+    def __init__(self, tracker, max_unconfirmed=MAX_UNCONFIRMED_MESSAGES) -> None:
+        self.tracker = tracker
+        self.max_unconfirmed = max_unconfirmed
+        self.in_flight = {}
+        self.settled = []
+        # dropped from the page with the next poll
+        self.forget = []
+        self.max_in_flight = 0
+        self.cap_waits = StreamingHistogram()
+
+    def add(self, job, delivery_id):
+        """Follows the message of the row, returns the rows settled since the last call"""
+        if delivery_id is None:
+            job["status"] = self.tracker.settle(None, [])
+            self.settled.append(job)
+        else:
+            self.in_flight[delivery_id] = {"job": job, "deadline": time.time() + self.tracker.deadline, "state": None, "transitions": [], "found": True}
+            self.max_in_flight = max(self.max_in_flight, len(self.in_flight))
+            self.collect()
+            if len(self.in_flight)>self.max_unconfirmed:
+                start_time = time.time()
+                while len(self.in_flight)>self.max_unconfirmed:
+                    self.collect(wait=True)
+                self.cap_waits.observe(time.time() - start_time)
+        return self.take()
+
+    def collect(self, wait=False):
+        """Settles the messages confirmed or past their deadline, waiting for the first of them if wait"""
+        if len(self.in_flight)==0:
+            return
+        timeout = 0
+        if wait:
+            timeout = max(min(entry["deadline"] for entry in self.in_flight.values()) - time.time(), 0)
+        states = self.tracker.poll(self.in_flight.keys(), timeout, forget=self.forget)
+        self.forget = []
+        now = time.time()
+        for delivery_id, entry in list(self.in_flight.items()):
+            if states is not None and delivery_id in states:
+                entry.update(states[delivery_id])
+            # a message which can't be followed anymore keeps the last state seen
+            if states is None or reached(entry["state"], self.tracker.wait_state) or now>=entry["deadline"]:
+                self._settle(delivery_id)
+
+    def _settle(self, delivery_id):
+        entry = self.in_flight.pop(delivery_id)
+        entry["job"]["status"] = self.tracker.settle(settled_state(entry["state"], entry["found"]), entry["transitions"])
+        self.forget.append(delivery_id)
+        self.settled.append(entry["job"])
+
+    def settle_all(self):
+        """Waits for all the messages in flight, before leaving the page"""
+        while len(self.in_flight)>0:
+            self.collect(wait=True)
+
+    def take(self):
+        settled, self.settled = self.settled, []
+        return settled
+
+    def drain(self):
+        self.settle_all()
+        return self.take()
+
+    def report(self):
+        print(f"""Unconfirmed messages metrics:
+                          Cap: {self.max_unconfirmed}
+                          Max in flight: {self.max_in_flight}
+                          Waits at the cap: {self.cap_waits.count}""")
+        self.cap_waits.report("Wait at the cap")
@@ -0,0 +1,672 @@
+import re
+import time
+import json
+import urllib.parse
+import urllib.request
+from functools import lru_cache
+from html.parser import HTMLParser
+from selenium.webdriver.support.wait import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.common.action_chains import ActionChains
+from selenium.webdriver.common.by import By
+from selenium.webdriver.common.keys import Keys
+from readiness import FIND_SCRIPT, WAIT_SCRIPT, to_selector
+from delivery import ARM_SCRIPT, WATCH_SCRIPT, FAILED, STATE_ORDER, state_of, reached
+
+
+# marks the opened chat as stale and clicks an in-app link to the next chat,
+# WhatsApp Web handles such links itself instead of reloading the whole app
+OPEN_CHAT_SCRIPT = """
+    var app = document.querySelector('#app');
+    if (!app) return false;
+    var main = document.querySelector('#main');
+    if (main) main.setAttribute('data-stale-chat', '1');
+    // the messages sent to the previous chat are followed in the chat list from now on
+    var deliveries = window.__deliveries;
+    if (deliveries) Object.keys(deliveries.trackers).forEach(function(id) { deliveries.trackers[id].left = true; });
+    window.__warmSession = true;
+    var link = document.createElement('a');
+    link.href = arguments[0];
+    link.rel = 'noopener noreferrer';
+    link.style.display = 'none';
+    app.appendChild(link);
+    link.click();
+    link.remove();
+    return true;
+"""
+
+WARM_SESSION_SCRIPT = "return window.__warmSession === true;"
+
+# locates the element, waits for it to be visible and enabled and clicks it, all in one round-trip
+CLICK_SCRIPT = """
+    var kind = arguments[0], selector = arguments[1];
+    var timeoutMs = arguments[2], done = arguments[arguments.length - 1];
+    var start = performance.now();
+    var state = {ok: false, found: false, visible: false, enabled: false, clicked: false, waited: 0, error: null};
+    function locate() {
+        var el = kind === 'xpath' ? document.evaluate(
+            selector, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+        ).singleNodeValue : document.querySelector(selector);
+        state.found = el !== null;
+        if (!el) return null;
+        var style = window.getComputedStyle(el);
+        state.visible = el.getClientRects().length > 0 && style.visibility !== 'hidden' && style.display !== 'none';
+        state.enabled = !el.disabled && el.getAttribute('aria-disabled') !== 'true';
+        return state.visible && state.enabled ? el : null;
+    }
+    function click(el) {
+        try {
+            el.scrollIntoView({block: 'center'});
+            if (el.focus) el.focus();
+            ['pointerdown', 'mousedown', 'pointerup', 'mouseup'].forEach(function(type) {
+                el.dispatchEvent(new MouseEvent(type, {bubbles: true, cancelable: true, view: window}));
+            });
+            el.click();
+            state.clicked = true;
+        } catch (e) {
+            state.error = String(e);
+        }
+    }
+    var finished = false, observer = null, timer = null, interval = null;
+    function finish(el) {
+        if (finished) return;
+        finished = true;
+        if (observer) observer.disconnect();
+        clearTimeout(timer);
+        clearInterval(interval);
+        if (el) click(el);
+        state.ok = state.clicked;
+        state.waited = (performance.now() - start) / 1000;
+        done(state);
+    }
+    var el = locate();
+    if (el) {
+        finish(el);
+        return;
+    }
+    function check() {
+        var el = locate();
+        if (el) finish(el);
+    }
+    observer = new MutationObserver(check);
+    observer.observe(document, {childList: true, subtree: true, attributes: true});
+    // visibility may change without any mutation, e.g. at the end of an animation
+    interval = setInterval(check, 100);
+    timer = setTimeout(function() { finish(locate()); }, timeoutMs);
+"""
+
+
+class BrowserDriver:
+    """
+    What the send loop needs from a browser, so it can run on something else than Selenium.
+    Locators are selenium (by, value) tuples, the waits raise TimeoutException.
+    """
+    @property
+    def title(self):
+        raise NotImplementedError
+
+    def get(self, url):
+        raise NotImplementedError
+
+    def refresh(self):
+        raise NotImplementedError
+
+    def execute_script(self, script, *args):
+        raise NotImplementedError
+
+    def execute_async_script(self, script, *args):
+        raise NotImplementedError
+
+    def set_script_timeout(self, secs):
+        pass
+
+    def find_elements(self, by_tuple):
+        raise NotImplementedError
+
+    def wait_present(self, by_tuple, timeout):
+        """All the elements of the locator once there's one, within timeout seconds"""
+        raise NotImplementedError
+
+    def wait_clickable(self, by_tuple, timeout):
+        """The first element of the locator once it's visible and enabled, within timeout seconds"""
+        raise NotImplementedError
+
+    def click(self, by_tuple, timeout):
+        """
+        Clicks the first element of the locator once it's visible and enabled, within timeout seconds.
+        Returns {ok, found, visible, enabled, clicked, waited, error}.
+        """
+        start_time = time.time()
+        try:
+            element = self.wait_clickable(by_tuple, timeout)
+            element.click()
+            return {"ok": True, "found": True, "visible": True, "enabled": True, "clicked": True, "waited": time.time() - start_time, "error": None}
+        except TimeoutException:
+            elements = self.find_elements(by_tuple)
+            found = len(elements)>0
+            return {
+                "ok": False,
+                "found": found,
+                "visible": found and elements[0].is_displayed(),
+                "enabled": found and elements[0].is_enabled(),
+                "clicked": False,
+                "waited": time.time() - start_time,
+                "error": None,
+            }
+
+    def paste(self):
+        """Pastes the clipboard into the focused element"""
+        raise NotImplementedError
+
+    def is_alive(self):
+        try:
+            return self.title is not None
+        except Exception:
+            return False
+
+    def quit(self):
+        pass
+
+
+class SeleniumDriver(BrowserDriver):
+    def __init__(self, browser) -> None:
+        self.browser = browser
+        # set again only when it changes, it's a round-trip of its own
+        self.script_timeout = None
+
+    @property
+    def title(self):
+        return self.browser.title
+
+    def get(self, url):
+        return self.browser.get(url)
+
+    def refresh(self):
+        return self.browser.refresh()
+
+    def execute_script(self, script, *args):
+        return self.browser.execute_script(script, *args)
+
+    def execute_async_script(self, script, *args):
+        return self.browser.execute_async_script(script, *args)
+
+    def set_script_timeout(self, secs):
+        if secs!=self.script_timeout:
+            self.browser.set_script_timeout(secs)
+            self.script_timeout = secs
+
+    def find_elements(self, by_tuple):
+        return self.browser.find_elements(*by_tuple)
+
+    def wait_present(self, by_tuple, timeout):
+        return WebDriverWait(self.browser, timeout).until(EC.presence_of_all_elements_located(by_tuple))
+
+    def wait_clickable(self, by_tuple, timeout):
+        return WebDriverWait(self.browser, timeout).until(EC.element_to_be_clickable(by_tuple))
+
+    def click(self, by_tuple, timeout):
+        kind, selector = to_selector(by_tuple)
+        if kind=="title":
+            raise ValueError(f"Unsupported locator: {by_tuple}")
+        self.set_script_timeout(timeout + 5)
+        return self.browser.execute_async_script(CLICK_SCRIPT, kind, selector, int(timeout*1000))
+
+    def paste(self):
+        ActionChains(self.browser).key_down(Keys.CONTROL).send_keys('v').perform()
+
+    def quit(self):
+        self.browser.quit()
+
+
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+
+class Node:
+    def __init__(self, tag, attrs, parent=None) -> None:
+        self.tag = tag
+        self.attrs = attrs
+        self.parent = parent
+        self.children = []
+        self.text = ""
+
+    def descendants(self):
+        for child in self.children:
+            yield child
+            yield from child.descendants()
+
+
+class DomBuilder(HTMLParser):
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.root = Node("#document", {})
+        self.current = self.root
+
+    def handle_starttag(self, tag, attrs):
+        node = Node(tag, {name: value or "" for name, value in attrs}, self.current)
+        self.current.children.append(node)
+        if tag not in VOID_TAGS:
+            self.current = node
+
+    def handle_startendtag(self, tag, attrs):
+        self.current.children.append(Node(tag, {name: value or "" for name, value in attrs}, self.current))
+
+    def handle_endtag(self, tag):
+        node = self.current
+        while node is not self.root and node.tag!=tag:
+            node = node.parent
+        if node is not self.root:
+            self.current = node.parent
+
+    def handle_data(self, data):
+        self.current.text += data
+
+
+def parse_html(html):
+    builder = DomBuilder()
+    builder.feed(html)
+    builder.close()
+    return builder.root
+
+
+XPATH_TOKEN = re.compile(r"\s*(//|\[|\]|\(|\)|,|=|@[\w-]+|'[^']*'|\"[^\"]*\"|[\w*-]+)")
+
+
+class XPath:
+    """
+    The xpath subset of the send path: //tag[predicate]//tag... where the predicates are
+    @attr, @attr='value', contains(@attr, 'value'), not(...), combined with and/or
+    """
+    def __init__(self, expression) -> None:
+        self.expression = expression
+        self.tokens = []
+        pos = 0
+        expression = expression.strip()
+        while pos<len(expression):
+            match = XPATH_TOKEN.match(expression, pos)
+            if match is None:
+                raise ValueError(f"Unsupported xpath: {self.expression}")
+            self.tokens.append(match[1])
+            pos = match.end()
+        self.pos = 0
+        self.steps = []
+        while self.pos<len(self.tokens):
+            self.expect("//")
+            tag = self.next()
+            predicate = None
+            if self.peek()=="[":
+                self.next()
+                predicate = self.parse_or()
+                self.expect("]")
+            self.steps.append((tag, predicate))
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos<len(self.tokens) else None
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise ValueError(f"Unsupported xpath: {self.expression}")
+        self.pos += 1
+        return token
+
+    def expect(self, token):
+        if self.next()!=token:
+            raise ValueError(f"Unsupported xpath: {self.expression}")
+
+    def parse_or(self):
+        terms = [self.parse_and()]
+        while self.peek()=="or":
+            self.next()
+            terms.append(self.parse_and())
+        return lambda node: any(term(node) for term in terms)
+
+    def parse_and(self):
+        terms = [self.parse_term()]
+        while self.peek()=="and":
+            self.next()
+            terms.append(self.parse_term())
+        return lambda node: all(term(node) for term in terms)
+
+    def parse_term(self):
+        token = self.next()
+        if token=="not":
+            self.expect("(")
+            term = self.parse_or()
+            self.expect(")")
+            return lambda node: not term(node)
+        if token=="contains":
+            self.expect("(")
+            attr = self.next()[1:]
+            self.expect(",")
+            value = self.next()[1:-1]
+            self.expect(")")
+            return lambda node: value in node.attrs.get(attr, "")
+        if token.startswith("@"):
+            attr = token[1:]
+            if self.peek()=="=":
+                self.next()
+                value = self.next()[1:-1]
+                return lambda node: node.attrs.get(attr)==value
+            return lambda node: attr in node.attrs
+        raise ValueError(f"Unsupported xpath: {self.expression}")
+
+    def select(self, root):
+        nodes = [root]
+        for tag, predicate in self.steps:
+            selected = []
+            seen = set()
+            for node in nodes:
+                for descendant in node.descendants():
+                    if id(descendant) in seen:
+                        continue
+                    if (tag=="*" or descendant.tag==tag) and (predicate is None or predicate(descendant)):
+                        seen.add(id(descendant))
+                        selected.append(descendant)
+            nodes = selected
+        return nodes
+
+
+@lru_cache(maxsize=256)
+def compile_xpath(expression):
+    return XPath(expression)
+
+
+def to_xpath(by_tuple):
+    kind, selector = to_selector(by_tuple)
+    if kind=="xpath":
+        return selector
+    if kind=="css":
+        if re.fullmatch(r"[\w-]+", selector):
+            return f"//{selector}"
+        if re.fullmatch(r"#[\w-]+", selector):
+            return f"//*[@id='{selector[1:]}']"
+    raise ValueError(f"Unsupported locator: {by_tuple}")
+
+
+class StandInElement:
+    def __init__(self, driver, node) -> None:
+        self.driver = driver
+        self.node = node
+
+    def get_attribute(self, name):
+        return self.node.attrs.get(name)
+
+    def is_displayed(self):
+        return "hidden" not in self.node.attrs and "display:none" not in self.node.attrs.get("style", "").replace(" ", "")
+
+    def is_enabled(self):
+        return "disabled" not in self.node.attrs
+
+    def click(self):
+        action = self.node.attrs.get("data-action")
+        if action:
+            self.driver.post(action)
+
+    def send_keys(self, value):
+        # a file input uploads the file right away
+        action = self.node.attrs.get("data-upload")
+        if action:
+            self.driver.post(action, {"file": str(value)})
+
+
+class StandInDriver(BrowserDriver):
+    """
+    Drives the local WhatsApp Web stand-in (standin.py) over plain HTTP, without any browser,
+    the pages are parsed and the locators and scripts of the send path are emulated.
+    The WhatsApp urls are sent to the stand-in.
+    """
+    def __init__(self, base_url, poll_interval=0.05) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.poll_interval = poll_interval
+        self.url = None
+        self.dom = None
+        self.warm_session = False
+        # the messages followed, like window.__deliveries, dropped with the page
+        self.deliveries = None
+
+    def _to_stand_in(self, url):
+        if url.startswith(self.base_url):
+            return url
+        parts = urllib.parse.urlsplit(url)
+        return f"{self.base_url}{parts.path or '/'}{'?' + parts.query if parts.query else ''}"
+
+    def _load(self, url, refresh=False):
+        if url.startswith("data:"):
+            html = urllib.parse.unquote(url.split(",", 1)[1])
+        else:
+            request = urllib.request.Request(url, headers={"X-Stand-In-Refresh": "1"} if refresh else {})
+            with urllib.request.urlopen(request, timeout=30) as response:
+                html = response.read().decode("utf-8")
+        self.dom = parse_html(html)
+
+    def post(self, path, data=None):
+        body = urllib.parse.urlencode(data or {}).encode()
+        with urllib.request.urlopen(urllib.request.Request(self._to_stand_in(path), data=body), timeout=30) as response:
+            result = json.loads(response.read().decode("utf-8") or "null")
+        self._load(self.url, refresh=True)
+        return result
+
+    def _refresh_dom(self):
+        # the page of the stand-in is rendered from its state, fetching it again is what a live DOM would show
+        if self.url is not None and not self.url.startswith("data:"):
+            self._load(self.url, refresh=True)
+
+    @property
+    def title(self):
+        if self.dom is None:
+            return ""
+        titles = compile_xpath("//title").select(self.dom)
+        return titles[0].text.strip() if len(titles)>0 else ""
+
+    def get(self, url):
+        self.url = url if url.startswith("data:") else self._to_stand_in(url)
+        self.warm_session = False
+        self.deliveries = None
+        self._load(self.url)
+
+    def refresh(self):
+        self.get(self.url)
+
+    def find_elements(self, by_tuple):
+        self._refresh_dom()
+        return self._find(by_tuple)
+
+    def _find(self, by_tuple):
+        if self.dom is None:
+            return []
+        return [StandInElement(self, node) for node in compile_xpath(to_xpath(by_tuple)).select(self.dom)]
+
+    def _until(self, find, timeout):
+        end_time = time.time() + timeout
+        while True:
+            self._refresh_dom()
+            result = find()
+            if result:
+                return result
+            if time.time()>=end_time:
+                raise TimeoutException(f"Stand-in wait timed out after {timeout} seconds")
+            time.sleep(self.poll_interval)
+
+    def wait_present(self, by_tuple, timeout):
+        return self._until(lambda: self._find(by_tuple), timeout)
+
+    def wait_clickable(self, by_tuple, timeout):
+        def clickable():
+            for element in self._find(by_tuple):
+                return element if element.is_displayed() and element.is_enabled() else None
+        return self._until(clickable, timeout)
+
+    def click(self, by_tuple, timeout):
+        # the single script of the browser, emulated by execute_async_script
+        kind, selector = to_selector(by_tuple)
+        if kind=="title":
+            raise ValueError(f"Unsupported locator: {by_tuple}")
+        return self.execute_async_script(CLICK_SCRIPT, kind, selector, int(timeout*1000))
+
+    def _click(self, kind, selector, timeout):
+        by_tuple = ("xpath", selector) if kind=="xpath" else (By.CSS_SELECTOR, selector)
+        start_time = time.time()
+        result = {"ok": False, "found": False, "visible": False, "enabled": False, "clicked": False, "waited": 0, "error": None}
+        def clickable():
+            elements = self._find(by_tuple)
+            result["found"] = len(elements)>0
+            result["visible"] = result["found"] and elements[0].is_displayed()
+            result["enabled"] = result["found"] and elements[0].is_enabled()
+            return elements[0] if result["visible"] and result["enabled"] else None
+        try:
+            self._until(clickable, timeout).click()
+            result.update(ok=True, clicked=True)
+        except TimeoutException:
+            pass
+        result["waited"] = time.time() - start_time
+        return result
+
+    def _outgoing(self):
+        main = compile_xpath("//*[@id='main']").select(self.dom) if self.dom is not None else []
+        if len(main)==0:
+            return []
+        return [node for node in main[0].descendants() if "message-out" in node.attrs.get("class", "").split()]
+
+    def _chat_row(self, tracker):
+        panes = compile_xpath("//*[@id='pane-side']").select(self.dom) if self.dom is not None else []
+        if len(panes)==0:
+            return None
+        for node in panes[0].descendants():
+            title = node.attrs.get("title")
+            if title is None:
+                continue
+            if (tracker["title"] and title==tracker["title"]) or (tracker["digits"] and re.sub(r"\D", "", title)==tracker["digits"]):
+                while node is not None and node.attrs.get("role") not in ("listitem", "row"):
+                    node = node.parent
+                return node
+        return None
+
+    def _update_deliveries(self):
+        for tracker in self.deliveries.values():
+            outgoing = self._outgoing()
+            by_id = [node for node in outgoing if tracker["message_id"] is not None and node.attrs.get("data-id")==tracker["message_id"]]
+            if len(by_id)>0:
+                el = by_id[0]
+            elif tracker["left"]:
+                el = self._chat_row(tracker)
+            else:
+                new = [node for node in outgoing if node.attrs.get("data-id") not in tracker["known"]]
+                el = new[-1] if len(new)>0 else None
+                tracker["message_id"] = None if el is None else el.attrs.get("data-id")
+            tracker["found"] = el is not None
+            if el is None:
+                continue
+            nodes = list(el.descendants())
+            state = state_of(
+                [node.attrs["aria-label"] for node in nodes if "aria-label" in node.attrs],
+                [node.attrs["data-icon"] for node in nodes if "data-icon" in node.attrs],
+            )
+            if state is None or state==tracker["state"]:
+                continue
+            if state!=FAILED and tracker["state"] in STATE_ORDER and STATE_ORDER[state]<STATE_ORDER[tracker["state"]]:
+                continue
+            tracker["state"] = state
+            tracker["transitions"].append({"state": state, "at": time.time() - tracker["start"]})
+
+    def _present(self, kind, selector, present):
+        if kind=="title":
+            found = selector in self.title
+        else:
+            found = len(self._find(("xpath", selector) if kind=="xpath" else (By.CSS_SELECTOR, selector)))>0
+        return found==present
+
+    def execute_script(self, script, *args):
+        if script==FIND_SCRIPT:
+            self._refresh_dom()
+            kind, selector = args[0], args[1]
+            return self._present(kind, selector, True)
+        if script==OPEN_CHAT_SCRIPT:
+            if self.dom is None or len(compile_xpath("//*[@id='app']").select(self.dom))==0:
+                return False
+            # the stand-in handles in-app links like WhatsApp Web, the app isn't reloaded
+            for tracker in (self.deliveries or {}).values():
+                tracker["left"] = True
+            self.url = self._to_stand_in(args[0])
+            self._load(self.url)
+            self.warm_session = True
+            return True
+        if script==WARM_SESSION_SCRIPT:
+            return self.warm_session
+        if script==ARM_SCRIPT:
+            self._refresh_dom()
+            if self.dom is None or len(compile_xpath("//*[@id='main']").select(self.dom))==0:
+                return False
+            delivery_id, phone = args[0], args[1]
+            if self.deliveries is None:
+                self.deliveries = {}
+            headers = compile_xpath("//*[@id='main']//header//*[@title]").select(self.dom)
+            self.deliveries[delivery_id] = {
+                "digits": re.sub(r"\D", "", str(phone or "")),
+                "title": headers[0].attrs["title"] if len(headers)>0 else None,
+                "known": {node.attrs.get("data-id") for node in self._outgoing()},
+                "left": False,
+                "found": False,
+                "message_id": None,
+                "state": None,
+                "transitions": [],
+                "start": time.time(),
+            }
+            return True
+        # scrolling and the like, there's no layout
+        return 0 if "scrollHeight" in script else None
+
+    def execute_async_script(self, script, *args):
+        if script==CLICK_SCRIPT:
+            kind, selector, timeout_ms = args[:3]
+            return self._click(kind, selector, timeout_ms / 1000)
+        if script==WATCH_SCRIPT:
+            ids, target, timeout_ms, forget = args[:4]
+            if self.deliveries is None:
+                return {"states": {}, "waited": 0, "lost": True}
+            for delivery_id in forget:
+                self.deliveries.pop(delivery_id, None)
+            trackers = [self.deliveries[delivery_id] for delivery_id in ids if delivery_id in self.deliveries]
+            def any_reached():
+                self._update_deliveries()
+                return any(reached(tracker["state"], target) for tracker in trackers)
+            start_time = time.time()
+            try:
+                self._until(any_reached, timeout_ms / 1000)
+            except TimeoutException:
+                pass
+            states = {
+                delivery_id: {
+                    "state": self.deliveries[delivery_id]["state"],
+                    "transitions": list(self.deliveries[delivery_id]["transitions"]),
+                    "found": self.deliveries[delivery_id]["found"],
+                }
+                for delivery_id in ids if delivery_id in self.deliveries
+            }
+            return {"states": states, "waited": time.time() - start_time, "lost": False}
+        if script!=WAIT_SCRIPT:
+            raise NotImplementedError("The stand-in driver only runs the readiness, click and delivery scripts")
+        kind, selector, present, timeout_ms = args[:4]
+        start_time = time.time()
+        try:
+            self._until(lambda: self._present(kind, selector, present), timeout_ms / 1000)
+            ok = True
+        except TimeoutException:
+            ok = False
+        return {"ok": ok, "waited": time.time() - start_time}
+
+    def paste(self):
+        attach = compile_xpath("//*[@data-paste]").select(self.dom)
+        if len(attach)>0:
+            self.post(attach[0].attrs["data-paste"])
+
+    def is_alive(self):
+        try:
+            with urllib.request.urlopen(f"{self.base_url}/health", timeout=5) as response:
+                return response.status==200
+        except Exception:
+            return False
+
+    def quit(self):
+        self.dom = None
+        self.url = None
@@ -0,0 +1,94 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import Counter
+from pathlib import Path
+from settings import LEDGER_FILE
+from delivery import KEEP_STATUSES
+
+
+class SendLedger:
+    """
+    Append-only log of every send, one json line per row.
+    It's loaded into memory on start so the lookups stay O(1) for any number of rows.
+    """
+    def __init__(self, path=LEDGER_FILE) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.statuses = {}
+        # rows kept as sent per (number, message), a row in flight may still fail
+        self.sent = Counter()
+        self.load()
+        self.fh = open(self.path, "a", encoding="utf-8")
+        if self.fh.tell()>0 and not self.ends_with_newline():
+            self.fh.write("\n")
+
+    @staticmethod
+    def make_key(filename, sheet, row, contact_number, message):
+        message_hash = hashlib.sha1(message.encode("utf-8")).hexdigest()
+        return (str(filename), str(sheet), int(row), contact_number, message_hash)
+
+    def load(self):
+        if not self.path.exists():
+            return
+        skipped = 0
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    key = (record["file"], record["sheet"], record["row"], record["number"], record["message_hash"])
+                except (ValueError, KeyError):
+                    # a line cut short by a crash while writing it
+                    skipped += 1
+                    continue
+                self._index(key, record["status"])
+        print(f"Send ledger {self.path} loaded: {len(self.statuses)} rows, {len(self.sent)} sent messages")
+        if skipped>0:
+            print(f"Send ledger skipped {skipped} unreadable lines")
+
+    def ends_with_newline(self):
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1)==b"\n"
+
+    def _index(self, key, status):
+        if self.statuses.get(key) in KEEP_STATUSES:
+            self.sent[key[3:]] -= 1
+            if self.sent[key[3:]]<=0:
+                del self.sent[key[3:]]
+        self.statuses[key] = status
+        if status in KEEP_STATUSES:
+            self.sent[key[3:]] += 1
+
+    def sent_status(self, key):
+        """Returns the status to keep for a row which mustn't be sent again, otherwise None"""
+        if self.statuses.get(key) in KEEP_STATUSES:
+            return self.statuses[key]
+        if key[3:] in self.sent:
+            return "Already Sent"
+        return None
+
+    def record(self, key, status):
+        filename, sheet, row, contact_number, message_hash = key
+        line = json.dumps({
+            "file": filename,
+            "sheet": sheet,
+            "row": row,
+            "number": contact_number,
+            "message_hash": message_hash,
+            "status": status,
+            "time": time.time(),
+        }, ensure_ascii=False)
+        with self.lock:
+            self.fh.write(line + "\n")
+            self.fh.flush()
+            os.fsync(self.fh.fileno())
+            self._index(key, status)
+
+    def close(self):
+        with self.lock:
+            if not self.fh.closed:
+                self.fh.close()
@@ -6,46 +6,100 @@ import sys
 import subprocess
 import signal
 import psutil
-from contextlib import suppress
+from contextlib import suppress, nullcontext
 import argparse
+import json
 import time
+import math
 import random
 import shutil
+import threading
+import queue
 import pandas as pd
-import numpy as np
 import urllib
-from copy import deepcopy
+import urllib.parse
 from weakref import finalize
 from selenium import webdriver
-from selenium.webdriver.support.wait import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException
-from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.service import utils
 from selenium.webdriver.chromium.service import ChromiumService
 from selenium.webdriver.chromium.options import ChromiumOptions
-from patcher import Patcher
+from patcher import Patcher, local_chrome_version
+from readiness import Readiness, PAGE_PROFILES
+from ledger import SendLedger
+from contacts import CONTACT_SOURCES, open_contact_source, StatusWriter
+from validation import ContactValidator
+from dedup import build_dedup_index
+from templates import MessageTemplate
+from pipeline import SendPipeline
+from scheduler import AdaptiveRateLimiter
+from batch import batch_plan, RunSummary
+from metrics import StreamingHistogram, span_recorder
+from standby import StandbySession
+from delivery import DeliveryTracker, DeliveryReconciler, SENT_STATUSES, KEEP_STATUSES, IN_FLIGHT_STATUS
+from drivers import BrowserDriver, SeleniumDriver, StandInDriver, OPEN_CHAT_SCRIPT, WARM_SESSION_SCRIPT
 from utils import *
 from settings import *
 import traceback
 
+
+CHAT_LIST_BY = (By.XPATH, "//div[@id='pane-side']")
+
+# page of the browser health check when health_check_url is local, rendered without any network
+HEALTH_PROBE_TITLE = "WhatsAppSendMsg Health Probe"
+HEALTH_PROBE_URL = "data:text/html;charset=utf-8," + urllib.parse.quote(
+    f"<!DOCTYPE html><html><head><title>{HEALTH_PROBE_TITLE}</title></head><body>OK</body></html>"
+)
+
 class WhatsAppSendMsg:
-    def __init__(self, invisible=True, debug=False) -> None:
+    def __init__(self, invisible=True, debug=False, worker_id=None) -> None:
         finalize(self, self.kill_browser_process)
         self.invisible = invisible
         self.debug = debug
+        self.worker_id = worker_id
         self.not_ok = 0
         self.retry = 0
         self.max_retries = 3
+        self.scroll_timeout = 5
         self.force_kill = True
+        self.previous_image_name = None
+        self.is_app_loaded = False
+        self.warm_session = WARM_SESSION
+        # what the send loop drives, the selenium browser or the stand-in of WhatsApp Web
+        self.driver = None
+        self.readiness = Readiness()
+        self.delivery = DeliveryTracker()
+        # the next chat is opened right after clicking send, the messages are confirmed later, see max_unconfirmed_messages
+        self.reconciler = DeliveryReconciler(self.delivery) if MAX_UNCONFIRMED_MESSAGES>0 else None
+        # every worker is logged in to its own account
+        self.rate_limiter = AdaptiveRateLimiter()
+        self.summary = RunSummary()
+        # spare session swapped in when the browser dies, see warm_standby
+        self.standby = None
+        # set by WhatsAppSendMsgPool as the OS clipboard is shared by all the workers
+        self.clipboard_lock = None
+        self.attachment_mode = ATTACHMENT_MODE
+        if self.attachment_mode in ("auto", "clipboard") and not is_clipboard_supported():
+            if self.attachment_mode=="clipboard":
+                print("The clipboard isn't supported on this platform, images are attached through the page")
+            self.attachment_mode = "file_input"
+        elif self.attachment_mode=="auto":
+            self.attachment_mode = "clipboard"
+        extension = '' if IS_POSIX else '.exe'
+        self.shared_chrome_driver_path = CHROME_DIR / f"undetected_chromedriver{extension}"
+        if worker_id is None:
+            self.user_data_dir = USER_DATA_DIR
+            self.chrome_driver_path = self.shared_chrome_driver_path
+        else:
+            self.user_data_dir = CHROME_DIR / f"user-data-w{worker_id}"
+            self.user_data_dir.mkdir(exist_ok=True)
+            self.chrome_driver_path = CHROME_DIR / f"undetected_chromedriver_w{worker_id}{extension}"
 
     def is_head_ready(self):
         ready = False
         try:
-            WebDriverWait(self.browser, 20).until(EC.presence_of_element_located((By.TAG_NAME, "head")))
-            ready = self.browser.find_element(By.TAG_NAME, "head") is not None 
+            ready = self.readiness.wait("head", (By.TAG_NAME, "head"))
         except Exception as e:
             if "Alert Text" in str(e):
                 print("############## Alert detected.")
@@ -57,19 +111,19 @@ class WhatsAppSendMsg:
     def scroll(self):
         try:
             print("Scrolling...")
-            scroll_height = self.browser.execute_script("return document.body.scrollHeight;")
+            scroll_height = self.driver.execute_script("return document.body.scrollHeight;")
             start_time = time.time()
             old_scroll_height = None
             while True:
                 i = 10
                 while i>0:
-                    self.browser.execute_script(f"window.scrollTo(0, {scroll_height/i});")
+                    self.driver.execute_script(f"window.scrollTo(0, {scroll_height/i});")
                     time.sleep(random.randrange(3, 5)/100)
                     i -= 1
                     if time.time() - start_time >= self.scroll_timeout:
                         break
                 time.sleep(random.randrange(3, 5)/100)
-                new_scroll_height = self.browser.execute_script("return document.body.scrollHeight;")
+                new_scroll_height = self.driver.execute_script("return document.body.scrollHeight;")
                 if new_scroll_height==scroll_height:
                     break
                 if old_scroll_height is None or old_scroll_height!=new_scroll_height:
@@ -81,19 +135,17 @@ class WhatsAppSendMsg:
         except:
             pass
         finally:
-            self.browser.execute_script("window.scrollTo(0, 0);")
-            time.sleep(0.5)
+            self.driver.execute_script("window.scrollTo(0, 0);")
 
-    def is_dom_ready(self):
+    def is_dom_ready(self, scroll=True):
         ready = False
         try:
-            time.sleep(0.5)
-            WebDriverWait(self.browser, 20).until(EC.presence_of_element_located((By.TAG_NAME, "body")))                
-            try:
-                self.scroll()
-            except:
-                pass
-            ready = self.browser.find_element(By.TAG_NAME, "body") is not None
+            ready = self.readiness.wait("body", (By.TAG_NAME, "body"))
+            if ready and scroll:
+                try:
+                    self.scroll()
+                except:
+                    pass
         except Exception as e:
             if "Alert Text" in str(e):
                 print("############## Alert detected.")
@@ -108,30 +160,33 @@ class WhatsAppSendMsg:
         print(f"Checking Title {title}")
         if title is None or title=="":
             if invalid_title is not None:
-                try:
-                    WebDriverWait(self.browser, 1).until(EC.title_contains(invalid_title.strip()))
-                except TimeoutException:
-                    valid = True
+                valid = not self.readiness.wait_title("invalid_title", invalid_title.strip())
 
                 if not valid:
                     print("BOT DETECTED")
             else:
                 valid = True
         else:
-            try:
-                WebDriverWait(self.browser, 15).until(EC.title_contains(title.strip()))
-                valid = True
-            except TimeoutException:
-                pass
+            valid = self.readiness.wait_title("title", title.strip())
         print("Is Title Valid?: ", "Yes" if valid else "No")
         return valid
         
-    def is_page_ready(self, title=None, invalid_title=None, max_try=3):
-        print("Is Page Ready?")
+    def is_page_ready(self, title=None, invalid_title=None, max_try=3, profile="default"):
+        print(f"Is Page Ready? ({profile})")
+        checks = PAGE_PROFILES[profile]
         ready = False
         for _ in range(0, max_try):
             try:
-                ready = self.is_head_ready() and self.is_dom_ready() and self.is_title_valid(title=title, invalid_title=invalid_title)
+                ready = True
+                if ready and checks["head"]:
+                    with span_recorder.span("head"):
+                        ready = self.is_head_ready()
+                if ready and checks["dom"]:
+                    with span_recorder.span("dom"):
+                        ready = self.is_dom_ready(scroll=checks["scroll"])
+                if ready and checks["title"]:
+                    with span_recorder.span("title"):
+                        ready = self.is_title_valid(title=title, invalid_title=invalid_title)
                 if ready:
                     break
             except Exception as e:
@@ -141,17 +196,17 @@ class WhatsAppSendMsg:
         return ready
 
 
-    def get_page(self, url, title=None, invalid_title=None):
+    def get_page(self, url, title=None, invalid_title=None, profile="default"):
         try:
-            self.browser.get(url)
-            time.sleep(1)
-            return self.is_page_ready(title=title, invalid_title=invalid_title)
+            with span_recorder.span("page_load"):
+                self.driver.get(url)
+            return self.is_page_ready(title=title, invalid_title=invalid_title, profile=profile)
         except TimeoutException as e:
             print("WhatsAppSendMsg.get_page Error1: ", e, traceback.format_exc())
             if self.retry<=self.max_retries:
                 self.retry += 1
                 # self.config_browser()
-                return self.get_page(url, title)
+                return self.get_page(url, title, invalid_title, profile)
             return False
         except Exception as e:
             print("WhatsAppSendMsg.get_page Error2: ", e, traceback.format_exc())
@@ -159,7 +214,21 @@ class WhatsAppSendMsg:
 
     def test_browser_ok(self):
         print("Testing browser")
-        if self.get_page(HEALTH_CHECK_URL, HEALTH_CHECK_TITLE):
+        if HEALTH_CHECK_URL=="local":
+            url, title = HEALTH_PROBE_URL, HEALTH_PROBE_TITLE
+        else:
+            url, title = HEALTH_CHECK_URL, HEALTH_CHECK_TITLE
+        start_time = time.time()
+        ok = False
+        # not a page_load of a row, the probe has its own stage
+        with span_recorder.span("health_probe"):
+            try:
+                self.driver.get(url)
+                ok = self.is_title_valid(title)
+            except Exception as e:
+                print("WhatsAppSendMsg.test_browser_ok Error: ", e, traceback.format_exc())
+        print(f"Health probe took {time.time()-start_time} seconds")
+        if ok:
             self.not_ok = 0
             print("OK")
             return True
@@ -170,6 +239,10 @@ class WhatsAppSendMsg:
 
     
     def kill_browser_process(self, all=False):     
+        # the stand-in has no browser process
+        if getattr(self, "driver", None) is not None and getattr(self, "browser", None) is None:
+            self.driver.quit()
+            self.driver = None
         try:
             if hasattr(self, "browser") and self.browser is not None:
                 print("Killing browser instances and process")
@@ -208,7 +281,8 @@ class WhatsAppSendMsg:
                 except:
                     pass
 
-            if all:
+            # workers of a pool must not kill the browsers of other workers, nor the standby session
+            if all and self.worker_id is None and self.standby is None:
                 try:
                     for process in psutil.process_iter():
                         try:
@@ -233,6 +307,7 @@ class WhatsAppSendMsg:
                 not self.browser.service.is_connectable()):
                 print("Browser closed and webdriver process killed!")
                 self.browser = None
+                self.driver = None
             else:
                 print("Browser and Webdriver process NOT killed !!!!")
                 if self.force_kill:
@@ -419,12 +494,33 @@ class WhatsAppSendMsg:
 
     def config_browser(self):
         print("Configuring browser...")
-        chrome_driver_filename = 'undetected_chromedriver'
-        if not IS_POSIX:
-            chrome_driver_filename += '.exe'
-        chrome_driver_path = CHROME_DIR / chrome_driver_filename
-        self.patcher = Patcher(user_multi_procs=True)
-        self.patcher.auto(executable_path=chrome_driver_path)
+        self.is_app_loaded = False
+        if BROWSER_DRIVER=="stand_in":
+            print(f"Using the WhatsApp Web stand-in at {STAND_IN_URL}")
+            self.browser = None
+            self.driver = StandInDriver(STAND_IN_URL)
+            self.readiness.browser = self.driver
+            self.delivery.driver = self.driver
+            if not self.test_browser_ok():
+                raise Exception(f"The WhatsApp Web stand-in at {STAND_IN_URL} isn't running")
+            return
+        chrome_driver_path = self.chrome_driver_path
+        # the driver is picked for the installed chrome, it's looked up once
+        browser_version = local_chrome_version(self.find_chrome_executable())
+        print("Installed chrome version: ", browser_version)
+        if self.worker_id is None:
+            self.patcher = Patcher(user_multi_procs=True, browser_version=browser_version)
+            self.patcher.auto(executable_path=chrome_driver_path)
+        else:
+            with Patcher.lock:
+                if not chrome_driver_path.exists() or not Patcher(browser_version=browser_version).matches_browser(chrome_driver_path):
+                    shared_patcher = Patcher(user_multi_procs=True, browser_version=browser_version)
+                    shared_patcher.auto(executable_path=self.shared_chrome_driver_path)
+                    print(f"Copying chromedriver {shared_patcher.executable_path} for worker {self.worker_id}")
+                    shutil.copy2(shared_patcher.executable_path, chrome_driver_path)
+                    Patcher.record_copy(shared_patcher.executable_path, chrome_driver_path)
+                self.patcher = Patcher(browser_version=browser_version)
+                self.patcher.auto(executable_path=chrome_driver_path)
         options = ChromiumOptions()
         # options.page_load_strategy = "normal"
         options.add_argument("--disable-extensions")
@@ -451,8 +547,8 @@ class WhatsAppSendMsg:
         options.add_argument("--disable-dev-shm-usage")
         options.add_argument('--disable-application-cache')
         options.add_argument("--disable-session-crashed-bubble")
-        if USER_DATA_DIR.exists():
-            options.add_argument(f"user-data-dir={str(USER_DATA_DIR.absolute())}")
+        if self.user_data_dir.exists():
+            options.add_argument(f"user-data-dir={str(self.user_data_dir.absolute())}")
         options.add_experimental_option("useAutomationExtension", False)
         options.add_experimental_option("excludeSwitches", ["enable-automation", "enable-logging"])
         options.add_experimental_option("prefs", {
@@ -472,6 +568,9 @@ class WhatsAppSendMsg:
         service = ChromiumService(executable_path=chrome_driver_path)
         self.browser = webdriver.chrome.webdriver.WebDriver(service=service, options=options, keep_alive=False)
         self.browser._delay = 3
+        self.driver = SeleniumDriver(self.browser)
+        self.readiness.browser = self.driver
+        self.delivery.driver = self.driver
         # self.browser.user_data_dir = str(USER_DATA_DIR.absolute())
         self.browser.keep_user_data_dir = True
         if self.invisible:
@@ -493,270 +592,723 @@ class WhatsAppSendMsg:
     def get_prensented_elements(self, by_tuple, timeout=10):
         els = []
         try:
-            els = WebDriverWait(self.browser, timeout).until(EC.presence_of_all_elements_located(by_tuple))
+            els = self.driver.wait_present(by_tuple, timeout)
         except Exception as e:
             print(f"WhatsAppSendMsg.get_prensented_elements {e}")
             els = []
         return els
 
-    def get_clickable_element(self, by_tuple, timeout=20):
-        el = None
-        error = ""
-        sep = ""
+    def click_element(self, by_tuple, timeout=20):
+        """Clicks the element once it's visible and enabled, the lookup, the checks and the click are a single script"""
         try:
-            els = self.get_prensented_elements(by_tuple=by_tuple)
-            if len(els)>0:
-                el = els[0]
+            result = self.driver.click(by_tuple, timeout)
         except Exception as e:
-            error += f"Error1: {e}"
-            sep = "\n"
-        try:
-            el1 = WebDriverWait(self.browser, timeout).until(EC.element_to_be_clickable(by_tuple))
-            if el1 is not None:
-                el = el1
-        except Exception as e:
-            error += f"{sep}Error2: {e}"
-        if len(error)>0:
-            error = f"WhatsAppSendMsg.get_clickable_element {error}"
-            print(error)
-        return el
+            # the page got replaced while waiting, the element is looked up again
+            print(f"WhatsAppSendMsg.click_element script interrupted, retrying with webdriver waits: {e}")
+            result = BrowserDriver.click(self.driver, by_tuple, timeout)
+        if not result["ok"]:
+            print(f"WhatsAppSendMsg.click_element couldn't click {by_tuple[1]}: found: {result['found']}, visible: {result['visible']}, enabled: {result['enabled']}, error: {result['error']}")
+        return result["ok"]
 
 
     def cleanup_session_login(self):
         if self.is_title_valid(None) or self.is_title_valid(""):
             print("Re-configuring and Re-loging...")
-            if USER_DATA_DIR.exists():
+            if self.user_data_dir.exists():
                 self.kill_browser_process()
-                shutil.rmtree(USER_DATA_DIR)
-                USER_DATA_DIR.mkdir(exist_ok=True)
+                shutil.rmtree(self.user_data_dir)
+                self.user_data_dir.mkdir(exist_ok=True)
             self.kill_browser_process(all=True)
             self.config_browser()
             return self.login()
         return False
 
     def login(self):
-        if self.get_page(LOGIN_URL, LOGIN_TITLE):
-            time.sleep(3)
-            initial_startup_el = self.browser.find_elements(By.XPATH, "//div[@id='initial_startup']")
+        if self.get_page(LOGIN_URL, LOGIN_TITLE, profile="login"):
+            self.readiness.wait("startup", (By.XPATH, "//div[@id='initial_startup']"), present=False)
+            initial_startup_el = self.driver.find_elements((By.XPATH, "//div[@id='initial_startup']"))
             if len(initial_startup_el)==0:
-                landing_title_el = self.browser.find_elements(By.XPATH, "//div[@class='landing-title']")
+                landing_title_el = self.driver.find_elements((By.XPATH, "//div[@class='landing-title']"))
                 if len(landing_title_el)>0:
-                    self.browser.refresh()
-                else:
-                    time.sleep(10)
+                    self.driver.refresh()
+                elif self.readiness.wait("chats", CHAT_LIST_BY):
                     return True
             print("Please scan the QR Code to login!")
+            deadline = time.time() + batch_plan.login_timeout_secs
             while True:
-                if confirmation_input("Done with scanning QR code?", 'y/N')==True:
-                    initial_startup_el = self.browser.find_elements(By.XPATH, "//div[@id='initial_startup']")
+                if batch_plan.enabled:
+                    # nobody to answer, logged in once the chat list shows up before the deadline
+                    remaining = deadline - time.time()
+                    if remaining<=0:
+                        print(f"Not logged in within {batch_plan.login_timeout_secs} seconds, scan the QR code once without batch mode!")
+                        return False
+                    if self.readiness.wait("chats", CHAT_LIST_BY, deadline=remaining):
+                        return True
+                    time.sleep(min(5, max(deadline - time.time(), 0)))
+                elif confirmation_input("Done with scanning QR code?", 'y/N', key="qr_scanned")==True:
+                    initial_startup_el = self.driver.find_elements((By.XPATH, "//div[@id='initial_startup']"))
                     if len(initial_startup_el)==0:
-                        time.sleep(1)
                         print(f"Waiting for login redirect title {LOGIN_REDIRECT_TITLE}!")
-                        if not self.is_page_ready(LOGIN_REDIRECT_TITLE):
+                        if not self.is_page_ready(LOGIN_REDIRECT_TITLE, profile="login"):
                             if not self.is_title_valid(LOGIN_REDIRECT_TITLE):
                                 if not self.cleanup_session_login():
                                     print("Couldn't login!!! Re-loging....")
                                     return self.login()
-                        time.sleep(3)
-                        return True
-                    else:
-                        print("Not logged in yet. Possible reasons: \n1> Scanning not done yet! Please scan the QR code...\n2> Slow network, still loading...")
+                        if self.readiness.wait("chats", CHAT_LIST_BY):
+                            return True
+                    print("Not logged in yet. Possible reasons: \n1> Scanning not done yet! Please scan the QR code...\n2> Slow network, still loading...")
         return self.cleanup_session_login()
         
     def is_message_link_rendered(self):
         if MESSAGE_LINK_RENDERED_TITLE is not None and len(MESSAGE_LINK_RENDERED_TITLE)>0:
-            el = None
-            while not el:
-                by_tuple = (By.XPATH, f"//div[@id='main']//footer//div[@title='{MESSAGE_LINK_RENDERED_TITLE}']")
-                el = self.get_prensented_elements(by_tuple=by_tuple)
-                time.sleep(0.1)
+            by_tuple = (By.XPATH, f"//div[@id='main']//footer//div[@title='{MESSAGE_LINK_RENDERED_TITLE}']")
+            return self.readiness.wait("message_link", by_tuple)
+        return True
 
     def attach_message_image(self):
         by_tuple = (By.XPATH, f"//div[@id='main']//footer//div[@title='Type a message']")
-        el = self.get_clickable_element(by_tuple=by_tuple)
-        if el:
-            el.click()
-            ActionChains(self.browser).key_down(Keys.CONTROL).send_keys('v').perform()
+        if self.click_element(by_tuple):
+            self.driver.paste()
+
+    def attach_image_file(self, image_path):
+        if not image_path.exists():
+            print(f"Image {image_path} doesn't exist")
+            return False
+        by_tuple = (By.XPATH, "//div[@id='main']//footer//*[@title='Attach' or @data-icon='clip' or @data-icon='plus' or @data-icon='attach-menu-plus']")
+        self.click_element(by_tuple, timeout=5)
+        # file inputs take a path with send_keys even when they're hidden
+        by_tuple = (By.XPATH, "//div[@id='app']//input[@type='file' and contains(@accept, 'image')]")
+        els = self.get_prensented_elements(by_tuple=by_tuple, timeout=5)
+        if len(els)==0:
+            print("WhatsAppSendMsg.attach_image_file Error: there's no file input for images")
+            return False
+        els[0].send_keys(str(image_path.absolute()))
+        return self.readiness.wait("attachment", (By.XPATH, "//div[@id='app']//div[@aria-label='Send']"))
+
+    def attach_image(self, image_name):
+        """Attaches the image to the opened chat, returns whether there's an image to send"""
+        if image_name is None or len(image_name)==0:
+            return False
+        if self.attachment_mode=="clipboard":
+            with self.clipboard_lock or nullcontext():
+                if self.prepare_image(image_name):
+                    self.attach_message_image()
+                    return True
+            return False
+        return self.attach_image_file(MESSAGE_IMAGE_DIR / image_name)
 
     def click_send(self, send_button=True):
         if send_button:
             by_tuple = (By.XPATH, f"//div[@id='main']//footer//button[@aria-label='Send']")
         else:
             by_tuple = (By.XPATH, f"//div[@id='app']//div[@aria-label='Send']")
-        el = self.get_clickable_element(by_tuple)
-        if el:
-            el.click()
-            return True
+        return self.click_element(by_tuple)
+
+    def open_chat(self, url):
+        try:
+            if not self.driver.execute_script(OPEN_CHAT_SCRIPT, url):
+                return False
+            by_tuple = (By.XPATH, "//div[@id='main' and not(@data-stale-chat)]//footer")
+            if self.readiness.wait("chat", by_tuple):
+                print("Chat opened in-page")
+                return True
+            if not self.driver.execute_script(WARM_SESSION_SCRIPT):
+                # the link reloaded the page instead of being handled in-page
+                print("In-page chat opening isn't supported, disabling warm session")
+                self.warm_session = False
+                self.is_app_loaded = False
+        except Exception as e:
+            print("WhatsAppSendMsg.open_chat Error: ", e, traceback.format_exc())
         return False
 
+    def open_send_page(self, contact_number, text):
+        if self.warm_session and self.is_app_loaded:
+            with span_recorder.span("page_load"):
+                opened = self.open_chat(WARM_SEND_URL % (contact_number, text))
+            if opened:
+                return True
+            print("Falling back to reloading the page")
+        if self.reconciler is not None:
+            # the messages in flight can't be followed once the page is reloaded
+            self.reconciler.settle_all()
+        self.is_app_loaded = self.get_page(SEND_URL % (contact_number, text), LOGIN_TITLE, profile="send")
+        return self.is_app_loaded
+
     def wait_until_sent(self):
-        by_tuple = (By.XPATH, f"//div[@id='app']//span[@aria-label=' Pending ']")
-        els = self.get_prensented_elements(by_tuple=by_tuple, timeout=5)
-        while len(els)>0:
-            print("Message Pending...")
-            els = self.get_prensented_elements(by_tuple=by_tuple, timeout=1)
-        
+        """Waits for the message to be sent (or delivered or read, see delivery_wait_state), returns its status"""
+        state = self.delivery.wait()
+        print(f"Message {state or 'not seen'}")
+        return self.delivery.status(state)
+
+    def is_browser_alive(self):
+        try:
+            driver = getattr(self, "driver", None)
+            return driver is not None and driver.is_alive()
+        except Exception:
+            return False
+
+    def swap_browser(self, other):
+        """Exchanges the browser and its profile with another session"""
+        for attr in ("browser", "driver", "user_data_dir", "chrome_driver_path", "patcher", "is_app_loaded", "warm_session", "previous_image_name"):
+            mine, theirs = getattr(self, attr, None), getattr(other, attr, None)
+            setattr(self, attr, theirs)
+            setattr(other, attr, mine)
+        self.readiness.browser = self.delivery.driver = self.driver
+        other.readiness.browser = other.delivery.driver = other.driver
+
+    def recover(self, standby=None):
+        """Brings back a session whose browser died, by swapping the standby session in if there's one ready"""
+        standby = standby or self.standby
+        start_time = time.time()
+        recovered = False
+        with span_recorder.span("recovery"):
+            spare = standby.take() if standby is not None else None
+            if spare is not None:
+                print("Swapping the standby session in")
+                self.swap_browser(spare)
+                # the spare now has the dead browser, its profile is relaunched as the next spare
+                standby.prepare(spare)
+                recovered = True
+            else:
+                print("Restarting the session")
+                try:
+                    self.kill_browser_process()
+                    recovered = self.setup_session()
+                except Exception as e:
+                    print("WhatsAppSendMsg.recover Error: ", e, traceback.format_exc())
+        if recovered and standby is not None:
+            standby.recovered(time.time() - start_time)
+        elif recovered:
+            print(f"Session recovered in {time.time() - start_time} seconds")
+        return recovered
+
+    def setup_session(self):
+        max_retries = 3
+        retry = 0
+        while True:
+            try:
+                self.config_browser()
+                break
+            except Exception as e:
+                print("WhatsAppSendMsg.setup_session Error: ", e, traceback.format_exc())
+                retry += 1
+            if retry>max_retries:
+                raise Exception("Browser can't be configured at this moment!")
+        if self.login():
+            self.driver.wait_present((By.TAG_NAME, "title"), 20)
+            print("Logged in")
+            self.is_app_loaded = True
+            return True
+        return False
+
+    def prepare_image(self, image_name):
+        # with a shared clipboard another worker may have replaced the image
+        if self.clipboard_lock is None and self.previous_image_name==image_name:
+            return True
+        if send_image_to_clipboard(image_dir=MESSAGE_IMAGE_DIR, image_name=image_name):
+            self.previous_image_name = image_name
+            return True
+        return False
+
+    def process_row(self, text, contact_number, contact_name, image_name):
+        status = "Unknown"
+        if pd.isnull(contact_name):
+            contact_name = ""
+        image_name = clean_image_name(image_name)
+        contact_name = str(contact_name).strip()
+        print(f"Processing {contact_name}, {contact_number}")
+        with span_recorder.row(worker=self.worker_id, contact_number=contact_number, image=image_name) as row:
+            try:
+                if self.open_send_page(contact_number, text):
+                    with span_recorder.span("image_attach"):
+                        is_image_attached = self.attach_image(image_name)
+                    if not is_image_attached:
+                        with span_recorder.span("message_link"):
+                            self.is_message_link_rendered()
+                    with span_recorder.span("send_click"):
+                        # the message is followed from the moment it's added to the chat
+                        self.delivery.arm(contact_number)
+                        is_clicked = self.click_send(send_button=not is_image_attached)
+                    if is_clicked and self.reconciler is not None:
+                        print(f"######################## SENT, TO BE CONFIRMED: {contact_name}, {contact_number} ########################")
+                        status = IN_FLIGHT_STATUS
+                    elif is_clicked:
+                        with span_recorder.span("delivery_wait"):
+                            status = self.wait_until_sent()
+                        print(f"######################## {status.upper()}: {contact_name}, {contact_number} ########################")
+                    else:
+                        print(f"######################## Falied to SENT TO: {contact_name}, {contact_number} ########################")
+                        status = "Fail"
+            except Exception as e:
+                print("WhatsAppSendMsg.process_row Error: ", e, traceback.format_exc())
+                status = "Fail"
+            row.status = status
+        return status
+
     def start_sending_msg(self):
         try:
-            if not MESSAGE_BODY_FILE.exists():
-                print(f"There's not message body file {MESSAGE_BODY_FILE}")
-                return
-            message_body = None
-            with open(MESSAGE_BODY_FILE, "r", encoding="utf-8") as f:
-                message_body = f.read()
-            if message_body is None or len(message_body)==0:
-                print(f"There's no body in message body file {MESSAGE_BODY_FILE}")
-                return
-            print("Message body to send: ", message_body)
-
-            if CONTACT_FOLDER_PATH.exists():            
-                max_retries = 3
-                retry = 0
-                while True:
-                    try:
-                        self.config_browser()
-                        break
-                    except Exception as e:
-                        print("WhatsAppSendMsg.start_sending_msg Error: ", e, traceback.format_exc())
-                        retry += 1
-                    if retry>max_retries:
-                        raise Exception("Browser can't be configured at this moment!")
-                if self.login():
-                    WebDriverWait(self.browser, 20).until(EC.presence_of_element_located((By.TAG_NAME, "title")))
-                    print("Logged in")
-                    file_process_durations = []
-                    chunk_process_durations = []
-                    row_process_durations = []
+            message_template = MessageTemplate.load()
+            if message_template is None:
+                self.summary.fail("no message body")
+                return self.summary
+            if NATIONAL_NUMBER_LENGTH<=0:
+                print("Please set national_number_length in settings.config, the digits of a contact number without the country code!")
+                self.summary.fail("national_number_length isn't set")
+                return self.summary
+
+            if CONTACT_FOLDER_PATH.exists():
+                if self.setup_session():
+                    self.summary.logged_in = True
+                    if WARM_STANDBY:
+                        self.standby = StandbySession(lambda: WhatsAppSendMsg(invisible=self.invisible, debug=self.debug, worker_id="standby"))
+                        self.standby.prepare(wait=True)
+                    ledger = SendLedger()
+                    pipeline = SendPipeline()
+                    file_process_durations = StreamingHistogram()
+                    chunk_process_durations = StreamingHistogram()
                     start_time = time.time()
-                    for f in CONTACT_FOLDER_PATH.iterdir():
-                        filename = f.name
-                        if filename.startswith('~$') or filename=='Contacts Template.xlsx':continue
-                        if f.is_file() and f.suffix=='.xlsx':
-                            if not confirmation_input(f"Process {filename}?", 'N/y'):continue
-                            start_time1 = time.time()
-                            print(f"Processing {filename}")
-                            sheets = list(pd.read_excel(f, sheet_name=None))
-                            print("Total Sheets:", len(sheets))
-                            previous_image_name = None 
-                            is_image_in_clipboard = False                        
-                            sheets_df = {}
-                            for sheet in sheets:
-                                orginal_df = pd.read_excel(f, sheet_name=sheet)
-                                df = deepcopy(orginal_df)
-                                try:
-                                    has_contact_number_col = CONTACT_NUMBER_COLUMN_NAME in df
-                                    has_contact_name_col = CONTACT_NAME_COLUMN_NAME in df
-                                    has_image_name_col = IMAGE_NAME_COLUMN_NAME in df
-                                    has_status_col = STATUS_COLUMN_NAME in df
-                                    if has_contact_number_col and has_contact_name_col and has_image_name_col and has_status_col:
-                                        size = roundoff(NUMBER_OF_ROWS_TO_PROCESS)
-                                        chunks = chunker(df, size)
-                                        no_of_chunks = roundoff(len(df)/NUMBER_OF_ROWS_TO_PROCESS)
-                                        if no_of_chunks==0:
-                                            no_of_chunks = 1
-                                        print("no_of_chunks: ", no_of_chunks, NUMBER_OF_ROWS_TO_PROCESS, size)
-                                        for i, chunk in enumerate(chunks):
-                                            if not confirmation_input(f"Process chunk {i+1}/{no_of_chunks} of sheet '{sheet}'?", 'N/y'):continue
-                                            print(f"Processing chunk {i+1}/{no_of_chunks} of sheet '{sheet}'")
-                                            start_time2 = time.time()
-                                            for row in chunk.iterrows():
-                                                start_time3 = time.time()
-                                                status = "Unknown"
-                                                idx = row[0]
-                                                r = row[1]
-                                                contact_number = r[CONTACT_NUMBER_COLUMN_NAME]
-                                                contact_name = r[CONTACT_NAME_COLUMN_NAME]
-                                                image_name = r[IMAGE_NAME_COLUMN_NAME]
-                                                if pd.isnull(contact_number):continue
-                                                if pd.isnull(contact_name):
-                                                    contact_name = ""
-                                                if pd.isnull(image_name):
-                                                    image_name = None
-                                                    is_image_in_clipboard = False
-                                                else:
-                                                    image_name = str(image_name).strip()
-                                                    if len(image_name)==0:
-                                                        is_image_in_clipboard = False
-                                                    elif previous_image_name!=image_name:
-                                                        is_image_in_clipboard = send_image_to_clipboard(
-                                                            image_dir=MESSAGE_IMAGE_DIR, 
-                                                            image_name=image_name
-                                                        )
-                                                        if is_image_in_clipboard:
-                                                            previous_image_name = image_name
-                                                contact_number = str(contact_number).strip()
-                                                contact_name = str(contact_name).strip()
-                                                if not contact_number.startswith(f"+{COUNTRY_CODE}"):
-                                                    contact_number = f"+{COUNTRY_CODE}{contact_number.lstrip(COUNTRY_CODE)}"
-                                                print(f"Processing {contact_name}, {contact_number}")
-                                                try:
-                                                    text = urllib.parse.urlencode({'text' : message_body.format(contact_name=contact_name)})
-                                                    send_url = SEND_URL % (contact_number, text)
-                                                    if self.get_page(send_url, LOGIN_TITLE):
-                                                        if is_image_in_clipboard:
-                                                            self.attach_message_image()
-                                                        else:
-                                                            self.is_message_link_rendered()
-                                                        if self.click_send(send_button=not is_image_in_clipboard):
-                                                            self.wait_until_sent()
-                                                            print(f"######################## SENT TO: {contact_name}, {contact_number} ########################")
-                                                            status = "Success"
-                                                        else:
-                                                            print(f"######################## Falied to SENT TO: {contact_name}, {contact_number} ########################")
-                                                            status = "Fail"
-                                                except Exception as e:
-                                                    print("WhatsAppSendMsg.start_sending_msg Error1: ", e, traceback.format_exc())
-                                                    status = "Fail"
-                                                orginal_df[STATUS_COLUMN_NAME][idx] = status
-                                                row_process_duration = time.time()-start_time3
-                                                row_process_durations.append(row_process_duration)
-                                            chunk_process_duration = time.time()-start_time2
-                                            chunk_process_durations.append(chunk_process_duration)
-                                            print(f"Processing of chunk {i+1}/{no_of_chunks} of sheet '{sheet}' took: {chunk_process_duration} seconds.")
-                                    else:
-                                        if not has_contact_number_col:
-                                            raise Exception(f"{filename} has missing column: '{CONTACT_NUMBER_COLUMN_NAME}'")
-                                        elif not has_contact_name_col:
-                                            raise Exception(f"{filename} has missing column: '{CONTACT_NAME_COLUMN_NAME}'")
-                                        elif not has_image_name_col:
-                                            raise Exception(f"{filename} has missing column: '{IMAGE_NAME_COLUMN_NAME}'")
-                                        elif not has_status_col:
-                                            raise Exception(f"{filename} has missing column: '{STATUS_COLUMN_NAME}'")      
-                                except Exception as e:
-                                    print("WhatsAppSendMsg.start_sending_msg Error2 : ", e, traceback.format_exc())
-                                sheets_df[sheet] = orginal_df
-                            file_process_duration = time.time() - start_time1
-                            file_process_durations.append(file_process_duration)
-                            print(f"Processing of filename '{filename}' took: {file_process_duration} seconds.")
-
-                            if confirmation_input(f"\n###################### Please close '{filename}' if it's opened anywhere. ######################\nClosed?", 'N/y'):
-                                with pd.ExcelWriter(f, engine="openpyxl", mode="w") as writer:
-                                    for sheet, df in sheets_df.items():
-                                        df.to_excel(writer, sheet_name=sheet, index=False)
-
-                    print(f"""Row processing duration metrics:
-                          Max: {max(row_process_durations)}
-                          Min: {min(row_process_durations)}
-                          Avg: {np.average(row_process_durations)}
-                          Mean: {np.mean(row_process_durations)}""")
-                    print(f"""Chunk processing duration metrics:
-                          Max: {max(chunk_process_durations)}
-                          Min: {min(chunk_process_durations)}
-                          Avg: {np.average(chunk_process_durations)}
-                          Mean: {np.mean(chunk_process_durations)}""")
-                    print(f"""File processing duration metrics:
-                          Max: {max(file_process_durations)}
-                          Min: {min(file_process_durations)}
-                          Avg: {np.average(file_process_durations)}
-                          Mean: {np.mean(file_process_durations)}""")
+                    sources, dedup_index = prepare_contact_sources(message_template)
+                    for source in sources:
+                        filename = source.name
+                        start_time1 = time.time()
+                        print(f"Processing {filename}")
+                        sheets = source.sheets()
+                        print("Total Sheets:", len(sheets))
+                        status_writer = StatusWriter(source)
+                        validator = ContactValidator(filename, dedup_index)
+                        for sheet in sheets:
+                            try:
+                                columns = source.columns(sheet)
+                                check_sheet_columns(columns, filename, message_template)
+                                stages = SheetSender(self, message_template, status_writer, filename, sheet, ledger, self.rate_limiter)
+                                for i, no_of_chunks, chunk in iter_chunks(source.rows(sheet), source.count(sheet), sheet):
+                                    start_time2 = time.time()
+                                    # validation and everything else about the next rows is done while a row is sent
+                                    errors = pipeline.run(iter_validated_rows(validator, sheet, chunk, self.attachment_mode), stages.prepare, stages.send, stages.write, stages.flush)
+                                    for idx, *_ in errors:
+                                        status_writer.update(sheet, idx, "Fail")
+                                    chunk_process_duration = time.time()-start_time2
+                                    chunk_process_durations.observe(chunk_process_duration)
+                                    print(f"Processing of chunk {i+1}/{no_of_chunks} of sheet '{sheet}' took: {chunk_process_duration} seconds.")
+                                    status_writer.flush()
+                            except Exception as e:
+                                print("WhatsAppSendMsg.start_sending_msg Error2 : ", e, traceback.format_exc())
+                                self.summary.add_error(f"{filename} '{sheet}': {e}")
+                        status_writer.flush(final=True)
+                        self.summary.add_file(filename, status_writer.counts)
+                        validator.close()
+                        source.close()
+                        file_process_duration = time.time() - start_time1
+                        file_process_durations.observe(file_process_duration)
+                        print(f"Processing of filename '{filename}' took: {file_process_duration} seconds.")
+
+                    span_recorder.report()
+                    chunk_process_durations.report("Chunk processing duration")
+                    file_process_durations.report("File processing duration")
+                    ledger.close()
+                    if dedup_index is not None:
+                        dedup_index.close()
+                    message_template.report()
+                    image_payload_cache.report()
+                    pipeline.report()
+                    self.rate_limiter.report()
+                    if self.standby is not None:
+                        self.standby.report()
+                        self.standby.close()
+                    self.readiness.report()
+                    self.delivery.report()
+                    if self.reconciler is not None:
+                        self.reconciler.report()
                     print(f"Total processing time: {time.time() -start_time} seconds.")                
                     print("######################## COMPLETED ########################")
                 else:
                     print("Couldn't log in !!!")
+                    self.summary.fail("couldn't log in")
+            else:
+                self.summary.fail(f"there's no contact folder {CONTACT_FOLDER_PATH}")
         except Exception as e:
             print("WhatsAppSendMsg.start_sending_msg Error2: ", e, traceback.format_exc())
+            self.summary.fail(e)
+        finally:
+            self.summary.finished_at = time.time()
         # self.kill_browser_process()
-            
+        return self.summary
+
+
+class WhatsAppSendMsgPool:
+    def __init__(self, workers=2, invisible=True, debug=False) -> None:
+        self.workers = [
+            WhatsAppSendMsg(invisible=invisible, debug=debug, worker_id=i+1)
+            for i in range(workers)
+        ]
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.clipboard_lock = threading.Lock()
+        self.max_restarts = 3
+        self.ledger = None
+        self.summary = RunSummary()
+        self.stats = {}
+        self.standby = None
+        self.standby_lock = threading.Lock()
+        if WARM_STANDBY:
+            # one spare for all the workers
+            self.standby = StandbySession(lambda: WhatsAppSendMsg(invisible=invisible, debug=debug, worker_id="standby"))
+        for worker in self.workers:
+            worker.clipboard_lock = self.clipboard_lock
+            self.stats[worker.worker_id] = {
+                "alive": False,
+                "restarts": 0,
+                "processed": 0,
+                "success": 0,
+                "busy_secs": 0.0,
+            }
+
+    def setup_workers(self):
+        # logins are done one after another as they may ask to scan the QR code
+        for worker in self.workers:
+            print(f"Setting up worker {worker.worker_id}...")
+            try:
+                self.stats[worker.worker_id]["alive"] = worker.setup_session()
+            except Exception as e:
+                print(f"WhatsAppSendMsgPool.setup_workers Error (worker {worker.worker_id}): ", e, traceback.format_exc())
+            if not self.stats[worker.worker_id]["alive"]:
+                print(f"Worker {worker.worker_id} couldn't log in, it won't send messages!")
+                worker.kill_browser_process()
+        if self.standby is not None:
+            print("Setting up the standby session...")
+            self.standby.prepare(wait=True)
+        return any(stats["alive"] for stats in self.stats.values())
+
+    def restart_worker(self, worker):
+        stats = self.stats[worker.worker_id]
+        while stats["restarts"]<self.max_restarts:
+            stats["restarts"] += 1
+            print(f"Restarting worker {worker.worker_id} ({stats['restarts']}/{self.max_restarts})...")
+            # the standby session can only be taken by one worker at once
+            with self.standby_lock:
+                if worker.recover(self.standby):
+                    return True
+        stats["alive"] = False
+        print(f"Worker {worker.worker_id} stopped after {stats['restarts']} restarts!")
+        return False
+
+    def work(self, worker, results):
+        stats = self.stats[worker.worker_id]
+        while stats["alive"]:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            key, ledger_key, text, contact_number, contact_name, image_name = item
+            worker.rate_limiter.acquire()
+            start_time = time.time()
+            try:
+                status = worker.process_row(text, contact_number, contact_name, image_name)
+            except Exception as e:
+                print(f"WhatsAppSendMsgPool.work Error (worker {worker.worker_id}): ", e, traceback.format_exc())
+                status = "Fail"
+            if status not in KEEP_STATUSES and not worker.is_browser_alive():
+                worker.rate_limiter.observe(time.time()-start_time, status)
+                # hand the row over to another worker and bring this one back if possible
+                self.queue.put(item)
+                if not self.restart_worker(worker):
+                    break
+                continue
+            job = {"key": key, "ledger_key": ledger_key, "status": status, "latency": time.time()-start_time}
+            if status==IN_FLIGHT_STATUS:
+                # kept by the ledger right away so a crash doesn't send it again, overwritten once confirmed
+                self.ledger.record(ledger_key, IN_FLIGHT_STATUS)
+                self.record(worker, worker.reconciler.add(job, worker.delivery.current), results)
+            else:
+                self.record(worker, [job], results)
+        if worker.reconciler is not None:
+            self.record(worker, worker.reconciler.drain(), results)
+
+    def record(self, worker, jobs, results):
+        stats = self.stats[worker.worker_id]
+        for job in jobs:
+            worker.rate_limiter.observe(job["latency"], job["status"])
+            self.ledger.record(job["ledger_key"], job["status"])
+            with self.lock:
+                results[job["key"]] = job["status"]
+                stats["processed"] += 1
+                stats["success"] += job["status"] in SENT_STATUSES
+                stats["busy_secs"] += job["latency"]
+
+    def run_rows(self, rows):
+        results = {}
+        for row in rows:
+            self.queue.put(row)
+        threads = [
+            threading.Thread(target=self.work, args=(worker, results), daemon=True)
+            for worker in self.workers if self.stats[worker.worker_id]["alive"]
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        left = 0
+        while not self.queue.empty():
+            key, *_ = self.queue.get_nowait()
+            results[key] = "Unknown"
+            left += 1
+        if left>0:
+            print(f"No worker left to process {left} rows!")
+        return results
+
+    def report(self, elapsed):
+        elapsed_mins = max(elapsed, 1e-9)/60
+        total = 0
+        for worker_id, stats in self.stats.items():
+            total += stats["processed"]
+            print(f"""Worker {worker_id} metrics:
+                          Alive: {"Yes" if stats["alive"] else "No"}
+                          Restarts: {stats["restarts"]}
+                          Processed: {stats["processed"]}
+                          Success: {stats["success"]}
+                          Msgs/min: {stats["processed"]/elapsed_mins}""")
+        print(f"Total processed: {total}, Msgs/min: {total/elapsed_mins}")
+
+    def start_sending_msg(self):
+        try:
+            message_template = MessageTemplate.load()
+            if message_template is None:
+                self.summary.fail("no message body")
+                return self.summary
+            if NATIONAL_NUMBER_LENGTH<=0:
+                print("Please set national_number_length in settings.config, the digits of a contact number without the country code!")
+                self.summary.fail("national_number_length isn't set")
+                return self.summary
+            if not CONTACT_FOLDER_PATH.exists():
+                self.summary.fail(f"there's no contact folder {CONTACT_FOLDER_PATH}")
+                return self.summary
+            if not self.setup_workers():
+                print("Couldn't log in !!!")
+                self.summary.fail("couldn't log in")
+                return self.summary
+            self.summary.logged_in = True
+            self.ledger = SendLedger()
+            start_time = time.time()
+            sources, dedup_index = prepare_contact_sources(message_template)
+            for source in sources:
+                filename = source.name
+                print(f"Processing {filename}")
+                sheets = source.sheets()
+                print("Total Sheets:", len(sheets))
+                status_writer = StatusWriter(source)
+                validator = ContactValidator(filename, dedup_index)
+                for sheet in sheets:
+                    try:
+                        columns = source.columns(sheet)
+                        check_sheet_columns(columns, filename, message_template)
+                        for i, no_of_chunks, chunk in iter_chunks(source.rows(sheet), source.count(sheet), sheet):
+                            rows = []
+                            for idx, r, contact_number, status in schedule_rows(validator.validate(sheet, chunk), self.workers[0].attachment_mode):
+                                if status is None:
+                                    ledger_key = make_ledger_key(filename, sheet, idx, message_template, contact_number, r)
+                                    status = self.ledger.sent_status(ledger_key)
+                                if status is not None:
+                                    status_writer.update(sheet, idx, status)
+                                    continue
+                                rows.append((
+                                    idx,
+                                    ledger_key,
+                                    message_template.encode(r),
+                                    contact_number,
+                                    r.get(CONTACT_NAME_COLUMN_NAME),
+                                    r.get(IMAGE_NAME_COLUMN_NAME)
+                                ))
+                            print(f"{len(chunk)-len(rows)} rows are skipped as empty, invalid, duplicate or already sent")
+                            for idx, status in self.run_rows(rows).items():
+                                status_writer.update(sheet, idx, status)
+                            status_writer.flush()
+                    except Exception as e:
+                        print("WhatsAppSendMsgPool.start_sending_msg Error1: ", e, traceback.format_exc())
+                        self.summary.add_error(f"{filename} '{sheet}': {e}")
+                status_writer.flush(final=True)
+                self.summary.add_file(filename, status_writer.counts)
+                validator.close()
+                source.close()
+                self.report(time.time()-start_time)
+            if dedup_index is not None:
+                dedup_index.close()
+            message_template.report()
+            image_payload_cache.report()
+            span_recorder.report()
+            if self.standby is not None:
+                self.standby.report()
+            for worker in self.workers:
+                print(f"Worker {worker.worker_id} readiness:")
+                worker.readiness.report()
+                worker.rate_limiter.report()
+                worker.delivery.report()
+                if worker.reconciler is not None:
+                    worker.reconciler.report()
+            print(f"Total processing time: {time.time() -start_time} seconds.")
+            print("######################## COMPLETED ########################")
+        except Exception as e:
+            print("WhatsAppSendMsgPool.start_sending_msg Error2: ", e, traceback.format_exc())
+            self.summary.fail(e)
+        finally:
+            self.summary.finished_at = time.time()
+            if self.ledger is not None:
+                self.ledger.close()
+            if self.standby is not None:
+                self.standby.close()
+            for worker in self.workers:
+                worker.kill_browser_process()
+        return self.summary
+
+
+class SheetSender:
+    """
+    The stages of the send pipeline for the rows of a sheet.
+    Without a ledger the rows aren't looked up nor recorded, without a rate limiter they aren't paced, e.g. in the benchmarks.
+    """
+    def __init__(self, wp, message_template, status_writer, filename, sheet, ledger=None, rate_limiter=None) -> None:
+        self.wp = wp
+        self.message_template = message_template
+        self.status_writer = status_writer
+        self.filename = filename
+        self.sheet = sheet
+        self.ledger = ledger
+        self.rate_limiter = rate_limiter
+
+    def prepare(self, row):
+        idx, r, contact_number, status = row
+        job = {"idx": idx, "status": status}
+        if status is not None:
+            return job
+        if self.ledger is not None:
+            job["ledger_key"] = make_ledger_key(self.filename, self.sheet, idx, self.message_template, contact_number, r)
+            job["status"] = self.ledger.sent_status(job["ledger_key"])
+            if job["status"] is not None:
+                print(f"Skipping row {idx} of sheet '{self.sheet}', status in ledger: {job['status']}")
+                return job
+        job["text"] = self.message_template.encode(r)
+        job["contact_number"] = contact_number
+        job["contact_name"] = r.get(CONTACT_NAME_COLUMN_NAME)
+        job["image_name"] = clean_image_name(r.get(IMAGE_NAME_COLUMN_NAME))
+        stage_image(job["image_name"], self.wp.attachment_mode)
+        return job
+
+    def send(self, job):
+        """Returns the rows settled, the row itself unless it's left in flight"""
+        wp = self.wp
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        start_time = time.time()
+        job["status"] = wp.process_row(job["text"], job["contact_number"], job["contact_name"], job["image_name"])
+        if job["status"] not in KEEP_STATUSES and not wp.is_browser_alive() and wp.recover():
+            job["status"] = wp.process_row(job["text"], job["contact_number"], job["contact_name"], job["image_name"])
+        job["sent"] = True
+        job["latency"] = time.time()-start_time
+        if job["status"]==IN_FLIGHT_STATUS:
+            if self.ledger is not None:
+                # kept by the ledger right away so a crash doesn't send it again, overwritten once confirmed
+                self.ledger.record(job["ledger_key"], IN_FLIGHT_STATUS)
+            return self.settled(wp.reconciler.add(job, wp.delivery.current))
+        return self.settled([job])
+
+    def settled(self, jobs):
+        if self.rate_limiter is not None:
+            for job in jobs:
+                self.rate_limiter.observe(job["latency"], job["status"])
+        return jobs
+
+    def flush(self):
+        return self.settled(self.wp.reconciler.drain()) if self.wp.reconciler is not None else []
+
+    def write(self, job):
+        if job.get("sent") and self.ledger is not None:
+            self.ledger.record(job["ledger_key"], job["status"])
+        self.status_writer.update(self.sheet, job["idx"], job["status"])
+
+
+def make_ledger_key(filename, sheet, idx, message_template, contact_number, r):
+    return SendLedger.make_key(filename, sheet, idx, contact_number, message_template.render(r))
+
+
+def clean_image_name(image_name):
+    if pd.isnull(image_name):
+        return None
+    image_name = str(image_name).strip()
+    return image_name if len(image_name)>0 else None
+
+
+def stage_image(image_name, attachment_mode):
+    # pasted images are encoded ahead, uploaded ones are read by the browser itself
+    if image_name is not None and attachment_mode=="clipboard":
+        image_payload_cache.prefetch(MESSAGE_IMAGE_DIR / image_name)
+
+
+def schedule_rows(validated, attachment_mode):
+    """
+    Yields the validated rows of a chunk, grouped by their image if group_rows_by_image is set,
+    keeping their order within a group. The image of the next group is staged while a group is sent.
+    """
+    if not GROUP_ROWS_BY_IMAGE:
+        yield from validated
+        return
+    groups = {}
+    for row in validated:
+        groups.setdefault(clean_image_name(row[1].get(IMAGE_NAME_COLUMN_NAME)), []).append(row)
+    images = list(groups)
+    print(f"Rows grouped by {len(images)} images")
+    if len(images)>0:
+        stage_image(images[0], attachment_mode)
+    for i, image_name in enumerate(images):
+        if i+1<len(images):
+            stage_image(images[i+1], attachment_mode)
+        yield from groups[image_name]
+
+
+def iter_validated_rows(validator, sheet, chunk, attachment_mode):
+    yield from schedule_rows(validator.validate(sheet, chunk), attachment_mode)
+
+
+def prepare_contact_sources(message_template):
+    """Opens all the contact files selected to process and indexes their numbers to skip the duplicates of all of them"""
+    sources = [open_contact_source(f) for f in iter_contact_files()]
+    check = lambda columns, filename: check_sheet_columns(columns, filename, message_template)
+    dedup_index = build_dedup_index(sources, check=check) if len(sources)>0 else None
+    return sources, dedup_index
+
+
+def iter_contact_files():
+    for f in CONTACT_FOLDER_PATH.iterdir():
+        filename = f.name
+        if filename.startswith('~$') or filename=='Contacts Template.xlsx':continue
+        if f.is_file() and f.suffix.lower() in CONTACT_SOURCES:
+            if not confirmation_input(f"Process {filename}?", 'N/y', key="process_file", subject=filename):continue
+            yield f
+
+
+def validate_sheet_columns(columns, filename):
+    for column in [CONTACT_NUMBER_COLUMN_NAME, CONTACT_NAME_COLUMN_NAME, IMAGE_NAME_COLUMN_NAME, STATUS_COLUMN_NAME]:
+        if column not in columns:
+            raise Exception(f"{filename} has missing column: '{column}'")
+
+
+def check_sheet_columns(columns, filename, message_template):
+    """Raises for a sheet which can't be sent"""
+    validate_sheet_columns(columns, filename)
+    message_template.validate(columns, filename)
+
+
+def iter_chunks(rows, total, sheet):
+    """Chunks of the rows of a sheet, the statuses are written back after each of them"""
+    size = CHUNK_SIZE
+    chunks = chunker(rows, size)
+    if total is None:
+        # the sheet doesn't tell its size, it's not read ahead just to count the rows
+        no_of_chunks = "?"
+    else:
+        no_of_chunks = max(math.ceil(total/size), 1) if size>0 else 1
+    print("no_of_chunks: ", no_of_chunks, size)
+    for i, chunk in enumerate(chunks):
+        print(f"Processing chunk {i+1}/{no_of_chunks} of sheet '{sheet}'")
+        yield i, no_of_chunks, chunk
 
 
 if __name__ == "__main__":
@@ -784,11 +1336,110 @@ if __name__ == "__main__":
         help="Run script with debug mode, default: off"
     )
 
+    parser.add_argument(
+        "-w",
+        "--workers",
+        dest="WORKERS",
+        type=int,
+        default=1,
+        required=False,
+        help="Number of browsers sending messages in parallel, each with its own login, default: 1"
+    )
+
+    parser.add_argument(
+        "-b",
+        "--batch",
+        dest="BATCH",
+        action='store_true',
+        default=False,
+        required=False,
+        help="Run without any prompt, the answers are taken from the options below and the run plan, default: off"
+    )
+
+    parser.add_argument(
+        "--plan",
+        dest="PLAN",
+        default=None,
+        required=False,
+        help="Run plan json file of the batch mode: files, write_back, login_timeout_secs, summary_file, workers, invisible, debug"
+    )
+
+    parser.add_argument(
+        "--files",
+        dest="FILES",
+        nargs="+",
+        default=None,
+        required=False,
+        help="Contact files (or patterns) to process in batch mode, default: all of them"
+    )
+
+    parser.add_argument(
+        "--no-write-back",
+        dest="WRITE_BACK",
+        action='store_false',
+        default=None,
+        required=False,
+        help="Don't write the statuses back to the contact files in batch mode"
+    )
+
+    parser.add_argument(
+        "--login-timeout",
+        dest="LOGIN_TIMEOUT",
+        type=float,
+        default=None,
+        required=False,
+        help="Seconds to wait for the login in batch mode, default: 300"
+    )
+
+    parser.add_argument(
+        "--summary",
+        dest="SUMMARY",
+        default=None,
+        required=False,
+        help="Json file to write the run summary to, the exit code is 0 if all the rows went fine, 2 if some didn't and 1 if the run failed"
+    )
+
+    parser.add_argument(
+        "--metrics-port",
+        dest="METRICS_PORT",
+        type=int,
+        default=METRICS_PORT,
+        required=False,
+        help="Serve the prometheus metrics of the run at http://127.0.0.1:<port>/metrics, default: metrics_port of settings.config (0: off)"
+    )
+
     args = parser.parse_args(argv[1:])
     print(parser.description)
+    if args.BATCH or args.PLAN is not None:
+        batch_plan.load(
+            args.PLAN,
+            files=args.FILES,
+            write_back=args.WRITE_BACK,
+            login_timeout_secs=args.LOGIN_TIMEOUT,
+            summary_file=args.SUMMARY
+        )
+        # the options of the plan unless given on the command line
+        for option, dest, default in [("invisible", "INVISIBLE", False), ("debug", "DEBUG", False), ("workers", "WORKERS", 1)]:
+            if option in batch_plan.options and getattr(args, dest)==default:
+                setattr(args, dest, type(default)(batch_plan.options[option]))
     INVISIBLE = args.INVISIBLE
     DEBUG = args.DEBUG
+    WORKERS = args.WORKERS
+    print("BATCH: ", batch_plan.enabled)
     print("INVISIBLE: ", INVISIBLE)
     print("DEBUG: ", DEBUG)
-    wp_scraper = WhatsAppSendMsg(invisible=INVISIBLE, debug=DEBUG)
-    wp_scraper.start_sending_msg()
+    print("WORKERS: ", WORKERS)
+    if WORKERS>1:
+        wp_scraper = WhatsAppSendMsgPool(workers=WORKERS, invisible=INVISIBLE, debug=DEBUG)
+    else:
+        wp_scraper = WhatsAppSendMsg(invisible=INVISIBLE, debug=DEBUG)
+    if args.METRICS_PORT>0:
+        span_recorder.serve(args.METRICS_PORT)
+    summary = wp_scraper.start_sending_msg()
+    span_recorder.close()
+    summary_file = args.SUMMARY or batch_plan.summary_file
+    if summary_file is not None:
+        summary.write(summary_file)
+    if batch_plan.enabled:
+        print(json.dumps(summary.to_dict()))
+    sys.exit(summary.exit_code())
@@ -0,0 +1,222 @@
+import json
+import math
+import time
+import threading
+from pathlib import Path
+from collections import Counter
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from settings import METRICS_PORT, SPANS_FILE
+
+
+PERCENTILES = (50, 95, 99)
+
+
+class StreamingHistogram:
+    """
+    Durations counted in log spaced buckets about 2% wide,
+    so the percentiles of any number of samples are estimated in constant memory.
+    """
+    def __init__(self, growth=1.02, min_value=1e-4) -> None:
+        self.growth = growth
+        self.min_value = min_value
+        self.log_growth = math.log(growth)
+        self.buckets = Counter()
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        value = max(float(value), 0.0)
+        if value<=self.min_value:
+            bucket = 0
+        else:
+            bucket = int(math.log(value / self.min_value) / self.log_growth) + 1
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, q):
+        if self.count==0:
+            return None
+        rank = max(math.ceil(self.count * q / 100), 1)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen>=rank:
+                # the middle of the bucket, never outside of what was observed
+                value = self.min_value * self.growth ** (bucket - 0.5) if bucket>0 else self.min_value
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def stats(self):
+        stats = {
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "avg": self.sum / self.count if self.count>0 else None,
+        }
+        for q in PERCENTILES:
+            stats[f"p{q}"] = self.percentile(q)
+        return stats
+
+    def report(self, label):
+        if self.count==0:
+            print(f"{label} metrics: nothing processed")
+            return
+        stats = self.stats()
+        print(f"""{label} metrics:
+                          Count: {stats["count"]}
+                          Max: {stats["max"]}
+                          Min: {stats["min"]}
+                          Avg: {stats["avg"]}
+                          P50: {stats["p50"]}
+                          P95: {stats["p95"]}
+                          P99: {stats["p99"]}""")
+
+
+class RowSpan:
+    def __init__(self, attrs) -> None:
+        self.attrs = attrs
+        self.start = time.time()
+        self.stages = {}
+        self.status = None
+
+    def add(self, stage, duration):
+        self.stages[stage] = self.stages.get(stage, 0.0) + duration
+
+
+class SpanRecorder:
+    """
+    Time spent by every row in each stage of sending it: page_load, head, dom, title, message_link, image_attach, send_click, delivery_wait.
+    Every row is appended to a jsonl file, the stages are summed up in streaming histograms.
+    The stages are attributed to the row being processed by the current thread, so every worker has its own.
+    """
+    def __init__(self, path=SPANS_FILE) -> None:
+        self.path = path
+        self.fh = None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.histograms = {}
+        self.statuses = Counter()
+        self.server = None
+
+    def _histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms.setdefault(name, StreamingHistogram())
+        return histogram
+
+    @contextmanager
+    def row(self, **attrs):
+        row = RowSpan(attrs)
+        self.local.row = row
+        try:
+            yield row
+        finally:
+            self.local.row = None
+            self._finish(row)
+
+    @contextmanager
+    def span(self, stage):
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            duration = time.time() - start_time
+            row = getattr(self.local, "row", None)
+            if row is not None:
+                row.add(stage, duration)
+            with self.lock:
+                self._histogram(stage).observe(duration)
+
+    def _finish(self, row):
+        duration = time.time() - row.start
+        record = dict(row.attrs, start=row.start, duration=duration, status=row.status, stages=row.stages)
+        with self.lock:
+            self._histogram("row").observe(duration)
+            self.statuses[row.status] += 1
+            if self.path is not None:
+                if self.fh is None:
+                    Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+                    self.fh = open(self.path, "a", encoding="utf-8")
+                self.fh.write(json.dumps(record, default=str) + "\n")
+                self.fh.flush()
+
+    def reset(self):
+        """Forgets the stages recorded so far, the rows already written to the spans file are kept"""
+        with self.lock:
+            self.histograms = {}
+            self.statuses = Counter()
+
+    def stats(self):
+        with self.lock:
+            return {name: histogram.stats() for name, histogram in self.histograms.items()}
+
+    def prometheus_text(self):
+        lines = [
+            "# HELP whatsapp_send_stage_seconds Time spent by the rows in each stage of sending them",
+            "# TYPE whatsapp_send_stage_seconds summary",
+        ]
+        for stage, stats in self.stats().items():
+            for q in PERCENTILES:
+                if stats[f"p{q}"] is not None:
+                    lines.append(f'whatsapp_send_stage_seconds{{stage="{stage}",quantile="{q/100}"}} {stats[f"p{q}"]}')
+            lines.append(f'whatsapp_send_stage_seconds_sum{{stage="{stage}"}} {stats["sum"]}')
+            lines.append(f'whatsapp_send_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+        lines.append("# HELP whatsapp_send_rows_total Rows processed by status")
+        lines.append("# TYPE whatsapp_send_rows_total counter")
+        with self.lock:
+            statuses = dict(self.statuses)
+        for status, count in statuses.items():
+            lines.append(f'whatsapp_send_rows_total{{status="{status}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port=METRICS_PORT, host="127.0.0.1"):
+        """Serves the metrics in the prometheus text format at http://host:port/metrics during the run"""
+        recorder = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0]!="/metrics":
+                    self.send_error(404)
+                    return
+                body = recorder.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        print(f"Metrics served at http://{host}:{self.server.server_address[1]}/metrics")
+        return self.server.server_address[1]
+
+    def report(self):
+        for name in sorted(self.histograms):
+            if name!="row":
+                self.histograms[name].report(f"Stage '{name}'")
+        self._histogram("row").report("Row processing duration")
+        if self.path is not None:
+            print(f"Row spans: {self.path}")
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        with self.lock:
+            if self.fh is not None:
+                self.fh.close()
+                self.fh = None
+
+
+span_recorder = SpanRecorder()
@@ -1,24 +1,112 @@
 from distutils.version import LooseVersion
 import io
 import json
+import hashlib
 import logging
+import mmap
 import os
 from pathlib import Path
+from contextlib import suppress
 import random
 import re
 import shutil
 import string
+import subprocess
 import sys
 import time
+from functools import lru_cache
 from urllib.request import urlopen
 from urllib.request import urlretrieve
 import zipfile
+import threading
 from multiprocessing import Lock
-from settings import CHROME_DIR
+from settings import CHROME_DIR, DRIVER_CACHE_DIR, DRIVER_MIRROR_DIR
 
 
 IS_POSIX = sys.platform.startswith(("darwin", "cygwin", "linux", "linux2"))
 
+# what is known of every driver binary, so they're not scanned again on every start
+MANIFEST_FILE = CHROME_DIR / "driver_manifest.json"
+manifest_lock = threading.Lock()
+
+
+def load_manifest():
+    try:
+        with open(MANIFEST_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def update_manifest(path, entry):
+    with manifest_lock:
+        manifest = load_manifest()
+        if entry is None:
+            manifest.pop(str(Path(path).absolute()), None)
+        else:
+            manifest[str(Path(path).absolute())] = entry
+        tmp = MANIFEST_FILE.with_name(f"{MANIFEST_FILE.name}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp, MANIFEST_FILE)
+
+
+def manifest_entry(path):
+    """The entry of the binary if it wasn't changed since it was recorded, None otherwise"""
+    entry = load_manifest().get(str(Path(path).absolute()))
+    if entry is None:
+        return None
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    if entry.get("size")!=stat.st_size or entry.get("mtime_ns")!=stat.st_mtime_ns:
+        return None
+    return entry
+
+
+@lru_cache(maxsize=None)
+def local_chrome_version(binary):
+    """Version of the installed Chrome, None if it can't be told"""
+    if binary is None:
+        return None
+    if not IS_POSIX:
+        try:
+            import winreg
+            with winreg.OpenKey(winreg.HKEY_CURRENT_USER, r"Software\Google\Chrome\BLBeacon") as key:
+                return LooseVersion(winreg.QueryValueEx(key, "version")[0])
+        except (ImportError, OSError):
+            pass
+        # chrome.exe --version doesn't print anything, its folder has a folder named after the version
+        with suppress(OSError):
+            versions = [d.name for d in Path(binary).parent.iterdir() if d.is_dir() and re.fullmatch(r"\d+(\.\d+)+", d.name)]
+            if len(versions)>0:
+                return max(map(LooseVersion, versions))
+        return None
+    try:
+        output = subprocess.check_output([binary, "--version"], stderr=subprocess.DEVNULL, timeout=10).decode()
+    except (OSError, subprocess.SubprocessError):
+        return None
+    match = re.search(r"\d+(\.\d+)+", output)
+    return LooseVersion(match[0]) if match else None
+
+
+def major_version(version):
+    if version is None:
+        return None
+    return int(str(version).split(".")[0])
+
+
+def open_mmap(path, write=False):
+    """Maps the binary in memory, its pages are only read when searched"""
+    fh = io.open(path, "r+b" if write else "rb")
+    try:
+        return fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_WRITE if write else mmap.ACCESS_READ)
+    except ValueError:
+        # empty file
+        fh.close()
+        raise
+
 
 class Patcher(object):
     lock = Lock()
@@ -33,8 +121,12 @@ class Patcher(object):
         executable_path=None,
         force=False,
         user_multi_procs=False,
+        browser_version=None,
     ):
         self.force = force
+        # the driver is matched to the major version of the installed browser when it's known
+        self.browser_version = browser_version
+        self.major = major_version(browser_version)
         self._custom_exe_path = False
         prefix = "undetected"
         self.user_multi_procs = user_multi_procs
@@ -87,6 +179,14 @@ class Patcher(object):
         # self.exe_name %= ""
 
     def auto(self, executable_path=None, force=False, _=None):
+        if executable_path and not (force or self.force):
+            entry = manifest_entry(executable_path)
+            if entry is not None and entry["patched"] and self.matches_browser(executable_path, entry):
+                print(f"Using patched driver {executable_path} ({entry.get('version')}) from the manifest")
+                self.executable_path = executable_path
+                self._custom_exe_path = True
+                os.chmod(self.executable_path, mode=0o755)
+                return True
         p = Path(self.data_path)
         if self.user_multi_procs:
             with Lock():
@@ -94,7 +194,12 @@ class Patcher(object):
                     driver_name = "*chromedriver"
                 else:
                     driver_name = "*chromedriver.exe"
-                files = list(p.rglob(driver_name))
+                # the drivers of the cache are kept
+                files = [f for f in p.rglob(driver_name) if DRIVER_CACHE_DIR not in f.parents]
+                for f in [f for f in files if not self.matches_browser(f)]:
+                    print(f"Driver {f} doesn't match the browser {self.browser_version}, removing it")
+                    f.unlink()
+                    files.remove(f)
                 if len(files)>0:
                     most_recent = max(files, key=lambda f: f.stat().st_mtime)
                     files.remove(most_recent)
@@ -104,7 +209,11 @@ class Patcher(object):
                         os.chmod(self.executable_path, mode=0o755)
                         return True
         print("executable_path: ", executable_path)
-        
+
+        if executable_path and executable_path.exists() and not self.matches_browser(executable_path):
+            print(f"Driver {executable_path} doesn't match the browser {self.browser_version}, replacing it")
+            os.unlink(executable_path)
+
         if executable_path and executable_path.exists():
             self.executable_path = executable_path
             self._custom_exe_path = True
@@ -138,10 +247,80 @@ class Patcher(object):
         except FileNotFoundError:
             pass
 
-        release = self.fetch_release_number()
-        self.version_full = release
-        self.unzip_package(self.fetch_package())
-        return self.patch()
+        if executable_path:
+            self.executable_path = executable_path
+        if self.install_cached():
+            return True
+        mirrored = self.find_in_mirror()
+        if mirrored is not None:
+            self.version_full, package = mirrored
+            self.unzip_package(package, keep=True)
+        else:
+            release = self.fetch_release_number()
+            self.version_full = release
+            self.unzip_package(self.fetch_package())
+        patched = self.patch()
+        if patched:
+            self.store_in_cache()
+        return patched
+
+    def matches_browser(self, executable_path, entry=None):
+        """Whether the driver is for the major version of the browser, drivers of unknown version are trusted"""
+        if self.major is None:
+            return True
+        entry = entry or manifest_entry(executable_path)
+        version = entry.get("version") if entry is not None else self.parse_exe_version(executable_path)
+        return version is None or major_version(version)==self.major
+
+    def cached_driver_path(self, major=None):
+        return DRIVER_CACHE_DIR / str(major or self.major) / self.exe_name
+
+    def install_cached(self):
+        """Copies the patched driver of the browser's major version from the cache, if there's one"""
+        if self.major is None:
+            return False
+        cached = self.cached_driver_path()
+        entry = manifest_entry(cached)
+        if entry is None or not entry["patched"]:
+            return False
+        print(f"Using driver {entry.get('version')} from the cache {cached}")
+        shutil.copy2(cached, self.executable_path)
+        os.chmod(self.executable_path, 0o755)
+        Patcher.record_copy(cached, self.executable_path)
+        return True
+
+    def store_in_cache(self):
+        version = self.parse_exe_version()
+        major = major_version(version) or self.major
+        if major is None:
+            return
+        cached = self.cached_driver_path(major)
+        cached.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(self.executable_path, cached)
+        Patcher.record_copy(self.executable_path, cached)
+        print(f"Driver {version} stored in the cache {cached}")
+
+    def find_in_mirror(self):
+        """
+        (version, package) of the newest driver of the browser's major version in the local mirror,
+        laid out like the downloads: <mirror>/<version>/<platform>/chromedriver-<platform>.zip
+        """
+        if DRIVER_MIRROR_DIR is None or not DRIVER_MIRROR_DIR.exists():
+            return None
+        zip_name = f"chromedriver-{self.platform_name}.zip"
+        packages = []
+        for package in DRIVER_MIRROR_DIR.glob(f"*/{self.platform_name}/{zip_name}"):
+            version = package.parent.parent.name
+            if not re.fullmatch(r"\d+(\.\d+)+", version):
+                continue
+            if self.major is None or major_version(version)==self.major:
+                packages.append((LooseVersion(version), str(package)))
+        if len(packages)==0:
+            print(f"There's no driver for the browser {self.browser_version} in the mirror {DRIVER_MIRROR_DIR}")
+            return None
+        version, package = max(packages)
+        print(f"Using driver {version} from the mirror {package}")
+        return version, package
 
     def driver_binary_in_use(self, path: str = None) -> bool:
         if not path:
@@ -187,6 +366,14 @@ class Patcher(object):
         return self.is_binary_patched()
 
     def fetch_release_number(self):
+        if self.major is not None:
+            path = "/latest-versions-per-milestone.json"
+            print("getting release number of milestone %s from %s" % (self.major, path))
+            with urlopen(self.url_repo + path) as conn:
+                milestones = json.loads(conn.read().decode())["milestones"]
+            if str(self.major) in milestones:
+                return LooseVersion(milestones[str(self.major)]["version"])
+            print("there's no release of milestone %s, using the stable one" % self.major)
         path = "/last-known-good-versions-with-downloads.json"
         print("getting release number from %s" % path)
         with urlopen(self.url_repo + path) as conn:
@@ -195,12 +382,16 @@ class Patcher(object):
         last_versions = json.loads(response)
         return LooseVersion(last_versions["channels"]["Stable"]["version"])
 
-    def parse_exe_version(self):
-        with io.open(self.executable_path, "rb") as f:
-            for line in iter(lambda: f.readline(), b""):
-                match = re.search(rb"platform_handle\x00content\x00([0-9.]*)", line)
-                if match:
-                    return LooseVersion(match[1].decode())
+    def parse_exe_version(self, executable_path=None):
+        executable_path = executable_path or self.executable_path
+        try:
+            fh, mm = open_mmap(executable_path)
+        except (FileNotFoundError, ValueError):
+            return None
+        with fh, mm:
+            match = re.search(rb"platform_handle\x00content\x00([0-9.]*)", mm)
+            if match:
+                return LooseVersion(match[1].decode())
 
     def fetch_package(self):
         zip_name = f"chromedriver_{self.platform_name}.zip"
@@ -210,7 +401,7 @@ class Patcher(object):
         print("downloading from %s" % download_url)
         return urlretrieve(download_url)[0]
 
-    def unzip_package(self, fp):
+    def unzip_package(self, fp, keep=False):
         exe_path = self.exe_name
         zip_name = f"chromedriver-{self.platform_name}"
         exe_path = os.path.join(zip_name, self.exe_name)
@@ -223,8 +414,9 @@ class Patcher(object):
         os.makedirs(self.zip_path, mode=0o755, exist_ok=True)
         with zipfile.ZipFile(fp, mode="r") as zf:
             zf.extractall(self.zip_path)
-        os.rename(os.path.join(self.zip_path, exe_path), self.executable_path)
-        os.remove(fp)
+        os.replace(os.path.join(self.zip_path, exe_path), self.executable_path)
+        if not keep:
+            os.remove(fp)
         shutil.rmtree(self.zip_path)
         os.chmod(self.executable_path, 0o755)
         return self.executable_path
@@ -245,19 +437,61 @@ class Patcher(object):
 
     def is_binary_patched(self, executable_path=None):
         executable_path = executable_path or self.executable_path
+        entry = manifest_entry(executable_path)
+        if entry is not None:
+            return entry["patched"]
         try:
-            with io.open(executable_path, "rb") as fh:
-                return fh.read().find(b"undetected chromedriver") != -1
-        except FileNotFoundError:
+            fh, mm = open_mmap(executable_path)
+        except (FileNotFoundError, ValueError):
             return False
+        with fh, mm:
+            patched = mm.find(b"undetected chromedriver") != -1
+        self.record(executable_path, patched)
+        return patched
+
+    def record(self, executable_path=None, patched=None):
+        """Adds the binary to the manifest"""
+        executable_path = executable_path or self.executable_path
+        try:
+            stat = os.stat(executable_path)
+            fh, mm = open_mmap(executable_path)
+        except (FileNotFoundError, ValueError):
+            return None
+        with fh, mm:
+            if patched is None:
+                patched = mm.find(b"undetected chromedriver") != -1
+            match = re.search(rb"platform_handle\x00content\x00([0-9.]*)", mm)
+            entry = {
+                "path": str(Path(executable_path).absolute()),
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha256": hashlib.sha256(mm).hexdigest(),
+                "patched": patched,
+                "version": match[1].decode() if match else None,
+            }
+        update_manifest(executable_path, entry)
+        return entry
+
+    @staticmethod
+    def record_copy(src, dst):
+        """Adds a copy of a recorded binary to the manifest without reading it"""
+        entry = manifest_entry(src)
+        if entry is None:
+            return None
+        stat = os.stat(dst)
+        if stat.st_size!=entry["size"]:
+            return None
+        entry = dict(entry, path=str(Path(dst).absolute()), mtime_ns=stat.st_mtime_ns)
+        update_manifest(dst, entry)
+        return entry
 
     def patch_exe(self):
         start = time.perf_counter()
         print("patching driver executable %s" % self.executable_path)
-        with io.open(self.executable_path, "r+b") as fh:
-            content = fh.read()
+        fh, mm = open_mmap(self.executable_path, write=True)
+        with fh, mm:
             # match_injected_codeblock = re.search(rb"{window.*;}", content)
-            match_injected_codeblock = re.search(rb"\{window\.cdc.*?;\}", content)
+            match_injected_codeblock = re.search(rb"\{window\.cdc.*?;\}", mm)
             if match_injected_codeblock:
                 target_bytes = match_injected_codeblock[0]
                 new_target_bytes = (
@@ -265,18 +499,26 @@ class Patcher(object):
                         len(target_bytes), b" "
                     )
                 )
-                new_content = content.replace(target_bytes, new_target_bytes)
-                if new_content == content:
+                if len(new_target_bytes)!=len(target_bytes):
                     print(
-                        "something went wrong patching the driver binary. could not find injection code block"
+                        "something went wrong patching the driver binary. the injection code block is too short"
                     )
                 else:
                     print(
                         "found block:\n%s\nreplacing with:\n%s"
                         % (target_bytes, new_target_bytes)
                     )
-                fh.seek(0)
-                fh.write(new_content)
+                    # only the bytes of every copy of the block are written, in place
+                    position = match_injected_codeblock.start()
+                    while position != -1:
+                        mm[position:position + len(target_bytes)] = new_target_bytes
+                        position = mm.find(target_bytes, position + len(target_bytes))
+                    mm.flush()
+            else:
+                print(
+                    "something went wrong patching the driver binary. could not find injection code block"
+                )
+        self.record(self.executable_path)
         print(
             "patching took us {:.2f} seconds".format(time.perf_counter() - start)
         )
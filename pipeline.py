@@ -0,0 +1,156 @@
+import time
+import queue
+import threading
+import traceback
+from metrics import StreamingHistogram
+from settings import PIPELINE_DEPTH
+
+
+# marks the end of the rows in a queue
+END = object()
+
+
+class StageMetrics:
+    def __init__(self, name) -> None:
+        self.name = name
+        self.latencies = StreamingHistogram()
+        self.max_depth = 0
+        self.depth_samples = 0
+        self.depth_total = 0
+
+    def observe(self, latency):
+        self.latencies.observe(latency)
+
+    def sample_depth(self, depth):
+        self.max_depth = max(self.max_depth, depth)
+        self.depth_samples += 1
+        self.depth_total += depth
+
+    def stats(self):
+        latencies = self.latencies.stats()
+        return {
+            "count": latencies["count"],
+            "avg_latency": latencies["avg"] or 0,
+            "max_latency": latencies["max"] or 0,
+            "avg_queue_depth": self.depth_total / self.depth_samples if self.depth_samples>0 else 0,
+            "max_queue_depth": self.max_depth,
+        }
+
+
+class SendPipeline:
+    """
+    Runs the rows through three stages so the browser never waits for the rest:
+    prepare (ledger lookup, message, image staging) on a background thread,
+    send on the calling thread as it owns the browser, and write (ledger, statuses) on another background thread.
+    A prepared row with a status goes straight to the write stage without being sent.
+    Send may return a list of rows instead, e.g. the rows whose messages got confirmed by then,
+    the rows left are returned by flush once all the rows are sent.
+    """
+    def __init__(self, depth=PIPELINE_DEPTH) -> None:
+        self.depth = depth
+        self.metrics = {name: StageMetrics(name) for name in ("prepare", "send", "write")}
+
+    def _timed(self, stage, func, item):
+        start_time = time.time()
+        try:
+            return func(item)
+        finally:
+            self.metrics[stage].observe(time.time() - start_time)
+
+    def _put(self, ready, job, stop):
+        """Waits for room in the ready queue, returns False once the run is stopped"""
+        while not stop.is_set():
+            try:
+                ready.put(job, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _prepare_all(self, rows, prepare, ready, done, errors, stop, failures):
+        try:
+            for row in rows:
+                if stop.is_set():
+                    break
+                try:
+                    job = self._timed("prepare", prepare, row)
+                except Exception as e:
+                    print("SendPipeline.prepare Error: ", e, traceback.format_exc())
+                    errors.append(row)
+                    continue
+                if job.get("status") is None:
+                    if not self._put(ready, job, stop):
+                        break
+                    self.metrics["send"].sample_depth(ready.qsize())
+                else:
+                    done.put(job)
+                    self.metrics["write"].sample_depth(done.qsize())
+        except Exception as e:
+            # the rows themselves couldn't be read, e.g. validation failed, raised again by run
+            print("SendPipeline.rows Error: ", e, traceback.format_exc())
+            failures.append(e)
+        finally:
+            self._put(ready, END, stop)
+
+    def _write_all(self, write, done):
+        while True:
+            job = done.get()
+            if job is END:
+                break
+            try:
+                self._timed("write", write, job)
+            except Exception as e:
+                print("SendPipeline.write Error: ", e, traceback.format_exc())
+
+    def run(self, rows, prepare, send, write, flush=None):
+        """
+        Blocks until all the rows are sent and written, returns the rows which couldn't be prepared.
+        Raises the error of the rows iterator once the rows read before it are sent and written.
+        """
+        ready = queue.Queue(maxsize=self.depth)
+        done = queue.Queue()
+        errors = []
+        failures = []
+        # set when the send loop is left, e.g. send raised, so the preparer doesn't wait for room in ready forever
+        stop = threading.Event()
+        preparer = threading.Thread(target=self._prepare_all, args=(rows, prepare, ready, done, errors, stop, failures), daemon=True)
+        writer = threading.Thread(target=self._write_all, args=(write, done), daemon=True)
+        preparer.start()
+        writer.start()
+        try:
+            while True:
+                job = ready.get()
+                if job is END:
+                    break
+                sent = self._timed("send", send, job)
+                for sent_job in (sent if isinstance(sent, list) else [sent]):
+                    done.put(sent_job)
+                self.metrics["write"].sample_depth(done.qsize())
+            if flush is not None:
+                for sent_job in flush():
+                    done.put(sent_job)
+        finally:
+            stop.set()
+            while True:
+                try:
+                    ready.get_nowait()
+                except queue.Empty:
+                    break
+            preparer.join()
+            done.put(END)
+            writer.join()
+        if len(failures)>0:
+            raise failures[0]
+        return errors
+
+    def stats(self):
+        return {name: metrics.stats() for name, metrics in self.metrics.items()}
+
+    def report(self):
+        for name, stats in self.stats().items():
+            print(f"""Pipeline stage '{name}' metrics:
+                          Count: {stats["count"]}
+                          Avg latency: {stats["avg_latency"]}
+                          Max latency: {stats["max_latency"]}
+                          Avg queue depth: {stats["avg_queue_depth"]}
+                          Max queue depth: {stats["max_queue_depth"]}""")
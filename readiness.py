@@ -0,0 +1,139 @@
+import time
+from selenium.webdriver.common.by import By
+from metrics import StreamingHistogram
+
+
+# seconds each stage of the page-ready chain may wait at most
+STAGE_DEADLINES = {
+    "head": 20,
+    "body": 20,
+    "title": 15,
+    "invalid_title": 1,
+    "startup": 30,
+    "chats": 10,
+    "chat": 10,
+    "message_link": 20,
+    "attachment": 20,
+}
+DEFAULT_DEADLINE = 10
+
+# checks each kind of page needs before it's considered ready
+PAGE_PROFILES = {
+    "default": {"head": True, "dom": True, "scroll": True, "title": True},
+    # WhatsApp Web is a single page app, there's nothing to lazy load by scrolling
+    "send": {"head": False, "dom": True, "scroll": False, "title": True},
+    "login": {"head": True, "dom": True, "scroll": False, "title": True},
+}
+
+FIND_SCRIPT = """
+    var kind = arguments[0], selector = arguments[1];
+    if (kind === 'title') return document.title.indexOf(selector) !== -1;
+    if (kind === 'xpath') return document.evaluate(
+        selector, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+    ).singleNodeValue !== null;
+    return document.querySelector(selector) !== null;
+"""
+
+# resolves as soon as the selector (dis)appears, without polling from python
+WAIT_SCRIPT = """
+    var kind = arguments[0], selector = arguments[1], present = arguments[2];
+    var timeoutMs = arguments[3], done = arguments[arguments.length - 1];
+    var start = performance.now();
+    function found() {
+        var el;
+        if (kind === 'title') el = document.title.indexOf(selector) !== -1 ? document : null;
+        else if (kind === 'xpath') el = document.evaluate(
+            selector, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+        ).singleNodeValue;
+        else el = document.querySelector(selector);
+        return present ? el !== null : el === null;
+    }
+    if (found()) {
+        done({ok: true, waited: 0});
+        return;
+    }
+    var finished = false;
+    var observer = new MutationObserver(function() {
+        if (!finished && found()) finish(true);
+    });
+    var timer = setTimeout(function() { finish(found()); }, timeoutMs);
+    function finish(ok) {
+        finished = true;
+        observer.disconnect();
+        clearTimeout(timer);
+        done({ok: ok, waited: (performance.now() - start) / 1000});
+    }
+    observer.observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+"""
+
+
+def to_selector(by_tuple):
+    by, value = by_tuple
+    if by==By.XPATH:
+        return "xpath", value
+    if by==By.TAG_NAME:
+        return "css", value
+    if by==By.ID:
+        return "css", f"#{value}"
+    if by==By.CLASS_NAME:
+        return "css", f".{value}"
+    if by==By.CSS_SELECTOR:
+        return "css", value
+    if by=="title":
+        return "title", value
+    raise ValueError(f"Unsupported locator: {by}")
+
+
+class Readiness:
+    def __init__(self, browser=None, deadlines=None) -> None:
+        self.browser = browser
+        self.deadlines = dict(STAGE_DEADLINES)
+        if deadlines is not None:
+            self.deadlines.update(deadlines)
+        self.timings = {}
+
+    def deadline(self, stage):
+        return self.deadlines.get(stage, DEFAULT_DEADLINE)
+
+    def wait(self, stage, by_tuple, present=True, deadline=None):
+        """Returns True once the element of by_tuple is (or isn't) on the page"""
+        if deadline is None:
+            deadline = self.deadline(stage)
+        return self._wait(stage, by_tuple, present, deadline)
+
+    def wait_title(self, stage, title, deadline=None):
+        return self.wait(stage, ("title", title), deadline=deadline)
+
+    def _wait(self, stage, by_tuple, present, deadline):
+        kind, selector = to_selector(by_tuple)
+        start_time = time.time()
+        ok = False
+        try:
+            self.browser.set_script_timeout(deadline + 5)
+            result = self.browser.execute_async_script(WAIT_SCRIPT, kind, selector, present, int(deadline*1000))
+            ok = bool(result and result.get("ok"))
+        except Exception as e:
+            # the document got replaced while observing it, keep checking the new one
+            remaining = deadline - (time.time() - start_time)
+            print(f"Readiness.wait '{stage}' observer interrupted, polling for {max(remaining, 0):.2f} seconds: {e}")
+            ok = self._poll(kind, selector, present, remaining)
+        waited = time.time() - start_time
+        self.timings.setdefault(stage, StreamingHistogram()).observe(waited)
+        print(f"Stage '{stage}' {'ready' if ok else 'timed out'} after {waited:.3f} seconds")
+        return ok
+
+    def _poll(self, kind, selector, present, remaining):
+        end_time = time.time() + remaining
+        while True:
+            try:
+                if self.browser.execute_script(FIND_SCRIPT, kind, selector)==present:
+                    return True
+            except Exception:
+                pass
+            if time.time()>=end_time:
+                return False
+            time.sleep(0.05)
+
+    def report(self):
+        for stage, durations in self.timings.items():
+            durations.report(f"Stage '{stage}' waiting")
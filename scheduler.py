@@ -0,0 +1,122 @@
+import time
+import random
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from settings import *
+from delivery import SENT_STATUSES
+
+
+class SendWindows:
+    """Times of the day messages may be sent in, "09:00-13:00,14:00-21:00", a window may cross midnight: "22:00-02:00" """
+    def __init__(self, spec=SEND_WINDOWS) -> None:
+        self.spec = spec
+        self.windows = []
+        for window in spec.split(","):
+            window = window.strip()
+            if len(window)==0:
+                continue
+            try:
+                start, end = (datetime.strptime(t.strip(), "%H:%M").time() for t in window.split("-"))
+            except ValueError:
+                raise Exception(f"Invalid send window '{window}' in send_windows, expected HH:MM-HH:MM")
+            self.windows.append((start, end))
+
+    def is_open(self, now=None):
+        if len(self.windows)==0:
+            return True
+        t = (now or datetime.now()).time()
+        for start, end in self.windows:
+            if (start<=t<end) if start<end else (t>=start or t<end):
+                return True
+        return False
+
+    def seconds_until_open(self, now=None):
+        now = now or datetime.now()
+        if self.is_open(now):
+            return 0.0
+        starts = []
+        for start, _ in self.windows:
+            opening = datetime.combine(now.date(), start)
+            if opening<=now:
+                opening += timedelta(days=1)
+            starts.append(opening)
+        return (min(starts) - now).total_seconds()
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket of the sends of an account. The rate goes up a little after every healthy send
+    and is halved when the recent sends fail too often or get slower than target_send_latency_secs.
+    """
+    def __init__(self, rate=SEND_RATE_PER_MINUTE, min_rate=MIN_SEND_RATE_PER_MINUTE, max_rate=MAX_SEND_RATE_PER_MINUTE,
+                 burst=SEND_BURST, jitter=SEND_JITTER, windows=None, target_latency=TARGET_SEND_LATENCY_SECS,
+                 max_failure_rate=MAX_FAILURE_RATE, sample_size=20, rate_step=0.2) -> None:
+        self.min_rate = min_rate
+        self.max_rate = max(max_rate, min_rate)
+        self.rate = min(max(rate, self.min_rate), self.max_rate)
+        self.burst = max(burst, 1)
+        self.jitter = jitter
+        self.windows = windows or SendWindows()
+        self.target_latency = target_latency
+        self.max_failure_rate = max_failure_rate
+        self.outcomes = deque(maxlen=sample_size)
+        self.rate_step = rate_step
+        self.tokens = 1.0
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+        self.waited_secs = 0.0
+        self.slowdowns = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate / 60)
+        self.updated_at = now
+
+    def acquire(self):
+        """Blocks until a message may be sent, returns the seconds waited"""
+        start_time = time.monotonic()
+        while True:
+            closed_secs = self.windows.seconds_until_open()
+            if closed_secs>0:
+                print(f"Outside of the send windows ({self.windows.spec}), waiting {closed_secs} seconds...")
+                time.sleep(min(closed_secs, 60))
+                with self.lock:
+                    # the tokens don't pile up while the windows are closed
+                    self.tokens = min(self.tokens, 1.0)
+                    self.updated_at = time.monotonic()
+                continue
+            with self.lock:
+                self._refill()
+                if self.tokens>=1:
+                    self.tokens -= 1
+                    break
+                wait_secs = (1 - self.tokens) * 60 / self.rate
+            time.sleep(wait_secs)
+        if self.jitter>0:
+            time.sleep(random.uniform(0, self.jitter * 60 / self.rate))
+        waited = time.monotonic() - start_time
+        with self.lock:
+            self.waited_secs += waited
+        return waited
+
+    def observe(self, latency, status):
+        with self.lock:
+            self.outcomes.append((latency, status in SENT_STATUSES))
+            failures = sum(1 for _, ok in self.outcomes if not ok)
+            failure_rate = failures / len(self.outcomes)
+            avg_latency = sum(latency for latency, _ in self.outcomes) / len(self.outcomes)
+            judged = len(self.outcomes)>=min(5, self.outcomes.maxlen)
+            if judged and (failure_rate>self.max_failure_rate or avg_latency>self.target_latency):
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.slowdowns += 1
+                # judged again on the sends at the new rate
+                self.outcomes.clear()
+            elif status in SENT_STATUSES:
+                self.rate = min(self.max_rate, self.rate + self.rate_step)
+
+    def report(self):
+        print(f"""Send rate metrics:
+                          Rate: {self.rate} msgs/min
+                          Slowdowns: {self.slowdowns}
+                          Waited: {self.waited_secs} seconds""")
@@ -25,7 +25,10 @@ BASE_DIR = Path("./")
 CONFIGURATION_FILE = BASE_DIR / 'settings.config'
 CHROME_DIR = BASE_DIR / "chrome"
 USER_DATA_DIR = CHROME_DIR / "user-data"
+# patched drivers of every major version of chrome, reused instead of downloaded
+DRIVER_CACHE_DIR = CHROME_DIR / "drivers"
 CONTACT_FOLDER_PATH = BASE_DIR / "contacts"
+REPORTS_DIR = BASE_DIR / "reports"
 
 CHROME_DIR.mkdir(exist_ok=True)
 USER_DATA_DIR.mkdir(mode=777, exist_ok=True)
@@ -43,17 +46,62 @@ LOGIN_URL = SETTINGS.get('login_url').strip()
 LOGIN_TITLE = SETTINGS.get('login_title').strip()
 LOGIN_REDIRECT_TITLE = SETTINGS.get('login_redirect_title').strip()
 SEND_URL = SETTINGS.get('send_url').strip()
+# opens the next chat with an in-app link instead of reloading WhatsApp Web, not verified against every version of it
+WARM_SESSION = SETTINGS.get('warm_session', 'False').strip() in TRUTHY
+WARM_SEND_URL = SETTINGS.get('warm_send_url', SEND_URL).strip()
+# keeps a spare browser logged in on its own profile to swap in when a browser dies
+WARM_STANDBY = SETTINGS.get('warm_standby', 'False').strip() in TRUTHY
+# selenium: drives chrome, stand_in: talks to the local stand-in of WhatsApp Web at stand_in_url (python standin.py)
+BROWSER_DRIVER = SETTINGS.get('browser_driver', 'selenium').strip().lower()
+STAND_IN_URL = SETTINGS.get('stand_in_url', 'http://127.0.0.1:8765').strip().rstrip('/')
 CONTACT_NUMBER_COLUMN_NAME = SETTINGS.get('contact_number_column_name').strip()
 CONTACT_NAME_COLUMN_NAME = SETTINGS.get('contact_name_column_name').strip()
 IMAGE_NAME_COLUMN_NAME = SETTINGS.get('image_name_column_name').strip()
 STATUS_COLUMN_NAME = SETTINGS.get('status_column_name').strip()
 MESSAGE_BODY_FILE = BASE_DIR / 'message' / SETTINGS.get('message_body_file').strip()
+TEMPLATE_CACHE_SIZE = int(SETTINGS.get('template_cache_size', '4096').strip())
+IMAGE_CACHE_SIZE = int(SETTINGS.get('image_cache_size', '16').strip())
+# clipboard: paste the image (windows only), file_input: upload it through the page, auto: clipboard if possible
+ATTACHMENT_MODE = SETTINGS.get('attachment_mode', 'auto').strip().lower()
+GROUP_ROWS_BY_IMAGE = SETTINGS.get('group_rows_by_image', 'False').strip() in TRUTHY
+# rows prepared ahead of the one being sent
+PIPELINE_DEPTH = max(int(SETTINGS.get('pipeline_depth', '4').strip()), 1)
+# time spent by every row in each stage, empty to not keep it
+SPANS_FILE = (REPORTS_DIR / SETTINGS.get('spans_file', 'spans.jsonl').strip()) if SETTINGS.get('spans_file', 'spans.jsonl').strip() else None
+# port of the prometheus metrics served during a run, 0 to not serve them
+METRICS_PORT = int(SETTINGS.get('metrics_port', '0').strip() or 0)
 MESSAGE_IMAGE_DIR = BASE_DIR / 'message' / SETTINGS.get('message_image_folder').strip()
 MESSAGE_LINK_RENDERED_TITLE = SETTINGS.get('message_link_rendered_title').strip()
 COUNTRY_CODE = SETTINGS.get('country_code').strip()
+# digits of a contact number without the country code, required to tell local numbers from numbers with it
+NATIONAL_NUMBER_LENGTH = int(SETTINGS.get('national_number_length', '0').strip() or 0)
+LEDGER_FILE = BASE_DIR / 'ledger' / SETTINGS.get('ledger_file', 'send_ledger.jsonl').strip()
+# memory: a hash table, disk: a sqlite index for very large lists
+DEDUP_INDEX = SETTINGS.get('dedup_index', 'memory').strip().lower()
+DEDUP_INDEX_FILE = BASE_DIR / 'ledger' / 'dedup_index.sqlite'
 
-HEALTH_CHECK_URL = SETTINGS.get('health_check_url').strip()
-HEALTH_CHECK_TITLE = SETTINGS.get('health_check_title').strip()
-ACTIVE_HOURS = float(SETTINGS.get('active_hours').strip())
-PROCESSING_DURATION_EARCH_ROWS_SECS = float(SETTINGS.get('processing_duration_earch_rows_secs').strip())
-NUMBER_OF_ROWS_TO_PROCESS = ACTIVE_HOURS*3600/PROCESSING_DURATION_EARCH_ROWS_SECS
+# sent, delivered or read: the state each message is waited for after clicking send, until delivery_timeout_secs
+DELIVERY_WAIT_STATE = SETTINGS.get('delivery_wait_state', 'sent').strip().lower()
+DELIVERY_TIMEOUT_SECS = float(SETTINGS.get('delivery_timeout_secs', '60').strip())
+# messages sent but not confirmed yet while the next chats are opened, 0 to wait for every message before the next one
+MAX_UNCONFIRMED_MESSAGES = int(SETTINGS.get('max_unconfirmed_messages', '0').strip() or 0)
+# folder with the drivers laid out like the downloads, <version>/<platform>/chromedriver-<platform>.zip, used before downloading
+DRIVER_MIRROR_DIR = Path(SETTINGS.get('driver_mirror_dir', '').strip()) if SETTINGS.get('driver_mirror_dir', '').strip() else None
+# local: a built-in page checked without any network, or the url of a page whose title is health_check_title
+HEALTH_CHECK_URL = SETTINGS.get('health_check_url', 'local').strip()
+HEALTH_CHECK_TITLE = SETTINGS.get('health_check_title', '').strip()
+# messages per minute of every account, adapted to the send latency and failures between the min and the max
+SEND_RATE_PER_MINUTE = float(SETTINGS.get('send_rate_per_minute', '6').strip())
+MIN_SEND_RATE_PER_MINUTE = float(SETTINGS.get('min_send_rate_per_minute', '1').strip())
+MAX_SEND_RATE_PER_MINUTE = float(SETTINGS.get('max_send_rate_per_minute', '12').strip())
+SEND_BURST = int(SETTINGS.get('send_burst', '1').strip())
+# random extra delay before a send, as a fraction of the interval between sends
+SEND_JITTER = float(SETTINGS.get('send_jitter', '0.3').strip())
+# comma separated HH:MM-HH:MM times of the day to send in, empty for any time
+SEND_WINDOWS = SETTINGS.get('send_windows', '').strip()
+TARGET_SEND_LATENCY_SECS = float(SETTINGS.get('target_send_latency_secs', '15').strip())
+MAX_FAILURE_RATE = float(SETTINGS.get('max_failure_rate', '0.2').strip())
+# rows whose statuses are written back to the contact file at once
+CHUNK_SIZE = int(SETTINGS.get('chunk_size', '100').strip())
+# seconds between two writes of the statuses back to a contact file, they're always written at the end of the file
+STATUS_WRITE_INTERVAL_SECS = float(SETTINGS.get('status_write_interval_secs', '60').strip())
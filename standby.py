@@ -0,0 +1,77 @@
+import time
+import threading
+import traceback
+from metrics import StreamingHistogram
+
+
+class StandbySession:
+    """
+    A spare session launched and logged in ahead on its own browser profile.
+    It's swapped in for a session whose browser died instead of a cold start and login mid-run,
+    the browser profile of the dead session is relaunched in the background as the next spare.
+    """
+    def __init__(self, factory) -> None:
+        self.factory = factory
+        self.spare = None
+        self.thread = None
+        self.lock = threading.Lock()
+        self.setup_durations = StreamingHistogram()
+        self.recovery_durations = StreamingHistogram()
+
+    def _setup(self, session):
+        start_time = time.time()
+        ok = False
+        try:
+            if session is None:
+                session = self.factory()
+            else:
+                session.kill_browser_process()
+            ok = session.setup_session()
+        except Exception as e:
+            print("StandbySession.setup Error: ", e, traceback.format_exc())
+        self.setup_durations.observe(time.time() - start_time)
+        if ok:
+            print(f"Standby session ready in {time.time() - start_time} seconds")
+            with self.lock:
+                self.spare = session
+        elif session is not None:
+            print("Standby session couldn't log in")
+            session.kill_browser_process()
+
+    def prepare(self, session=None, wait=False):
+        """
+        Launches a spare session, from the given one if any.
+        The first spare is waited for as its login may ask to scan the QR code.
+        """
+        if wait:
+            self._setup(session)
+            return
+        self.thread = threading.Thread(target=self._setup, args=(session,), daemon=True)
+        self.thread.start()
+
+    def take(self, timeout=None):
+        """Returns the spare session, waiting for it if it's still being launched, None if there's none"""
+        if self.thread is not None:
+            self.thread.join(timeout)
+        with self.lock:
+            spare, self.spare = self.spare, None
+        if spare is not None and not spare.is_browser_alive():
+            print("Standby session died while waiting")
+            spare.kill_browser_process()
+            return None
+        return spare
+
+    def recovered(self, duration):
+        self.recovery_durations.observe(duration)
+        print(f"Session recovered in {duration} seconds")
+
+    def close(self):
+        if self.thread is not None:
+            self.thread.join()
+        spare = self.take()
+        if spare is not None:
+            spare.kill_browser_process()
+
+    def report(self):
+        self.setup_durations.report("Standby session setup duration")
+        self.recovery_durations.report("Time to recover")
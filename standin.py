@@ -0,0 +1,283 @@
+# local stand-in of WhatsApp Web to measure the send loop offline
+# run from the project folder: python standin.py --port 8765 --page-latency 0.5 --failure-rate 0.05
+# then set browser_driver=stand_in and stand_in_url=http://127.0.0.1:8765 in settings.config
+
+import json
+import time
+import random
+import argparse
+import threading
+import html as html_lib
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from settings import MESSAGE_LINK_RENDERED_TITLE, LOGIN_TITLE
+
+
+# in a real browser the clicks, uploads and in-app links are handled by the page like WhatsApp Web does
+PAGE_SCRIPT = """
+function reloadChat(url) {
+    return fetch(url, {headers: {'X-Stand-In-Fragment': '1', 'X-Stand-In-Refresh': url === location.href ? '1' : ''}})
+        .then(function(r) { return r.text(); })
+        .then(function(html) {
+            document.querySelector('#app').innerHTML = html;
+            if (url !== location.href) history.replaceState(null, '', url);
+        });
+}
+function post(url) {
+    return fetch(url, {method: 'POST'}).then(function(r) { return r.json(); });
+}
+document.addEventListener('click', function(e) {
+    var el = e.target.closest('[data-action]');
+    if (el) {
+        post(el.dataset.action).then(function(msg) {
+            reloadChat(location.href);
+            // the status of the message changes on the server
+            [msg.pending_ms, msg.delivered_ms, msg.read_ms].forEach(function(ms) {
+                if (ms !== null) setTimeout(function() { reloadChat(location.href); }, ms + 10);
+            });
+        });
+        return;
+    }
+    var a = e.target.closest('a');
+    if (a && new URL(a.href).pathname === '/send') {
+        e.preventDefault();
+        var link = new URL(a.href);
+        reloadChat(location.origin + link.pathname + link.search);
+    }
+});
+document.addEventListener('change', function(e) {
+    if (e.target.dataset.upload) post(e.target.dataset.upload).then(function() { reloadChat(location.href); });
+});
+document.addEventListener('paste', function(e) {
+    var el = e.target.closest('[data-paste]');
+    if (el) post(el.dataset.paste).then(function() { reloadChat(location.href); });
+});
+"""
+
+
+class StandInState:
+    def __init__(self, page_latency, send_latency, pending_secs, delivered_secs, read_secs, failure_rate, link_title, seed, contact_names=None) -> None:
+        self.page_latency = page_latency
+        self.send_latency = send_latency
+        self.pending_secs = pending_secs
+        self.delivered_secs = delivered_secs
+        self.read_secs = read_secs
+        self.failure_rate = failure_rate
+        self.link_title = link_title
+        # {phone: name} of the saved contacts, their chats are titled with the name instead of the number
+        self.contact_names = contact_names or {}
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        # per phone: whether the send button is rendered, an image is attached, when the messages were sent
+        self.chats = {}
+        self.stats = {"pages": 0, "refreshes": 0, "sent": 0, "attachments": 0, "failed_pages": 0}
+
+    def open_chat(self, phone):
+        with self.lock:
+            failed = self.random.random()<self.failure_rate
+            self.stats["failed_pages"] += failed
+            chat = self.chats.setdefault(phone, {"sent_at": []})
+            chat.update(failed=failed, attached=False)
+
+    def chat(self, phone):
+        with self.lock:
+            chat = self.chats.setdefault(phone, {"sent_at": [], "failed": False, "attached": False})
+            return dict(chat, sent_at=list(chat["sent_at"]))
+
+    def recent_chats(self, limit=20):
+        """(phone, time of the last message) of the chats messaged last, newest first"""
+        with self.lock:
+            chats = [(phone, chat["sent_at"][-1]) for phone, chat in self.chats.items() if len(chat["sent_at"])>0]
+        return sorted(chats, key=lambda chat: chat[1], reverse=True)[:limit]
+
+    def message_status(self, age):
+        """aria-label and data-icon of the status of a message sent age seconds ago"""
+        if age<self.pending_secs:
+            return "Pending", "msg-time"
+        if self.read_secs is not None and age>=self.read_secs:
+            return "Read", "msg-dblcheck-ack"
+        if self.delivered_secs is not None and age>=self.delivered_secs:
+            return "Delivered", "msg-dblcheck"
+        return "Sent", "msg-check"
+
+    def send(self, phone):
+        with self.lock:
+            chat = self.chats.setdefault(phone, {"sent_at": [], "failed": False, "attached": False})
+            chat["sent_at"].append(time.time())
+            chat["attached"] = False
+            self.stats["sent"] += 1
+
+    def attach(self, phone):
+        with self.lock:
+            self.chats.setdefault(phone, {"sent_at": [], "failed": False})["attached"] = True
+            self.stats["attachments"] += 1
+
+    def chat_title(self, phone):
+        return self.contact_names.get(phone, phone)
+
+
+def render_chat(state, phone, text):
+    chat = state.chat(phone)
+    quoted = urllib.parse.quote(phone)
+    esc = html_lib.escape
+    title = esc(state.chat_title(phone))
+    parts = [f'<div id="main" data-phone="{esc(phone)}"><header><span title="{title}">{title}</span></header><div class="messages">']
+    # the ids of the messages are unique across the chats, like the ones of WhatsApp Web
+    jid = "".join(filter(str.isdigit, phone)) + "@c.us"
+    now = time.time()
+    for i, sent_at in enumerate(chat["sent_at"]):
+        label, icon = state.message_status(now - sent_at)
+        message_id = f"true_{jid}_{i}"
+        parts.append(f'<div class="message-out" data-id="{message_id}"><span aria-label=" {label} " data-icon="{icon}"></span></div>')
+    parts.append('</div><footer>')
+    parts.append('<div title="Attach" data-icon="plus" role="button"></div>')
+    if state.link_title:
+        parts.append(f'<div title="{esc(state.link_title)}" class="link-preview"></div>')
+    parts.append(f'<div title="Type a message" contenteditable="true" data-paste="/attach?phone={quoted}">{esc(text)}</div>')
+    if not chat["failed"]:
+        parts.append(f'<button aria-label="Send" data-action="/click?phone={quoted}">Send</button>')
+    parts.append('</footer></div>')
+    parts.append(f'<input type="file" accept="image/*,video/mp4,video/3gpp,video/quicktime" style="display:none" data-upload="/attach?phone={quoted}">')
+    if chat["attached"] and not chat["failed"]:
+        parts.append(f'<div aria-label="Send" role="button" data-action="/click?phone={quoted}"></div>')
+    return "".join(parts)
+
+
+def render_chat_list(state):
+    # the status of the last message of every chat, like the chat list of WhatsApp Web
+    now = time.time()
+    parts = []
+    for phone, sent_at in state.recent_chats():
+        label, icon = state.message_status(now - sent_at)
+        title = html_lib.escape(state.chat_title(phone))
+        parts.append(
+            f'<div role="listitem"><span title="{title}">{title}</span>'
+            f'<span aria-label=" {label} " data-icon="{icon}"></span></div>'
+        )
+    return "".join(parts)
+
+
+def render_app(state, phone=None, text=""):
+    chat = render_chat(state, phone, text) if phone else ""
+    return f'<div id="pane-side">{render_chat_list(state)}</div><div id="chat">{chat}</div>'
+
+
+def render_page(state, phone=None, text=""):
+    return (
+        f'<!DOCTYPE html><html><head><title>{html_lib.escape(LOGIN_TITLE)}</title></head><body>'
+        f'<div id="app">{render_app(state, phone, text)}</div>'
+        f'<script>{PAGE_SCRIPT}</script></body></html>'
+    )
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def _reply(self, status, body, content_type):
+        body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        state = self.server.state
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        refresh = self.headers.get("X-Stand-In-Refresh")=="1"
+        if url.path=="/health":
+            return self._reply(200, "ok", "text/plain")
+        if url.path=="/stats":
+            with state.lock:
+                return self._reply(200, json.dumps(state.stats), "application/json")
+        if url.path not in ("/", "/send"):
+            return self._reply(404, "not found", "text/plain")
+        phone = query.get("phone")
+        with state.lock:
+            state.stats["refreshes" if refresh else "pages"] += 1
+        if not refresh:
+            time.sleep(state.page_latency)
+            if phone:
+                state.open_chat(phone)
+        if self.headers.get("X-Stand-In-Fragment")=="1":
+            return self._reply(200, render_app(state, phone, query.get("text", "")), "text/html")
+        self._reply(200, render_page(state, phone, query.get("text", "")), "text/html; charset=utf-8")
+
+    def do_POST(self):
+        state = self.server.state
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        length = int(self.headers.get("Content-Length") or 0)
+        if length>0:
+            self.rfile.read(length)
+        phone = query.get("phone", "")
+        if url.path=="/click":
+            time.sleep(state.send_latency)
+            state.send(phone)
+            to_ms = lambda secs: None if secs is None else int(secs*1000)
+            return self._reply(200, json.dumps({
+                "pending_ms": to_ms(state.pending_secs),
+                "delivered_ms": to_ms(state.delivered_secs),
+                "read_ms": to_ms(state.read_secs),
+            }), "application/json")
+        if url.path=="/attach":
+            state.attach(phone)
+            return self._reply(200, json.dumps({"ok": True}), "application/json")
+        self._reply(404, json.dumps({"error": "not found"}), "application/json")
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInServer:
+    """WhatsApp Web stand-in with the send box, the send button and the status of the messages, with configurable latency and failures"""
+    def __init__(self, host="127.0.0.1", port=0, page_latency=0.0, send_latency=0.0, pending_secs=0.5, delivered_secs=1.0,
+                 read_secs=None, failure_rate=0.0, link_title=MESSAGE_LINK_RENDERED_TITLE, seed=0, contact_names=None) -> None:
+        self.server = ThreadingHTTPServer((host, port), StandInHandler)
+        self.server.daemon_threads = True
+        self.server.state = StandInState(page_latency, send_latency, pending_secs, delivered_secs, read_secs, failure_rate, link_title, seed, contact_names)
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def stats(self):
+        with self.server.state.lock:
+            return dict(self.server.state.stats)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        print(f"WhatsApp Web stand-in at {self.url}")
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in of WhatsApp Web for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--page-latency", type=float, default=0.0, help="Seconds to load a page, default: 0")
+    parser.add_argument("--send-latency", type=float, default=0.0, help="Seconds to accept a message, default: 0")
+    parser.add_argument("--pending-secs", type=float, default=0.5, help="Seconds a message stays pending, default: 0.5")
+    parser.add_argument("--delivered-secs", type=float, default=1.0, help="Seconds after sending a message is delivered, default: 1")
+    parser.add_argument("--read-secs", type=float, default=None, help="Seconds after sending a message is read, default: never")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of the chats without a send button, default: 0")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = StandInServer(
+        args.host, args.port, args.page_latency, args.send_latency, args.pending_secs,
+        args.delivered_secs, args.read_secs, args.failure_rate, seed=args.seed
+    )
+    server.start()
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,89 @@
+import urllib.parse
+import string
+from functools import lru_cache
+import pandas as pd
+from settings import *
+
+
+# the placeholder always filled with the contact name column, whatever that column is called
+CONTACT_NAME_PLACEHOLDER = "contact_name"
+
+
+class MessageTemplate:
+    """
+    Message body parsed once, its placeholders are columns of the contact sheets: {contact_name}, {city}, ...
+    The url encoded messages are memoized as many rows share the same values.
+    """
+    def __init__(self, body, cache_size=TEMPLATE_CACHE_SIZE) -> None:
+        self.body = body
+        try:
+            parsed = list(string.Formatter().parse(body))
+        except ValueError as e:
+            raise Exception(f"Message body file {MESSAGE_BODY_FILE} is invalid: {e}, use {{{{ and }}}} for literal braces")
+        self.fields = []
+        for _, field_name, _, _ in parsed:
+            if field_name is None:
+                continue
+            if field_name=="" or field_name.isdigit():
+                raise Exception(f"Message body file {MESSAGE_BODY_FILE} has a placeholder without a column name: '{{{field_name}}}'")
+            # {column.attr} or {column[0]} are formatted from the value of the column
+            name = field_name.split(".")[0].split("[")[0]
+            if name not in self.fields:
+                self.fields.append(name)
+        self.columns = [
+            CONTACT_NAME_COLUMN_NAME if field==CONTACT_NAME_PLACEHOLDER else field for field in self.fields
+        ]
+        self.render_values = lru_cache(maxsize=cache_size)(self._render_values)
+        self.encode_values = lru_cache(maxsize=cache_size)(self._encode_values)
+        try:
+            # fails now rather than once per row
+            self.render_values(("",) * len(self.fields))
+        except IndexError:
+            # {column[3]} depends on the value of each row
+            pass
+        except Exception as e:
+            raise Exception(f"Message body file {MESSAGE_BODY_FILE} can't be formatted: {e!r}")
+
+    @classmethod
+    def load(cls, path=MESSAGE_BODY_FILE):
+        if not path.exists():
+            print(f"There's not message body file {path}")
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            body = f.read()
+        if len(body)==0:
+            print(f"There's no body in message body file {path}")
+            return None
+        print("Message body to send: ", body)
+        template = cls(body)
+        print("Message placeholders: ", ", ".join(template.fields) or "-")
+        return template
+
+    def validate(self, columns, filename):
+        missing = [column for column in self.columns if column not in columns]
+        if len(missing)>0:
+            raise Exception(f"{filename} has missing columns for the message placeholders: {missing}")
+
+    def values(self, r):
+        values = []
+        for column in self.columns:
+            value = r.get(column)
+            values.append("" if pd.isnull(value) else str(value).strip())
+        return tuple(values)
+
+    def _render_values(self, values):
+        return self.body.format(**dict(zip(self.fields, values)))
+
+    def _encode_values(self, values):
+        return urllib.parse.urlencode({'text' : self.render_values(values)})
+
+    def render(self, r):
+        return self.render_values(self.values(r))
+
+    def encode(self, r):
+        """Message of the row as the text query parameter of the send url"""
+        return self.encode_values(self.values(r))
+
+    def report(self):
+        info = self.encode_values.cache_info()
+        print(f"Message cache: {info.hits} hits, {info.misses} misses, {info.currsize}/{info.maxsize} cached")
@@ -0,0 +1,8 @@
+import os
+import sys
+from pathlib import Path
+
+# the modules are top-level and settings reads settings.config from the working directory
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+os.chdir(ROOT_DIR)
@@ -0,0 +1,15 @@
+import pytest
+from batch import RunSummary, EXIT_OK, EXIT_INCOMPLETE
+
+
+@pytest.mark.parametrize("statuses, exit_code", [
+    ({"Sent": 3, "Delivered": 1}, EXIT_OK),
+    ({"Sent": 3, "Pending": 1}, EXIT_INCOMPLETE),
+    ({"Sent": 3, "Unconfirmed": 1}, EXIT_INCOMPLETE),
+    ({"Sent": 3, "In Flight": 1}, EXIT_INCOMPLETE),
+])
+def test_exit_code_of_the_statuses(statuses, exit_code):
+    summary = RunSummary()
+    summary.logged_in = True
+    summary.add_file("contacts.xlsx", statuses)
+    assert summary.exit_code() == exit_code
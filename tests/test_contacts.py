@@ -0,0 +1,22 @@
+from contacts import CsvContactSource
+from settings import CONTACT_NUMBER_COLUMN_NAME, CONTACT_NAME_COLUMN_NAME, STATUS_COLUMN_NAME
+
+
+def test_csv_statuses_land_on_their_rows_after_a_blank_line(tmp_path):
+    path = tmp_path / "contacts.csv"
+    path.write_text(
+        f"{CONTACT_NUMBER_COLUMN_NAME},{CONTACT_NAME_COLUMN_NAME},{STATUS_COLUMN_NAME}\n"
+        "9000000001,a,\n"
+        "\n"
+        "9000000002,b,\n"
+        "9000000003,c,\n",
+        encoding="utf-8",
+    )
+    source = CsvContactSource(path)
+    rows = list(source.rows(source.sheets()[0]))
+    source.close()
+    assert [row[CONTACT_NAME_COLUMN_NAME] for _, row in rows] == ["a", "b", "c"]
+
+    source.write_statuses({source.sheets()[0]: {idx: f"S-{row[CONTACT_NAME_COLUMN_NAME]}" for idx, row in rows}})
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert lines[1:] == ["9000000001,a,S-a", "", "9000000002,b,S-b", "9000000003,c,S-c"]
@@ -0,0 +1,38 @@
+import pytest
+from contacts import CsvContactSource
+from dedup import build_dedup_index
+from settings import CONTACT_NUMBER_COLUMN_NAME, CONTACT_NAME_COLUMN_NAME
+
+
+def write_csv(path, columns, numbers):
+    path.write_text(",".join(columns) + "\n" + "".join(f"{number},x\n" for number in numbers), encoding="utf-8")
+    return CsvContactSource(path)
+
+
+def check(columns, filename):
+    if CONTACT_NAME_COLUMN_NAME not in columns:
+        raise Exception(f"{filename} has missing column: '{CONTACT_NAME_COLUMN_NAME}'")
+
+
+@pytest.mark.parametrize("backend", ["memory", "disk"])
+def test_the_first_row_of_a_number_owns_it(tmp_path, backend, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    first = write_csv(tmp_path / "a.csv", [CONTACT_NUMBER_COLUMN_NAME, CONTACT_NAME_COLUMN_NAME], ["9000000001", "9000000002"])
+    second = write_csv(tmp_path / "b.csv", [CONTACT_NUMBER_COLUMN_NAME, CONTACT_NAME_COLUMN_NAME], ["9000000002", "9000000003"])
+    index = build_dedup_index([first, second], backend=backend, check=check)
+    assert tuple(index.first("+919000000002")) == ("a.csv", "a", 1)
+    assert tuple(index.first("+919000000003")) == ("b.csv", "b", 1)
+    assert len(index) == 3
+    index.close()
+    first.close()
+    second.close()
+
+
+def test_a_sheet_which_isnt_sent_owns_no_number(tmp_path):
+    skipped = write_csv(tmp_path / "a.csv", [CONTACT_NUMBER_COLUMN_NAME, "city"], ["9000000001"])
+    sent = write_csv(tmp_path / "b.csv", [CONTACT_NUMBER_COLUMN_NAME, CONTACT_NAME_COLUMN_NAME], ["9000000001"])
+    index = build_dedup_index([skipped, sent], backend="memory", check=check)
+    assert index.first("+919000000001") == ("b.csv", "b", 0)
+    index.close()
+    skipped.close()
+    sent.close()
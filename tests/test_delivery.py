@@ -0,0 +1,73 @@
+import pytest
+from selenium.webdriver.common.by import By
+from drivers import StandInDriver, OPEN_CHAT_SCRIPT
+from standin import StandInServer
+from delivery import state_of, reached, DeliveryTracker, DeliveryReconciler, UNCONFIRMED_STATUS, PENDING, SENT, DELIVERED, READ, FAILED
+
+
+@pytest.mark.parametrize("labels, icons, state", [
+    ([" Pending "], ["msg-time"], PENDING),
+    ([" Sent "], ["msg-check"], SENT),
+    ([" Delivered "], ["msg-dblcheck"], DELIVERED),
+    ([" Read "], ["msg-dblcheck-ack"], READ),
+    ([], ["msg-dblcheck-ack"], READ),
+    ([" Sent "], ["msg-error"], FAILED),
+])
+def test_state_of_the_status_of_a_message(labels, icons, state):
+    assert state_of(labels, icons) == state
+
+
+def test_other_labels_containing_a_status_dont_count():
+    # a chat row with an unread badge and a message still sent
+    assert state_of(["3 unread messages", "presentation", " Sent "], ["msg-check", "alert-notification"]) == SENT
+    assert state_of(["Unread", "Present"], []) is None
+
+
+def test_reached():
+    assert reached(DELIVERED, SENT)
+    assert not reached(PENDING, SENT)
+    assert reached(FAILED, READ)
+    assert not reached(None, SENT)
+
+
+class PollingTracker(DeliveryTracker):
+    def __init__(self, states) -> None:
+        super().__init__(deadline=0)
+        self.states = states
+
+    def poll(self, ids, timeout, state=None, forget=()):
+        return {delivery_id: self.states[delivery_id] for delivery_id in ids}
+
+
+def test_a_pending_message_not_found_anymore_settles_as_unconfirmed():
+    tracker = PollingTracker({
+        "1": {"state": PENDING, "transitions": [], "found": False},
+        "2": {"state": PENDING, "transitions": [], "found": True},
+        "3": {"state": SENT, "transitions": [], "found": False},
+    })
+    reconciler = DeliveryReconciler(tracker, max_unconfirmed=5)
+    settled = []
+    for delivery_id in ("1", "2", "3"):
+        settled += reconciler.add({"id": delivery_id}, delivery_id)
+    statuses = {job["id"]: job["status"] for job in settled + reconciler.drain()}
+    assert statuses == {"1": UNCONFIRMED_STATUS, "2": "Pending", "3": "Sent"}
+
+
+@pytest.mark.parametrize("contact_names", [{}, {"919000000001": "Alice"}])
+def test_a_message_is_followed_in_the_chat_list_after_leaving_its_chat(contact_names):
+    server = StandInServer(pending_secs=0.2, delivered_secs=0.5, contact_names=contact_names)
+    url = server.start()
+    try:
+        driver = StandInDriver(url)
+        driver.get(f"{url}/send?phone=919000000001&text=hi")
+        tracker = DeliveryTracker(driver, wait_state=DELIVERED, deadline=5)
+        reconciler = DeliveryReconciler(tracker, max_unconfirmed=5)
+        delivery_id = tracker.arm("+919000000001")
+        assert driver.click((By.XPATH, "//div[@id='main']//footer//button[@aria-label='Send']"), 2)["clicked"]
+        # the next chat is opened before the message is delivered
+        settled = reconciler.add({"row": 1}, delivery_id)
+        assert driver.execute_script(OPEN_CHAT_SCRIPT, f"{url}/send?phone=919000000002&text=hi")
+        settled += reconciler.drain()
+    finally:
+        server.stop()
+    assert [job["status"] for job in settled] == ["Delivered"]
@@ -0,0 +1,44 @@
+import pytest
+from selenium.webdriver.common.by import By
+from drivers import StandInDriver, CLICK_SCRIPT
+from standin import StandInServer
+
+
+@pytest.fixture
+def stand_in():
+    server = StandInServer()
+    url = server.start()
+    yield server, url
+    server.stop()
+
+
+class RecordingDriver(StandInDriver):
+    def __init__(self, base_url) -> None:
+        super().__init__(base_url)
+        self.scripts = []
+
+    def execute_async_script(self, script, *args):
+        self.scripts.append(script)
+        return super().execute_async_script(script, *args)
+
+
+def test_stand_in_clicks_through_the_click_script(stand_in):
+    server, url = stand_in
+    driver = RecordingDriver(url)
+    driver.get(f"{url}/send?phone=919000000001&text=hi")
+
+    result = driver.click((By.XPATH, "//div[@id='main']//button[@aria-label='Send']"), 2)
+
+    assert driver.scripts == [CLICK_SCRIPT]
+    assert result["ok"] and result["clicked"]
+    assert server.stats["sent"] == 1
+
+
+def test_stand_in_click_reports_a_missing_element(stand_in):
+    _, url = stand_in
+    driver = StandInDriver(url)
+    driver.get(f"{url}/send?phone=919000000001&text=hi")
+
+    result = driver.click((By.XPATH, "//div[@aria-label='Nowhere']"), 0.2)
+
+    assert not result["ok"] and not result["found"] and not result["clicked"]
@@ -0,0 +1,16 @@
+from PIL import Image
+from utils import ImagePayloadCache
+
+
+def test_get_waits_for_the_prefetch_of_the_image(tmp_path):
+    image_path = tmp_path / "image.png"
+    Image.new("RGB", (1500, 1500), "red").save(image_path)
+    cache = ImagePayloadCache(size=2)
+
+    cache.prefetch(image_path)
+    data = cache.get(image_path)
+
+    # encoded once, by the prefetch
+    assert cache.misses == 1 and cache.hits == 1
+    assert len(data) > 0
+    assert cache.loading == {}
@@ -0,0 +1,45 @@
+from ledger import SendLedger
+from delivery import IN_FLIGHT_STATUS, UNCONFIRMED_STATUS
+
+
+def test_rows_sent_are_kept_across_runs(tmp_path):
+    path = tmp_path / "ledger.jsonl"
+    key = SendLedger.make_key("contacts.xlsx", "Sheet1", 0, "+919000000001", "Hi")
+    ledger = SendLedger(path)
+    ledger.record(key, "Sent")
+    ledger.close()
+
+    ledger = SendLedger(path)
+    assert ledger.sent_status(key) == "Sent"
+    # the same message to the same number in another row
+    other = SendLedger.make_key("leads.csv", "leads", 5, "+919000000001", "Hi")
+    assert ledger.sent_status(other) == "Already Sent"
+    assert ledger.sent_status(SendLedger.make_key("leads.csv", "leads", 5, "+919000000001", "Hello")) is None
+    ledger.close()
+
+
+def test_a_row_in_flight_is_kept_until_it_settles(tmp_path):
+    key = SendLedger.make_key("contacts.xlsx", "Sheet1", 0, "+919000000001", "Hi")
+    ledger = SendLedger(tmp_path / "ledger.jsonl")
+    ledger.record(key, IN_FLIGHT_STATUS)
+    assert ledger.sent_status(key) == IN_FLIGHT_STATUS
+    ledger.record(key, UNCONFIRMED_STATUS)
+    assert ledger.sent_status(key) is None
+    assert len(ledger.sent) == 0
+    ledger.close()
+
+
+def test_a_line_cut_short_is_skipped(tmp_path):
+    path = tmp_path / "ledger.jsonl"
+    key = SendLedger.make_key("contacts.xlsx", "Sheet1", 0, "+919000000001", "Hi")
+    ledger = SendLedger(path)
+    ledger.record(key, "Delivered")
+    ledger.close()
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"file": "contacts.xlsx", "sheet": "Sh')
+
+    ledger = SendLedger(path)
+    assert ledger.sent_status(key) == "Delivered"
+    ledger.record(SendLedger.make_key("contacts.xlsx", "Sheet1", 1, "+919000000002", "Hi"), "Sent")
+    ledger.close()
+    assert len(SendLedger(path).statuses) == 2
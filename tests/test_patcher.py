@@ -0,0 +1,17 @@
+import patcher
+from patcher import Patcher
+
+
+def test_patch_exe_replaces_every_copy_of_the_injected_block(tmp_path, monkeypatch):
+    monkeypatch.setattr(patcher, "MANIFEST_FILE", tmp_path / "driver_manifest.json")
+    block = b"{window.cdc_adoQpoasnfa76pfcZLmcfl_Array = window.Array || Array;}"
+    path = tmp_path / "chromedriver"
+    path.write_bytes(b"\x00head" + block + b"\x00middle\x00" + block + b"\x00tail")
+
+    Patcher(executable_path=str(path)).patch_exe()
+
+    content = path.read_bytes()
+    assert b"cdc_" not in content
+    assert content.count(b'{console.log("undetected chromedriver 1337!")}') == 2
+    assert len(content) == len(block) * 2 + len(b"\x00head\x00middle\x00\x00tail")
+    assert patcher.manifest_entry(path)["patched"]
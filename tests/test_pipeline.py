@@ -0,0 +1,104 @@
+import threading
+import pytest
+from pipeline import SendPipeline
+from dedup import DiskDedupIndex
+
+
+def test_run_sends_and_writes_every_row():
+    written = []
+    pipeline = SendPipeline(depth=1)
+    errors = pipeline.run(
+        iter(range(5)),
+        lambda row: {"row": row, "status": "Invalid Number" if row==2 else None},
+        lambda job: dict(job, status="Sent"),
+        written.append,
+    )
+    assert errors == []
+    assert sorted(job["row"] for job in written) == [0, 1, 2, 3, 4]
+
+
+def test_run_stops_when_send_raises():
+    def send(job):
+        raise RuntimeError("browser died")
+
+    raised = []
+
+    def run():
+        try:
+            SendPipeline(depth=1).run(iter(range(100)), lambda row: {"row": row}, send, lambda job: None)
+        except RuntimeError as e:
+            raised.append(e)
+
+    # the preparer waits for room in the bounded ready queue when send raises
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    assert len(raised) == 1
+
+
+def test_run_raises_the_error_of_the_rows_after_sending_the_rows_before_it():
+    def rows():
+        yield 0
+        yield 1
+        raise ValueError("validation failed")
+
+    written = []
+    with pytest.raises(ValueError):
+        SendPipeline(depth=1).run(rows(), lambda row: {"row": row}, lambda job: dict(job, status="Sent"), written.append)
+    assert sorted(job["row"] for job in written) == [0, 1]
+
+
+def test_rows_validated_against_the_disk_dedup_index_on_the_preparer_thread(tmp_path):
+    index = DiskDedupIndex(tmp_path / "dedup.sqlite3")
+    sheet_id = index.register("contacts.csv", "contacts")
+    index.add_many(sheet_id, [("+919000000001", 0), ("+919000000002", 1)])
+
+    def rows():
+        for number in ("+919000000001", "+919000000002"):
+            yield index.first(number)
+
+    written = []
+    errors = SendPipeline().run(rows(), lambda first: {"first": first}, lambda job: job, written.append)
+    index.close()
+    assert errors == []
+    assert sorted(job["first"][2] for job in written) == [0, 1]
+
+
+def test_rows_which_cant_be_prepared_are_returned_and_the_others_sent():
+    def prepare(row):
+        if row==1:
+            raise ValueError("no message")
+        return {"row": row}
+
+    written = []
+    errors = SendPipeline(depth=1).run(iter(range(4)), prepare, lambda job: dict(job, status="Sent"), written.append)
+    assert errors == [1]
+    assert sorted(job["row"] for job in written) == [0, 2, 3]
+
+
+def test_a_failed_write_doesnt_stop_the_others():
+    written = []
+
+    def write(job):
+        if job["row"]==0:
+            raise OSError("disk full")
+        written.append(job)
+
+    SendPipeline().run(iter(range(3)), lambda row: {"row": row}, lambda job: dict(job, status="Sent"), write)
+    assert sorted(job["row"] for job in written) == [1, 2]
+
+
+def test_rows_handed_back_later_are_written_once_flushed():
+    held = []
+
+    def send(job):
+        # confirmed by the next send, like the messages in flight
+        settled, held[:] = list(held), [dict(job, status="Sent")]
+        return settled
+
+    written = []
+    pipeline = SendPipeline()
+    pipeline.run(iter(range(3)), lambda row: {"row": row}, send, written.append, flush=lambda: held)
+    assert [job["row"] for job in written] == [0, 1, 2]
+    assert pipeline.stats()["send"]["count"] == 3
@@ -0,0 +1,21 @@
+from selenium.webdriver.common.by import By
+from drivers import StandInDriver
+from readiness import Readiness
+from standin import StandInServer
+
+
+def test_waits_for_the_elements_of_the_page():
+    server = StandInServer()
+    url = server.start()
+    try:
+        driver = StandInDriver(url)
+        driver.get(f"{url}/send?phone=919000000001&text=hi")
+        readiness = Readiness(driver, deadlines={"missing": 0.2})
+        assert readiness.wait("send_button", (By.XPATH, "//div[@id='main']//footer//button[@aria-label='Send']"))
+        assert not readiness.wait("missing", (By.XPATH, "//div[@aria-label='Nowhere']"))
+        assert readiness.wait("missing", (By.XPATH, "//div[@aria-label='Nowhere']"), present=False)
+    finally:
+        server.stop()
+    assert readiness.timings["send_button"].count == 1
+    assert readiness.timings["missing"].count == 2
+    assert readiness.timings["missing"].max >= 0.2
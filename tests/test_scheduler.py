@@ -0,0 +1,35 @@
+from datetime import datetime
+from scheduler import SendWindows, AdaptiveRateLimiter
+
+
+def test_send_windows_crossing_midnight():
+    windows = SendWindows("09:00-13:00,22:00-02:00")
+    assert windows.is_open(datetime(2024, 1, 1, 10, 0))
+    assert windows.is_open(datetime(2024, 1, 1, 23, 30))
+    assert windows.is_open(datetime(2024, 1, 2, 1, 59))
+    assert not windows.is_open(datetime(2024, 1, 1, 13, 0))
+    assert windows.seconds_until_open(datetime(2024, 1, 1, 21, 0)) == 3600
+    assert windows.seconds_until_open(datetime(2024, 1, 1, 10, 0)) == 0
+
+
+def test_no_send_windows_is_always_open():
+    assert SendWindows("").is_open(datetime(2024, 1, 1, 3, 0))
+
+
+def test_rate_is_halved_when_the_sends_fail_and_raised_when_they_succeed():
+    limiter = AdaptiveRateLimiter(rate=20, min_rate=5, max_rate=30, jitter=0, windows=SendWindows(""),
+                                  target_latency=10, max_failure_rate=0.2, sample_size=5, rate_step=1)
+    limiter.observe(1, "Sent")
+    assert limiter.rate == 21
+    for _ in range(4):
+        limiter.observe(1, "Fail")
+    assert limiter.rate == 10.5
+    assert limiter.slowdowns == 1
+
+
+def test_rate_is_halved_when_the_sends_get_slow():
+    limiter = AdaptiveRateLimiter(rate=20, min_rate=5, max_rate=30, jitter=0, windows=SendWindows(""),
+                                  target_latency=2, max_failure_rate=0.5, sample_size=5, rate_step=0)
+    for _ in range(5):
+        limiter.observe(3, "Sent")
+    assert limiter.rate == 10
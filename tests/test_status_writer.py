@@ -0,0 +1,88 @@
+import sqlite3
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Font
+from contacts import XlsxContactSource, SqliteContactSource, StatusWriter
+from settings import CONTACT_NUMBER_COLUMN_NAME, STATUS_COLUMN_NAME
+
+
+def make_workbook(path, rows):
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Sheet1"
+    ws.append([CONTACT_NUMBER_COLUMN_NAME, STATUS_COLUMN_NAME])
+    for i in range(rows):
+        ws.append([9000000000 + i, None])
+    ws["A2"].font = Font(bold=True)
+    ws["A2"].number_format = "0"
+    wb.save(path)
+
+
+def test_statuses_are_written_at_the_interval_and_at_the_end(tmp_path):
+    path = tmp_path / "contacts.xlsx"
+    make_workbook(path, 3)
+    writer = StatusWriter(XlsxContactSource(path), interval=3600)
+    writer.confirmed = True
+    writer.update("Sheet1", 0, "Sent")
+    writer.flush()
+    assert load_workbook(path)["Sheet1"]["B2"].value is None
+
+    writer.update("Sheet1", 2, "Fail")
+    writer.flush(final=True)
+    ws = load_workbook(path)["Sheet1"]
+    assert [ws["B2"].value, ws["B3"].value, ws["B4"].value] == ["Sent", None, "Fail"]
+    # the styles of the workbook are kept
+    assert ws["A2"].font.bold
+    assert ws["A2"].number_format == "0"
+
+
+def test_statuses_are_written_in_the_background(tmp_path):
+    path = tmp_path / "contacts.xlsx"
+    make_workbook(path, 2)
+    source = XlsxContactSource(path)
+    writer = StatusWriter(source, interval=0)
+    writer.confirmed = True
+    writer.update("Sheet1", 1, "Delivered")
+    writer.flush()
+    writer.thread.join()
+    # kept aside while sending, the workbook is rewritten once at the end
+    assert source.read_statuses() == {"Sheet1": {1: "Delivered"}}
+    assert load_workbook(path)["Sheet1"]["B3"].value is None
+    writer.flush(final=True)
+    assert load_workbook(path)["Sheet1"]["B3"].value == "Delivered"
+    assert not source.statuses_path.exists()
+
+
+def test_sqlite_statuses_are_written_in_the_background(tmp_path):
+    path = tmp_path / "contacts.db"
+    connection = sqlite3.connect(str(path))
+    connection.execute(f'CREATE TABLE leads ("{CONTACT_NUMBER_COLUMN_NAME}" TEXT, "{STATUS_COLUMN_NAME}" TEXT)')
+    connection.executemany("INSERT INTO leads VALUES (?, NULL)", [("9000000001",), ("9000000002",)])
+    connection.commit()
+    connection.close()
+    source = SqliteContactSource(path)
+    writer = StatusWriter(source, interval=0)
+    writer.confirmed = True
+    for idx, _ in source.rows("leads"):
+        writer.update("leads", idx, "Sent")
+    writer.flush()
+    writer.thread.join()
+    assert writer.pending == {}
+    assert source.execute(f'SELECT "{STATUS_COLUMN_NAME}" FROM leads') == [("Sent",), ("Sent",)]
+    source.close()
+
+
+class FailingSource:
+    name = "failing.csv"
+
+    def write_statuses(self, statuses):
+        raise ValueError("can't write")
+
+
+def test_statuses_of_a_failed_write_are_kept_for_the_next_one():
+    writer = StatusWriter(FailingSource(), interval=0)
+    writer.confirmed = True
+    writer.update("Sheet1", 0, "Sent")
+    writer.flush()
+    writer.thread.join()
+    writer.update("Sheet1", 1, "Fail")
+    assert writer.pending == {"Sheet1": {0: "Sent", 1: "Fail"}}
@@ -0,0 +1,25 @@
+import pandas as pd
+import pytest
+from validation import normalize_contact_numbers
+
+
+def normalize(numbers, national_number_length):
+    normalized, reasons = normalize_contact_numbers(pd.Series(numbers, dtype=object), "91", national_number_length)
+    return normalized.tolist(), reasons.tolist()
+
+
+def test_local_numbers_starting_with_the_country_code_get_it():
+    normalized, _ = normalize(["9123456789", "919876543210", "+14155550100", "09876543210"], 10)
+    assert normalized == ["+919123456789", "+919876543210", "+14155550100", "+919876543210"]
+
+
+def test_short_numbers_are_invalid():
+    normalized, reasons = normalize(["1234567", "911234567"], 10)
+    assert normalized[0] is pd.NA and normalized[1] is pd.NA
+    assert reasons == ["invalid length", "invalid length"]
+
+
+@pytest.mark.parametrize("national_number_length", [0, -1])
+def test_national_number_length_is_required(national_number_length):
+    with pytest.raises(ValueError):
+        normalize(["9123456789"], national_number_length)
@@ -1,13 +1,26 @@
 import math
+import threading
+from collections import OrderedDict
+from itertools import islice
 from io import BytesIO
-import win32clipboard
 from PIL import Image
 from settings import *
+from batch import batch_plan
+try:
+    import win32clipboard
+except ImportError:
+    # the clipboard is only used on windows, images are attached through the page elsewhere
+    win32clipboard = None
 
-def confirmation_input(ask_str, ask_type):
+def confirmation_input(ask_str, ask_type, key=None, subject=None):
+    """In batch mode the answer of the prompt's key is taken from the run plan instead"""
     if ask_type not in ['Y/n', 'y/N', 'N/y', 'n/Y']:
         ask_type = 'Y/n'
     ask_str = f"{ask_str} [{ask_type}]: "
+    if batch_plan.enabled:
+        answer = batch_plan.answer(key, subject)
+        print(f"{ask_str}{'y' if answer else 'n'} (batch)")
+        return answer
     while True:
         ask_value = input(ask_str).lower()
         if not ask_value in [''] + TRUTHY + FALSY:
@@ -30,11 +43,13 @@ def roundoff(val):
         val = round(val)
     return val
 
-def chunker(seq, size):
-    if size<=0:
-        size = len(seq)
-    for pos in range(0, len(seq), size):
-        yield seq.iloc[pos:pos + size] 
+def chunker(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size)) if size>0 else list(iterator)
+        if len(chunk)==0:
+            break
+        yield chunk
 
 
 def send_to_clipboard(clip_type, data):
@@ -43,14 +58,89 @@ def send_to_clipboard(clip_type, data):
     win32clipboard.SetClipboardData(clip_type, data)
     win32clipboard.CloseClipboard()
 
-def send_image_to_clipboard(image_dir, image_name):
-    image_path = image_dir / image_name
-    if image_path.exists():
+class ImagePayloadCache:
+    """Bounded LRU of images encoded for the clipboard, keyed by path and mtime so edited images are encoded again"""
+    def __init__(self, size=IMAGE_CACHE_SIZE) -> None:
+        self.size = size
+        self.payloads = OrderedDict()
+        self.lock = threading.Lock()
+        # {key: event set once the prefetch encoding it is done}
+        self.loading = {}
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, image_path):
+        return (str(image_path.absolute()), image_path.stat().st_mtime_ns)
+
+    def cached(self, key):
+        with self.lock:
+            if key in self.payloads:
+                self.payloads.move_to_end(key)
+                self.hits += 1
+                return self.payloads[key]
+        return None
+
+    def get(self, image_path):
+        key = self.key(image_path)
+        data = self.cached(key)
+        if data is not None:
+            return data
+        with self.lock:
+            loading = self.loading.get(key)
+        if loading is not None:
+            # the prefetch of the image is waited for rather than encoding it twice
+            loading.wait()
+            data = self.cached(key)
+            if data is not None:
+                return data
+        return self.encode(image_path, key)
+
+    def encode(self, image_path, key):
         image = Image.open(image_path)
         output = BytesIO()
         image.convert("RGB").save(output, "BMP")
+        # the clipboard takes a DIB, the BMP without its 14 bytes file header
         data = output.getvalue()[14:]
         output.close()
-        send_to_clipboard(win32clipboard.CF_DIB, data)
+        with self.lock:
+            self.misses += 1
+            self.payloads[key] = data
+            while len(self.payloads)>self.size:
+                self.payloads.popitem(last=False)
+        return data
+
+    def prefetch(self, image_path):
+        """Encodes the image in the background so it's ready when it's needed, unless it's cached or being encoded already"""
+        if not image_path.exists():
+            return
+        key = self.key(image_path)
+        with self.lock:
+            if key in self.payloads or key in self.loading:
+                return
+            self.loading[key] = threading.Event()
+        threading.Thread(target=self._prefetch, args=(image_path, key), daemon=True).start()
+
+    def _prefetch(self, image_path, key):
+        try:
+            self.encode(image_path, key)
+        except Exception as e:
+            print("ImagePayloadCache.prefetch Error: ", e)
+        finally:
+            with self.lock:
+                self.loading.pop(key).set()
+
+    def report(self):
+        print(f"Image cache: {self.hits} hits, {self.misses} misses, {len(self.payloads)}/{self.size} cached")
+
+
+image_payload_cache = ImagePayloadCache()
+
+def is_clipboard_supported():
+    return win32clipboard is not None
+
+def send_image_to_clipboard(image_dir, image_name):
+    image_path = image_dir / image_name
+    if image_path.exists():
+        send_to_clipboard(win32clipboard.CF_DIB, image_payload_cache.get(image_path))
         return True
     return False
@@ -0,0 +1,124 @@
+import csv
+import numpy as np
+import pandas as pd
+from settings import *
+
+
+INVALID_NUMBER_STATUS = "Invalid Number"
+DUPLICATE_STATUS = "Duplicate"
+
+# E.164 numbers have at most 15 digits including the country code
+MIN_NUMBER_DIGITS = 8
+MAX_NUMBER_DIGITS = 15
+
+
+def normalize_contact_numbers(numbers, country_code=COUNTRY_CODE, national_number_length=NATIONAL_NUMBER_LENGTH):
+    """
+    Normalizes a series of contact numbers to +<country code><number> all at once.
+    Returns the normalized numbers and the reason each invalid number was rejected, <NA> for the valid ones.
+    """
+    if national_number_length<=0:
+        # a local number starting with the digits of the country code can't be told from a number with it
+        raise ValueError("national_number_length isn't set in settings.config")
+    s = numbers.astype("string").str.strip()
+    # numbers read from a float column, 9876543210.0
+    s = s.str.replace(r"\.0+$", "", regex=True)
+    s = s.str.replace(r"[\s\-().]", "", regex=True)
+    s = s.str.replace(r"^00", "+", regex=True)
+    empty = (s.isna() | (s=="")).fillna(True).to_numpy(dtype=bool)
+    has_plus = s.str.startswith("+").fillna(False).to_numpy(dtype=bool)
+    digits = s.str.replace(r"^\+", "", regex=True)
+    valid_chars = digits.str.fullmatch(r"\d+").fillna(False).to_numpy(dtype=bool)
+    # the trunk prefix of local numbers, 09876543210
+    national = digits.str.replace(r"^0+", "", regex=True)
+    national_length = national.str.len().fillna(0).to_numpy(dtype=int)
+    starts_with_cc = national.str.startswith(country_code).fillna(False).to_numpy(dtype=bool)
+
+    is_local = ~has_plus & (national_length==national_number_length)
+    is_with_cc = ~has_plus & ~is_local & starts_with_cc & (national_length==len(country_code)+national_number_length)
+    normalized = np.where(
+        has_plus, "+" + digits.fillna(""),
+        np.where(is_local, f"+{country_code}" + national.fillna(""), "+" + national.fillna(""))
+    )
+    normalized = pd.Series(normalized, index=numbers.index, dtype="string")
+    total_digits = normalized.str.len().to_numpy(dtype=int) - 1
+    valid_length = (total_digits>=MIN_NUMBER_DIGITS) & (total_digits<=MAX_NUMBER_DIGITS) & (has_plus | is_local | is_with_cc)
+    own_country = normalized.str.startswith(f"+{country_code}").to_numpy(dtype=bool)
+    valid_length &= ~own_country | (total_digits==len(country_code)+national_number_length)
+
+    reasons = np.select(
+        [empty, ~valid_chars, ~valid_length],
+        ["empty", "invalid characters", "invalid length"],
+        default=""
+    )
+    reasons = pd.Series(reasons, index=numbers.index, dtype="string").replace("", pd.NA)
+    normalized[reasons.notna()] = pd.NA
+    return normalized, reasons
+
+
+class ContactValidator:
+    """
+    Validates the contacts of a source chunk by chunk before they are sent,
+    the rejected rows are written to a csv report next to the other reports.
+    """
+    def __init__(self, source_name, dedup_index=None) -> None:
+        self.source_name = source_name
+        self.dedup_index = dedup_index
+        REPORTS_DIR.mkdir(parents=True, exist_ok=True)
+        self.report_path = REPORTS_DIR / f"{source_name}.validation.csv"
+        self.fh = open(self.report_path, "w", encoding="utf-8", newline="")
+        self.writer = csv.writer(self.fh)
+        self.writer.writerow(["sheet", "row", "contact_number", "normalized_number", "reason"])
+        self.seen = {}
+        self.counts = {"valid": 0, INVALID_NUMBER_STATUS: 0, DUPLICATE_STATUS: 0}
+
+    def validate(self, sheet, chunk):
+        """
+        Returns (idx, row, normalized contact number, status) of the rows of the chunk,
+        the status is None for the rows to send. The rows without a contact number are left out.
+        """
+        if len(chunk)==0:
+            return []
+        numbers = pd.Series([r.get(CONTACT_NUMBER_COLUMN_NAME) for _, r in chunk], dtype=object)
+        normalized, reasons = normalize_contact_numbers(numbers)
+        normalized = normalized.tolist()
+        reasons = reasons.astype(object).where(reasons.notna(), None).tolist()
+        validated = []
+        for i, (idx, r) in enumerate(chunk):
+            reason = reasons[i]
+            if reason=="empty":
+                continue
+            if reason is None:
+                contact_number = normalized[i]
+                first = self.first_row(contact_number, sheet, idx)
+                if first==(self.source_name, sheet, idx):
+                    self.counts["valid"] += 1
+                    validated.append((idx, r, contact_number, None))
+                    continue
+                reason = f"duplicate of row {first[2]} of sheet '{first[1]}' of '{first[0]}'"
+                status = DUPLICATE_STATUS
+            else:
+                contact_number = None
+                status = INVALID_NUMBER_STATUS
+            self.counts[status] += 1
+            self.writer.writerow([sheet, idx, chunk[i][1].get(CONTACT_NUMBER_COLUMN_NAME), contact_number, reason])
+            validated.append((idx, r, contact_number, status))
+        self.fh.flush()
+        return validated
+
+    def first_row(self, contact_number, sheet, idx):
+        """(file, sheet, idx) of the first row with the contact number, of all the files if there's a dedup index"""
+        if self.dedup_index is not None:
+            first = self.dedup_index.first(contact_number)
+            if first is not None:
+                return tuple(first)
+        return self.seen.setdefault(contact_number, (self.source_name, sheet, idx))
+
+    def close(self):
+        if not self.fh.closed:
+            self.fh.close()
+        print(f"""Validation of contacts:
+                          Valid: {self.counts["valid"]}
+                          Invalid: {self.counts[INVALID_NUMBER_STATUS]}
+                          Duplicates: {self.counts[DUPLICATE_STATUS]}
+                          Report: {self.report_path}""")